@@ -2,7 +2,7 @@
 """Print accl readings to the console in order to test it out.
 
 This is NOT production code, but instead a quick way to test the sensors.
-This also acts as a demo of sorts for the custom handler feature of capture.py.
+This also acts as a demo of sorts for the custom handler feature of capture.py (see capture_blocks).
 
 Modify the variable CHOSEN_ID to choose the sensor you would like to test.
 """
@@ -37,13 +37,16 @@ def main():
     con.flush()
 
     # Have frames delivered to show_accl.
-    capture.capture_frames(con, show_accl)
+    capture.capture_blocks(con, show_accl)
 
 
-def show_accl(frame, frame_count, config):
+def show_accl(block, _frame_count, config):
     # Skip all frames that are not from the sensor that we want.
-    if frame.flag.sensor != CHOSEN_ID:
+    block = block.of_sensor(CHOSEN_ID)
+    if not len(block):
         return True
+    # The console can't keep up with every frame anyway, so we just show the newest one of the block.
+    frame = block[-1]
 
     # Scale and calibrate the readings.
     if CHOSEN_ID == TONGUE_SENSOR_ID:
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""A compressed format for keeping captures for the long term, with random access by time.
+
+The csv files in 'raw/' are large (a frame of text is about 80 bytes), and an hour-long capture is hundreds of megabytes.
+An archive holds the same frames in binary, split into chunks of CHUNK_FRAME_COUNT frames
+that are each compressed on their own (with zlib or lzma), along with an index of the time range of every chunk.
+To read a range of time we only decompress the chunks that overlap it, never the whole capture.
+
+An archive file looks like this:
+
+    MAGIC
+    header length (4 bytes), then the header: utf-8 json with the columns, compression, and capture information
+    the compressed chunks, one after another
+    the index: one INDEX_ENTRY_FORMAT entry per chunk
+    the footer: FOOTER_FORMAT, which tells where the index starts and how many entries it has, then MAGIC again
+
+Within a chunk, the columns are stored one after another rather than frame by frame,
+since similar values next to each other compress much better. Times are unwrapped (see process.unwrap_time)
+and stored as 64 bit integers. The readings were already calibrated and scaled when they were captured,
+and we store them as 32 bit floats, which is more than enough for values that came from 16 bit integers.
+
+Run this file directly to archive every capture that is not archived yet, using every core of the machine.
+Give 'lzma' as the first command line argument for smaller (but slower) archives, the default is zlib.
+The csv files are left where they are, unless '--drop-csv' is given: then the tongue.csv and throat.csv of every archived
+capture are deleted, but only once its archive was read back and found to hold exactly what they hold (see drop_csv_files).
+Everything that reads a capture falls back to its archive when its csv files are gone (see process._read_sensor_chunks).
+"""
+
+__author__ = 'Joseph Rubin'
+
+import json
+import lzma
+import os
+import struct
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from util import *
+import catalog
+
+# The archive of capture 13 is 'archive/capture00013.elijah'.
+ARCHIVE_EXTENSION = '.elijah'
+
+# Marks the start and the end of an archive file.
+MAGIC = b'ELIJAHA1'
+
+# How many frames of a sensor go in a chunk. Smaller chunks mean less to decompress for a small range of time,
+# but compress a little worse. At the FAST capture rate this is about 5 seconds of data.
+CHUNK_FRAME_COUNT = 4096
+
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_LZMA = 'lzma'
+_COMPRESSORS = {
+    COMPRESSION_ZLIB: (lambda data: zlib.compress(data, 9), zlib.decompress),
+    COMPRESSION_LZMA: (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+
+# The columns of a sensor that we keep, and how they are stored.
+COLUMNS = ('time', 'gyroX', 'gyroY', 'gyroZ', 'acclX', 'acclY', 'acclZ', 'button')
+COLUMN_TYPES = {'time': np.int64, 'button': np.uint8}
+DEFAULT_COLUMN_TYPE = np.float32
+
+SENSOR_NAMES = ('tongue', 'throat')
+
+# Per chunk:          sensor, first time, last time, frame count, offset, compressed length
+INDEX_ENTRY_FORMAT = '<BqqIQI'
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+#                     index offset, index entry count
+FOOTER_FORMAT = '<QI'
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT) + len(MAGIC)
+
+
+def get_archive_filename(capture_number: int):
+    """Return the filename of the archive of a capture."""
+    return catalog.ARCHIVE_DIRECTORY_ROOT + get_capture_subdirectory(capture_number).rstrip('/') + ARCHIVE_EXTENSION
+
+
+def archive_capture(capture_number: int, compression: str=COMPRESSION_ZLIB, chunk_frame_count: int=CHUNK_FRAME_COUNT):
+    """Write the archive of a capture from its raw csv files. Return the size of the csv files and of the archive.
+
+    The archive is written to a temporary file first, so a half-written archive is never mistaken for a whole one.
+    """
+    # We don't need pandas (or process) unless we are archiving, and the workers of main each import them on their own.
+    import pandas as pd
+    from process import unwrap_time
+
+    compress = _COMPRESSORS[compression][0]
+    input_path = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    output_filename = get_archive_filename(capture_number)
+    os.makedirs(catalog.ARCHIVE_DIRECTORY_ROOT, exist_ok=True)
+
+    row = catalog.get_capture(capture_number)
+    header = {
+        'capture_number': capture_number,
+        'columns': COLUMNS,
+        'compression': compression,
+        'title': row['title'] if row is not None else None,
+        'capture_rate': row['capture_rate'] if row is not None else None,
+        'gyro_scale': row['gyro_scale'] if row is not None else None,
+        'accl_scale': row['accl_scale'] if row is not None else None,
+    }
+
+    csv_size = 0
+    index = []
+    with open(output_filename + '.tmp', 'wb') as output_file:
+        header_bytes = json.dumps(header).encode('utf-8')
+        output_file.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+
+        for sensor_id, sensor_name in enumerate(SENSOR_NAMES):
+            input_filename = input_path + sensor_name + '.csv'
+            csv_size += os.path.getsize(input_filename)
+            input_reader = pd.read_csv(input_filename, delimiter=',')
+            columns = [input_reader[column].values.astype(COLUMN_TYPES.get(column, DEFAULT_COLUMN_TYPE))
+                       for column in COLUMNS]
+            columns[0] = unwrap_time(columns[0])
+
+            for start in range(0, len(columns[0]), chunk_frame_count):
+                chunk = [column[start:start + chunk_frame_count] for column in columns]
+                data = compress(b''.join(column.tobytes() for column in chunk))
+                index.append((sensor_id, chunk[0][0], chunk[0][-1], len(chunk[0]), output_file.tell(), len(data)))
+                output_file.write(data)
+
+        index_offset = output_file.tell()
+        for entry in index:
+            output_file.write(struct.pack(INDEX_ENTRY_FORMAT, *entry))
+        output_file.write(struct.pack(FOOTER_FORMAT, index_offset, len(index)) + MAGIC)
+
+    os.replace(output_filename + '.tmp', output_filename)
+    return csv_size, os.path.getsize(output_filename)
+
+
+def verify_archive(capture_number: int):
+    """Return whether the archive of a capture holds exactly the frames of its raw csv files (as archive_capture stores them)."""
+    import pandas as pd
+    from process import unwrap_time
+
+    input_path = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    with ArchiveReader(get_archive_filename(capture_number)) as reader:
+        if tuple(reader.columns) != COLUMNS:
+            return False
+        for sensor_name in SENSOR_NAMES:
+            input_reader = pd.read_csv(input_path + sensor_name + '.csv', delimiter=',')
+            expected = {column: input_reader[column].values.astype(COLUMN_TYPES.get(column, DEFAULT_COLUMN_TYPE))
+                        for column in COLUMNS}
+            expected['time'] = unwrap_time(expected['time'])
+
+            position = 0
+            for chunk in reader.iter_chunks(sensor_name):
+                length = len(chunk['time'])
+                if not all(np.array_equal(chunk[column], expected[column][position:position + length]) for column in COLUMNS):
+                    return False
+                position += length
+            if position != len(input_reader):
+                return False
+    return True
+
+
+def drop_csv_files(capture_number: int):
+    """Delete the raw csv files of a capture that its archive holds, once verify_archive says that the archive is good.
+
+    The time indexes of the csv files (see query.py) are deleted with them. Return the number of bytes that were freed,
+    or raise ValueError if the archive doesn't match the csv files (then nothing is deleted).
+    """
+    if not verify_archive(capture_number):
+        raise ValueError('the archive does not match the csv files')
+
+    # We don't import query at the top, since it isn't needed unless we drop the csv files.
+    from query import get_time_index_filename
+    freed_size = 0
+    for sensor_name in SENSOR_NAMES:
+        input_filename = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + sensor_name + '.csv'
+        freed_size += os.path.getsize(input_filename)
+        os.remove(input_filename)
+        try:
+            os.remove(get_time_index_filename(capture_number, sensor_name))
+        except FileNotFoundError:
+            pass
+    return freed_size
+
+
+def has_csv_files(capture_number: int):
+    """Return whether the raw csv files of a capture (the ones that its archive holds) are still there."""
+    input_path = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    return all(os.path.isfile(input_path + sensor_name + '.csv') for sensor_name in SENSOR_NAMES)
+
+
+class ArchiveReader(object):
+    """Reads ranges of time out of an archive.
+
+        with ArchiveReader(archive.get_archive_filename(13)) as reader:
+            data = reader.read_range('tongue', 1000, 5000)
+            print(data['time'], data['gyroX'])
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            if self.file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(filename + ' is not an archive.')
+            header_length, = struct.unpack('<I', self.file.read(4))
+            self.header = json.loads(self.file.read(header_length).decode('utf-8'))
+            self.columns = tuple(self.header['columns'])
+            self.decompress = _COMPRESSORS[self.header['compression']][1]
+
+            self.file.seek(-FOOTER_SIZE, os.SEEK_END)
+            footer = self.file.read(FOOTER_SIZE)
+            if footer[-len(MAGIC):] != MAGIC:
+                # The archive was never finished.
+                raise ValueError(filename + ' is incomplete.')
+            index_offset, index_entry_count = struct.unpack(FOOTER_FORMAT, footer[:-len(MAGIC)])
+            self.file.seek(index_offset)
+            index_bytes = self.file.read(index_entry_count * INDEX_ENTRY_SIZE)
+            # The chunks of each sensor, in order of time.
+            self.index = {sensor_name: [] for sensor_name in SENSOR_NAMES}
+            for entry in struct.iter_unpack(INDEX_ENTRY_FORMAT, index_bytes):
+                self.index[SENSOR_NAMES[entry[0]]].append(entry[1:])
+        except BaseException:
+            self.file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc, _traceback):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def read_range(self, sensor_name, start_time=None, end_time=None, columns=None):
+        """Return a dict of arrays, one per column, holding the frames of a sensor with start_time <= time <= end_time.
+
+        A start_time or end_time of None means the start or end of the capture. Only the chunks that overlap the range are read.
+        """
+        columns = self.columns if columns is None else columns
+        parts = {column: [] for column in columns}
+        for first_time, last_time, frame_count, offset, length in self.index[sensor_name]:
+            if (start_time is not None and last_time < start_time) or (end_time is not None and first_time > end_time):
+                continue
+            chunk = self._read_chunk(offset, length, frame_count)
+            # Only the chunks at either end of the range need to be trimmed.
+            keep = np.ones(frame_count, dtype=bool)
+            if start_time is not None and first_time < start_time:
+                keep &= chunk['time'] >= start_time
+            if end_time is not None and last_time > end_time:
+                keep &= chunk['time'] <= end_time
+            for column in columns:
+                parts[column].append(chunk[column][keep])
+
+        return {column: np.concatenate(parts[column]) if parts[column]
+                else np.empty(0, dtype=COLUMN_TYPES.get(column, DEFAULT_COLUMN_TYPE))
+                for column in columns}
+
+    def iter_chunks(self, sensor_name, columns=None):
+        """Yield every chunk of a sensor, in order of time, as a dict of arrays like read_range, one chunk at a time."""
+        columns = self.columns if columns is None else columns
+        for _first_time, _last_time, frame_count, offset, length in self.index[sensor_name]:
+            chunk = self._read_chunk(offset, length, frame_count)
+            yield {column: chunk[column] for column in columns}
+
+    def _read_chunk(self, offset, length, frame_count):
+        """Decompress a chunk, and return a dict of its columns."""
+        self.file.seek(offset)
+        data = self.decompress(self.file.read(length))
+        chunk = {}
+        position = 0
+        for column in self.columns:
+            column_type = np.dtype(COLUMN_TYPES.get(column, DEFAULT_COLUMN_TYPE))
+            chunk[column] = np.frombuffer(data, dtype=column_type, count=frame_count, offset=position)
+            position += column_type.itemsize * frame_count
+        return chunk
+
+
+def main():
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    drop_csv = '--drop-csv' in sys.argv[1:]
+    compression = arguments[0] if arguments else COMPRESSION_ZLIB
+    if compression not in _COMPRESSORS:
+        raise Exception('The compression must be one of: ' + ', '.join(_COMPRESSORS))
+
+    capture_numbers = [row['number'] for row in catalog.list_captures()
+                       if not os.path.isfile(get_archive_filename(row['number']))]
+    # debug
+    print('$ Archiving', len(capture_numbers), 'captures with', compression)
+
+    total_csv_size = 0
+    total_archive_size = 0
+    # Each capture is archived in a process of its own, since the work is mostly parsing and compressing (which hold the GIL).
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(archive_capture, capture_number, compression) for capture_number in capture_numbers]
+        for capture_number, future in zip(capture_numbers, futures):
+            try:
+                csv_size, archive_size = future.result()
+            except (OSError, ValueError, KeyError) as e:
+                # A capture with missing or broken files shouldn't stop the others.
+                print('$ Could not archive capture', capture_number, '-', e)
+                continue
+            total_csv_size += csv_size
+            total_archive_size += archive_size
+            print('$ Archived capture {}: {:.1f} MB -> {:.1f} MB'.format(capture_number, csv_size / 1e6, archive_size / 1e6))
+
+    if total_archive_size:
+        print('$ In total {:.1f} MB -> {:.1f} MB ({:.1f} times smaller)'.format(
+            total_csv_size / 1e6, total_archive_size / 1e6, total_csv_size / total_archive_size))
+
+    if not drop_csv:
+        return
+    # Every archived capture, including those that were archived before, as long as it still has its csv files.
+    capture_numbers = [row['number'] for row in catalog.list_captures()
+                       if os.path.isfile(get_archive_filename(row['number'])) and has_csv_files(row['number'])]
+    total_freed_size = 0
+    # Checking an archive means parsing the csv files again, so this is done a process per capture too.
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(drop_csv_files, capture_number) for capture_number in capture_numbers]
+        for capture_number, future in zip(capture_numbers, futures):
+            try:
+                freed_size = future.result()
+            except (OSError, ValueError, KeyError) as e:
+                print('$ Kept the csv files of capture', capture_number, '-', e)
+                continue
+            total_freed_size += freed_size
+            print('$ Deleted the csv files of capture {}: {:.1f} MB'.format(capture_number, freed_size / 1e6))
+    print('$ Freed {:.1f} MB'.format(total_freed_size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Measure how long it takes for the GUI window to appear, and check it against our startup budget.
+
+We launch gui.py several times in benchmark mode (see STARTUP_BENCHMARK_ENVIRONMENT_VARIABLE in gui.py).
+In that mode it draws its window, reports, and quits right away without connecting to the board.
+We time each launch from the moment the process is spawned, since the interpreter startup is part of what the user waits for.
+
+The exit status is 1 if the median launch is over budget, or if any of the heavy modules
+that should only be imported on demand (pandas, matplotlib) were loaded before the window appeared.
+
+Run this from the recv/ directory on the slowest machine that we support.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import os
+import subprocess
+import sys
+import time
+
+# Time to first window (in seconds) that we are willing to accept on a bedside laptop.
+STARTUP_BUDGET_SECONDS = 1.5
+
+# How many times to launch the GUI. We report the median, since the first launch is usually slower (cold disk cache).
+LAUNCH_COUNT = 5
+
+# These may only be imported after the window is shown.
+FORBIDDEN_MODULES = ('pandas', 'matplotlib')
+
+
+def measure_launch():
+    """Launch the GUI once. Return the time until its window appeared and the heavy modules that it had loaded."""
+    environment = dict(os.environ, ELIJAH_STARTUP_BENCHMARK='1')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'gui.py'], stdout=subprocess.PIPE, env=environment, universal_newlines=True)
+
+    first_window_seconds = None
+    heavy_modules = []
+    for line in process.stdout:
+        key, _, value = line.strip().partition(' ')
+        if key == 'first_window_seconds':
+            first_window_seconds = time.perf_counter() - start
+        elif key == 'heavy_modules':
+            heavy_modules = [name for name in value.split(',') if name]
+    process.wait()
+
+    if first_window_seconds is None:
+        raise Exception('The GUI did not report its startup time. Is there a display?')
+    return first_window_seconds, heavy_modules
+
+
+def main():
+    times = []
+    heavy_modules = set()
+    for i in range(LAUNCH_COUNT):
+        seconds, modules = measure_launch()
+        times.append(seconds)
+        heavy_modules.update(modules)
+        print('$ Launch {}: {:.3f} s'.format(i + 1, seconds))
+
+    median = sorted(times)[len(times) // 2]
+    print('$ Median time to first window: {:.3f} s (budget {:.3f} s)'.format(median, STARTUP_BUDGET_SECONDS))
+    print('$ Heavy modules loaded at startup:', ', '.join(sorted(heavy_modules)) or 'none')
+
+    failed = False
+    if median > STARTUP_BUDGET_SECONDS:
+        print('$ Over budget!')
+        failed = True
+    forbidden = heavy_modules.intersection(FORBIDDEN_MODULES)
+    if forbidden:
+        print('$ These modules must be imported lazily:', ', '.join(sorted(forbidden)))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ __author__ = 'Joseph Rubin'
 from serial import SerialException
 import capture
 from const import *
+from frame import FrameBlock
 from util import *
 
 OUTPUT_DIRECTORY_PYTHON_ROOT = './'
@@ -46,7 +47,7 @@ def main():
     con.write(SIG_REQUEST)
     con.flush()
 
-    capture.capture_frames(con, *calibrate_wrapper(OUTPUT_DIRECTORY_PYTHON_ROOT, OUTPUT_DIRECTORY_HEADER_ROOT))
+    capture.capture_blocks(con, *calibrate_wrapper(OUTPUT_DIRECTORY_PYTHON_ROOT, OUTPUT_DIRECTORY_HEADER_ROOT))
     con.close()
 
 
@@ -74,16 +75,13 @@ def calibrate_wrapper(output_path_python, output_path_header):
         print('$ Error writing C++ header file. Maybe the file is open somewhere else? Skipping.')
 
     # Save capture values so we can average them at the end.
-    tongue_values = []
-    throat_values = []
+    # These are FrameBlocks (see frame.py), which hold the values compactly, no matter how long we capture.
+    tongue_values = FrameBlock()
+    throat_values = FrameBlock()
 
-    def sample(frame, frame_count, config):
-        if frame.flag.sensor == TONGUE_SENSOR_ID:
-            tongue_values.append((frame.reading.gyro_x, frame.reading.gyro_y, frame.reading.gyro_z,
-                                  frame.reading.accl_x, frame.reading.accl_y, frame.reading.accl_z))
-        elif frame.flag.sensor == THROAT_SENSOR_ID:
-            throat_values.append((frame.reading.gyro_x, frame.reading.gyro_y, frame.reading.gyro_z,
-                                  frame.reading.accl_x, frame.reading.accl_y, frame.reading.accl_z))
+    def sample(block, frame_count, config):
+        tongue_values.extend(block.of_sensor(TONGUE_SENSOR_ID))
+        throat_values.extend(block.of_sensor(THROAT_SENSOR_ID))
 
         # We divide by two because we are capturing from two sensors.
         return frame_count / config.capture_rate / 2 < DURATION_SECONDS
@@ -93,27 +91,23 @@ def calibrate_wrapper(output_path_python, output_path_header):
         print('$ Captured', frame_count, 'frames.')
         print('$ Found', bad_checksum_count, 'bad checksums.')
 
-        def _slice(lst, col):
-            """Return as a list the col'th values from every tuple in lst."""
-            return [row[col] for row in lst]
-
         # Our calibration will be the average of our at-rest readings.
         # The exception is accl_z which should be calibrated to read 1g.
-        tongue_gyro_x = avg(_slice(tongue_values, 0))
-        tongue_gyro_y = avg(_slice(tongue_values, 1))
-        tongue_gyro_z = avg(_slice(tongue_values, 2))
+        tongue_gyro_x = avg(tongue_values.gyro_x)
+        tongue_gyro_y = avg(tongue_values.gyro_y)
+        tongue_gyro_z = avg(tongue_values.gyro_z)
 
-        tongue_accl_x = avg(_slice(tongue_values, 3))
-        tongue_accl_y = avg(_slice(tongue_values, 4))
-        tongue_accl_z = avg(_slice(tongue_values, 5)) - (SIXTEEN_BIT_MAX_VALUE / config.accl_scale)
+        tongue_accl_x = avg(tongue_values.accl_x)
+        tongue_accl_y = avg(tongue_values.accl_y)
+        tongue_accl_z = avg(tongue_values.accl_z) - (SIXTEEN_BIT_MAX_VALUE / config.accl_scale)
 
-        throat_gyro_x = avg(_slice(throat_values, 0))
-        throat_gyro_y = avg(_slice(throat_values, 1))
-        throat_gyro_z = avg(_slice(throat_values, 2))
+        throat_gyro_x = avg(throat_values.gyro_x)
+        throat_gyro_y = avg(throat_values.gyro_y)
+        throat_gyro_z = avg(throat_values.gyro_z)
 
-        throat_accl_x = avg(_slice(throat_values, 3))
-        throat_accl_y = avg(_slice(throat_values, 4))
-        throat_accl_z = avg(_slice(throat_values, 5)) - (SIXTEEN_BIT_MAX_VALUE / config.accl_scale)
+        throat_accl_x = avg(throat_values.accl_x)
+        throat_accl_y = avg(throat_values.accl_y)
+        throat_accl_z = avg(throat_values.accl_z) - (SIXTEEN_BIT_MAX_VALUE / config.accl_scale)
 
         # Values in the order they will be written.
         order = [tongue_gyro_x, tongue_gyro_y, tongue_gyro_z,
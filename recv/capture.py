@@ -21,7 +21,7 @@ It will be called with frame_count, bad_checksum_count, and config.
 
 __author__ = 'Joseph Rubin'
 
-import sys
+import time
 import serial
 from serial import SerialException
 from serial.serialutil import Timeout
@@ -32,15 +32,41 @@ from frame import *
 from util import *
 from config import Config
 from calibration_generated import *
+import catalog
+from pipeline import Pipeline, Consumer, BLOCK
+from writer import BufferedWriter
+from rate import RateMonitor
 
 NAME = 'delete_me'
 
-OUTPUT_DIRECTORY_ROOT = 'raw/'
-OUTPUT_SUBDIRECTORY = 'capture{}/'
+OUTPUT_DIRECTORY_ROOT = catalog.RAW_DIRECTORY_ROOT
 
 # Fields that we write to the csv file.
 HEADERS = ('time', 'gyroX', 'gyroY', 'gyroZ', 'acclX', 'acclY', 'acclZ', 'button')
 
+# Every frame is this many bytes long (see read_frame), and the configuration that follows SIG_HEAD is CONFIG_SIZE bytes long.
+FRAME_SIZE = 16
+CONFIG_SIZE = 5
+_FRAME_STRUCT = struct.Struct('<HhhhhhhBB')
+
+# The most frames that capture_blocks reads and decodes at once.
+BLOCK_FRAME_COUNT = 64
+
+# While writing a capture, warn if the measured rate of a sensor is off from the declared capture rate by more than this fraction.
+RATE_DRIFT_WARNING = 0.05
+
+# We give the transmitter at most this long (in seconds) to finish the trailer, so that a missing dot can't hang the capture.
+TRAILER_TIMEOUT_SECONDS = 2
+# And we read at most this many bytes of it.
+TRAILER_MAX_BYTES = 1 << 16
+# The text of the trailer is kept with the capture.
+TRAILER_FILENAME = 'trailer.txt'
+
+# Set this to True to keep a log of every byte that goes over the serial connection (see replay.py).
+# The logs are kept in SERIAL_LOG_DIRECTORY_ROOT, named by when the connection was made.
+LOG_SERIAL_BYTES = False
+SERIAL_LOG_DIRECTORY_ROOT = 'serial_logs/'
+
 # How long to capture for (in seconds). This value is only relevant when invoking this file directly (using _main).
 # But if we are, for example, capturing from the GUI, this value will be ignored.
 DURATION_SECONDS = 5
@@ -60,9 +86,11 @@ def _main():
     con.close()
 
 
-def make_con(*, resetting=True, timeout=None):
+def make_con(*, resetting=True, timeout=None, port=None):
     """Returns a closed but configured serial connection to the Arduino.
 
+    If port is None, we connect to the first Arduino that we find (see util.get_arduino_port).
+
     If resetting is True, the connection will be a resetting connection,
     meaning that it will reset the Arduino when it is opened.
 
@@ -71,14 +99,24 @@ def make_con(*, resetting=True, timeout=None):
 
     Understand that if the con is resetting, the connection may finish opening before the Arduino completely resets,
     so don't send anything right away because the Arduino will not receive it! Wait for SIG_READY instead.
+
+    If LOG_SERIAL_BYTES is True, the connection is wrapped in a replay.TeeConnection, which works the same way.
     """
     # We use a timeout because it is essentially the only way to recover
     # when the board is disconnected in the middle of a capture.
     con = serial.Serial(timeout=timeout)
-    con.port = get_arduino_port()
+    con.port = port if port is not None else get_arduino_port()
     con.baudrate = TRANSMITTER_BAUD_RATE
     con.dtr = resetting
     con.terminated = False
+
+    if LOG_SERIAL_BYTES:
+        from replay import TeeConnection
+        os.makedirs(SERIAL_LOG_DIRECTORY_ROOT, exist_ok=True)
+        # The port may look like '/dev/ttyACM0', which can't be part of a filename.
+        log_filename = '{}{}_{}.log'.format(SERIAL_LOG_DIRECTORY_ROOT, time.strftime('%Y%m%d_%H%M%S'),
+                                            ''.join(c if c.isalnum() else '_' for c in str(con.port)))
+        return TeeConnection(con, log_filename)
     return con
 
 
@@ -111,13 +149,16 @@ def wait_for_sig_head(con, *, sig_max_offset=30):
             raise SerialException(error_message)
 
 
-def capture_frames(con, handler, start_handler=None, end_handler=None):
+def capture_frames(con, handler, start_handler=None, end_handler=None, *, count_handler=None):
+    """Call handler with (frame, frame_count, config) for every good frame of a capture, until the end frame.
+
+    The optional count_handler is called with (frame_count, bad_checksum_count) after every frame that was read,
+    so that whoever gave it knows the counts even if we raise before the end (see pipeline.Pipeline.abort).
+    """
     if not wait_for_sig_head(con):
         raise RequestDeniedException()
 
-    # Now we would like to read the configuration data that was sent. See usage of struct.unpack later for more information on the module.
-    capture_rate, gyro_scale, accl_scale = struct.unpack('<HHB', con.read(5))
-    config = Config(capture_rate=capture_rate, gyro_scale=gyro_scale, accl_scale=accl_scale)
+    config = read_config(con)
 
     if start_handler is not None:
         start_handler(config)
@@ -133,16 +174,17 @@ def capture_frames(con, handler, start_handler=None, end_handler=None):
         if frame_count == 1:
             print('$')
 
-        # Resolve the checksum as XOR of every raw byte.
-        checksum_resolution = 0
-        for byte in raw_frame:
-            checksum_resolution ^= byte
+        checksum_resolution = resolve_checksum(raw_frame)
         # Since we XOR'd with the Arduino-calculated checksum,
         # we should get zero if the data was successfully received.
         if checksum_resolution != 0:
             print('$ Bad checksum: ' + str(checksum_resolution) + ' - skip!')
             bad_checksum_count += 1
+            if count_handler is not None:
+                count_handler(frame_count, bad_checksum_count)
             continue
+        if count_handler is not None:
+            count_handler(frame_count, bad_checksum_count)
 
         # Check end flag to tell us when to stop.
         if frame.flag.end:
@@ -169,17 +211,120 @@ def capture_frames(con, handler, start_handler=None, end_handler=None):
     # and it's possible to capture more than once before closing it.
 
 
+def capture_blocks(con, handler, start_handler=None, end_handler=None, *, count_handler=None,
+                   block_frame_count=BLOCK_FRAME_COUNT):
+    """Like capture_frames, but the handler is called with a FrameBlock (see frame.py) of frames at a time.
+
+    Rather than read and decode the frames one at a time, we read every frame that is waiting on the connection
+    (up to block_frame_count) at once, which takes far less time per frame.
+    The handler is called with (block, frame_count, config) where frame_count counts every frame so far, including this block.
+    The count_handler is called like that of capture_frames, after every block that was read.
+
+    Returns the bytes that we read after the end frame, which are the start of the trailer (see read_trailer).
+    """
+    if not wait_for_sig_head(con):
+        raise RequestDeniedException()
+
+    config = read_config(con)
+
+    if start_handler is not None:
+        start_handler(config)
+
+    frame_count = 0
+    bad_checksum_count = 0
+    sent_enough = False
+    while True:
+        # Read every frame that is already waiting (up to our block size), but at least one.
+        block_size = max(1, min(block_frame_count, con.in_waiting // FRAME_SIZE)) * FRAME_SIZE
+        raw_frames = con.read(block_size)
+        received = time.perf_counter()
+        if len(raw_frames) < block_size:
+            raise SerialException('Timeout occurred. Perhaps the board was disconnected.')
+
+        block, block_frame_total, block_bad_checksum_count, trailer_prefix = decode_block(raw_frames)
+        # So that we can tell how far behind the transmitter we are (see latency.py).
+        block.received = received
+        frame_count += block_frame_total
+        bad_checksum_count += block_bad_checksum_count
+        if count_handler is not None:
+            count_handler(frame_count, bad_checksum_count)
+
+        # See capture_frames for why we don't simply stop here.
+        if len(block) and not handler(block, frame_count, config) and not sent_enough:
+            con.write(SIG_ENOUGH)
+            con.flush()
+            sent_enough = True
+
+        if trailer_prefix is not None:
+            # debug
+            print('$ Encountered stop flag.')
+            break
+
+    if end_handler is not None:
+        end_handler(frame_count, bad_checksum_count, config)
+
+    return trailer_prefix
+
+
+def decode_block(raw_frames):
+    """Decode the frames in raw_frames (a multiple of FRAME_SIZE bytes) into a FrameBlock of the good frames.
+
+    Returns the block, how many frames were read, how many had bad checksums,
+    and if there was an end frame, the bytes after it (otherwise None). Frames after the end frame are not decoded.
+    """
+    block = FrameBlock()
+    frame_count = 0
+    bad_checksum_count = 0
+    for start in range(0, len(raw_frames), FRAME_SIZE):
+        raw_frame = raw_frames[start:start + FRAME_SIZE]
+        frame_count += 1
+        if resolve_checksum(raw_frame) != 0:
+            bad_checksum_count += 1
+            continue
+        # See decode_frame.
+        time, gyro_x, gyro_y, gyro_z, accl_x, accl_y, accl_z, flag_byte, _checksum = _FRAME_STRUCT.unpack(raw_frame)
+        if get_bit(flag_byte, 0):
+            # The contents of the frame that has the end flag are to be ignored.
+            # Anything after it was not a frame at all, it was the start of the trailer.
+            return block, frame_count, bad_checksum_count, raw_frames[start + FRAME_SIZE:]
+        block.append(time, gyro_x, gyro_y, gyro_z, accl_x, accl_y, accl_z,
+                     0, (2 * get_bit(flag_byte, 2)) + get_bit(flag_byte, 1), get_bit(flag_byte, 7))
+    return block, frame_count, bad_checksum_count, None
+
+
+def read_config(con):
+    """Read the configuration data that follows SIG_HEAD."""
+    # See usage of struct.unpack in decode_frame for more information on the module.
+    raw_config = con.read(CONFIG_SIZE)
+    if len(raw_config) < CONFIG_SIZE:
+        raise SerialException('Timeout occurred. Perhaps the board was disconnected.')
+    capture_rate, gyro_scale, accl_scale = struct.unpack('<HHB', raw_config)
+    return Config(capture_rate=capture_rate, gyro_scale=gyro_scale, accl_scale=accl_scale)
+
+
+def resolve_checksum(raw_frame):
+    """Resolve the checksum of a raw frame as XOR of every raw byte. This is zero for a good frame."""
+    checksum_resolution = 0
+    for byte in raw_frame:
+        checksum_resolution ^= byte
+    return checksum_resolution
+
+
 def read_frame(con):
     # We read 16 bytes at a time, because that's the size of the struct that the arduino is sending.
     # 2 bytes  (unsigned) time
     # 12 bytes   (signed) reading
     # 1 byte   (unsigned) flags
     # 1 byte   (unsigned) checksum (XOR)
-    frame_size = 16
-    raw_frame = con.read(frame_size)
-    if len(raw_frame) < frame_size:
+    raw_frame = con.read(FRAME_SIZE)
+    if len(raw_frame) < FRAME_SIZE:
         raise SerialException('Timeout occurred. Perhaps the board was disconnected.')
 
+    return raw_frame, decode_frame(raw_frame)
+
+
+def decode_frame(raw_frame):
+    """Turn the bytes of a single frame into a Frame."""
     # Struct (module) lets us restore data from structures automatically using a format string to tell it the struct members.
     # The result is put into a tuple.
     # Arduino is little endian, so we use '<'.
@@ -198,170 +343,338 @@ def read_frame(con):
 
     flag = Flag(**flag_dict)
     reading = Reading(*[unpacked_frame[i] for i in range(1, 7)])
-    frame = Frame(time=unpacked_frame[0], reading=reading, flag=flag)
+    return Frame(time=unpacked_frame[0], reading=reading, flag=flag)
+
 
-    return raw_frame, frame
+def read_trailer(con, prefix=b''):
+    """Read the trailer that follows the frames, and return it as text (without the terminating dot).
+
+    prefix holds any bytes of the trailer that were already read from the connection.
+    We read whatever has arrived at once rather than a line at a time, and give up after TRAILER_TIMEOUT_SECONDS
+    (or TRAILER_MAX_BYTES), so a transmitter that never sends the dot can't hang us.
+    See the spec under communications protocol for details.
+    """
+    trailer = prefix
+    timeout = Timeout(TRAILER_TIMEOUT_SECONDS)
+    while not _find_trailer_end(trailer):
+        if timeout.expired() or len(trailer) >= TRAILER_MAX_BYTES:
+            # debug
+            print('$ The trailer never ended.')
+            break
+        # noinspection PyArgumentList
+        trailer += con.read(max(1, con.in_waiting))
+    end = _find_trailer_end(trailer)
+    if end:
+        trailer = trailer[:end[0]]
+    return trailer.decode('ascii', errors='ignore')
+
+
+def parse_trailer(trailer: str):
+    """Return the metadata in the text of a trailer, as a dict.
+
+    The transmitter writes its metadata as lines of 'key: value' (see endCapture in trans.ino).
+    Values that are numbers are converted to int or float. Any other lines (e.g. debug output) are skipped.
+    """
+    metadata = {}
+    for line in trailer.splitlines():
+        key, separator, value = line.partition(':')
+        key, value = key.strip(), value.strip()
+        if not separator or not key or ' ' in key:
+            continue
+        for convert in (int, float):
+            try:
+                value = convert(value)
+                break
+            except ValueError:
+                pass
+        metadata[key] = value
+    return metadata
+
+
+def _find_trailer_end(trailer):
+    """Return (start, end) of the line holding the terminating dot in trailer, or None if it is not there yet."""
+    for terminator in (b'.\r\n', b'.\n'):
+        if trailer.startswith(terminator):
+            return 0, len(terminator)
+        index = trailer.find(b'\n' + terminator)
+        if index != -1:
+            return index + 1, index + 1 + len(terminator)
+    return None
 
 
 # Below is a handler configuration that is used to capture data and save to a file.
 
 
-def do_writing_capture(con: serial.Serial, enable_trailer: bool=True, duration_seconds=None):
-    """Capture data from the transmitter and save it to a file. (This does not send a SIG_REQUEST itself.)"""
+def do_writing_capture(con: serial.Serial, enable_trailer: bool=True, duration_seconds=None, stop_event=None, consumers=(),
+                       trigger=None):
+    """Capture data from the transmitter and save it to a file. (This does not send a SIG_REQUEST itself.)
+
+    If a threading.Event is given as stop_event, setting it ends the capture (as if the duration was up).
+    If a trigger.PreTrigger is given, only the frames around button presses are saved.
+    Any other consumers (see pipeline.py) are given the frames of the capture along with the file writer.
+    Returns the capture number of the new capture.
+    """
     # With a duration of None, we will never terminate on our own (we continue until the transmitter sends a frame with the end flag set).
 
+    # The GUI imports this file, and these need numpy, which the GUI doesn't need at startup (see writing_consumer).
+    import saturation
+    import latency
+
     # Check to make sure that our serial con is good.
     if not con.is_open:
         raise SerialException('Serial did not open.')
 
-    # Since that was successful, we should find a free output path,
-    # but don't create it yet in case something goes wrong before we start capturing data.
-    output_path = None
-    capture_number = -1
-    while output_path is None or os.path.isdir(output_path):
-        capture_number += 1
-        output_path = OUTPUT_DIRECTORY_ROOT + OUTPUT_SUBDIRECTORY.format(str(capture_number).zfill(5))
+    # Since that was successful, we should reserve a capture number in the catalog,
+    # but don't create its output path yet in case something goes wrong before we start capturing data.
+    capture_number = catalog.allocate_capture_number(NAME, port=con.port)
+    output_path = OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+
+    # The writer is a consumer like any other, except that the capture waits for it rather than lose frames.
+    capture_pipeline = Pipeline()
+    writer = capture_pipeline.subscribe(writing_consumer(output_path, duration_seconds, capture_number, stop_event, trigger))
+    for consumer in consumers:
+        capture_pipeline.subscribe(consumer)
+    # Look for readings that were clipped by the range of the sensors, and recommend a better range at the end.
+    capture_pipeline.subscribe(saturation.make_saturation_consumer(output_path))
+    # Measure how far behind the transmitter we are.
+    capture_pipeline.subscribe(latency.make_latency_consumer(output_path))
 
-    # We need to pass the output_path to our handler so we use a wrapper function.
-    capture_frames(con, *writing_capture_handler_wrapper(output_path, duration_seconds))
+    try:
+        trailer_prefix = capture_blocks(con, *capture_pipeline.block_handlers(), count_handler=capture_pipeline.count)
+    except RequestDeniedException:
+        # Nothing was written, so give the capture number back.
+        catalog.delete_capture(capture_number)
+        raise
+    except SerialException:
+        # Probably the board was disconnected. We can't go on, but we don't want to lose what we have,
+        # so every consumer handles the frames that we received and ends (with the counts so far),
+        # and the writer finishes the capture as a truncated capture (see writing_consumer).
+        capture_pipeline.abort()
+        if writer.ident is None:
+            # We never got as far as creating the capture.
+            catalog.delete_capture(capture_number)
+        raise
 
     # Trailer (see the spec under communications protocol for details).
     if enable_trailer:
-        while True:
-            # noinspection PyArgumentList
-            line = con.readline().decode('ascii', errors='ignore')
-            if line == '.\r\n' or line == '.\n':
-                break
-            sys.stdout.write(line)
+        trailer = read_trailer(con, trailer_prefix)
+        metadata = parse_trailer(trailer)
+        # debug
+        print('$ Trailer:', metadata if metadata else repr(trailer))
+        # The writer may not have created the subdirectory (e.g. a trigger that never fired).
+        if os.path.isdir(output_path):
+            with open(output_path + TRAILER_FILENAME, 'w') as trailer_file:
+                trailer_file.write(trailer)
+        catalog.set_metadata(capture_number, metadata)
 
     # debug
     print('$ End of capture.')
 
-    return output_path
+    return capture_number
 
 
-def writing_capture_handler_wrapper(output_path, duration_seconds=None):
-    # With a duration of None, we will never terminate on our own (we continue until the transmitter sends a frame with the end flag set).
+def writing_consumer(output_path, duration_seconds=None, capture_number=None, stop_event=None, trigger=None):
+    """Return a consumer (see pipeline.py) that writes the frames of a capture to output_path.
+
+    If a trigger (see trigger.py) is given, only the frames that it lets through are written.
+
+    If a capture_number is given, we record the capture in the catalog when it is finished.
+    With a duration of None, we will never terminate on our own (we continue until the transmitter sends a frame with the end flag set).
+
+    The frames are formatted on the consumer's thread, and written to disk from the thread of a BufferedWriter.
+    We also build the time index of each sensor file as we go (see query.py).
+    The duration is measured by the timestamps of the frames (see rate.py), not by how many frames we received.
+    """
+    # The GUI imports this file, and query needs numpy, which the GUI doesn't need at startup.
+    from query import TimeIndexBuilder, TIME_INDEX_FILENAME, UNWRAPPED_MARKER_FILENAME
 
-    # This wrapper function allows us. to return a custom version of our custom handler. (we are defining a closure)
-    # That is, the following code will run just once.
+    # The following code will run just once. The handlers below are closures over it.
 
     # Prepare our output files.
     # Even though we are capturing 'raw' data, we are still scaling and calibrating it.
-    output_filename_tongue = output_path + 'tongue.csv'
-    output_filename_throat = output_path + 'throat.csv'
     # But we also keep a copy of the data that is not at all scaled or calibrated (currently we have no use for this).
-    output_filename_tongue_no_modification = output_path + 'tongue_unscaled_uncalibrated.csv'
-    output_filename_throat_no_modification = output_path + 'throat_unscaled_uncalibrated.csv'
+    output_filenames = {
+        TONGUE_SENSOR_ID: output_path + 'tongue.csv',
+        THROAT_SENSOR_ID: output_path + 'throat.csv',
+        (TONGUE_SENSOR_ID, 'raw'): output_path + 'tongue_unscaled_uncalibrated.csv',
+        (THROAT_SENSOR_ID, 'raw'): output_path + 'throat_unscaled_uncalibrated.csv',
+    }
+    output = None
+    rate_monitor = None
+    # The (capture) time of the last warning about the rate, so that we don't warn for every batch.
+    last_rate_warning_time = None
+
+    # How many frames we wrote for each sensor.
+    sensor_frame_counts = {TONGUE_SENSOR_ID: 0, THROAT_SENSOR_ID: 0}
 
-    output_tongue = None
-    output_throat = None
-    output_tongue_no_modification = None
-    output_throat_no_modification = None
+    # The time index of each sensor file, and how many bytes we have written to the file so far.
+    time_indexes = {TONGUE_SENSOR_ID: TimeIndexBuilder(), THROAT_SENSOR_ID: TimeIndexBuilder()}
+    time_index_filenames = {TONGUE_SENSOR_ID: output_path + TIME_INDEX_FILENAME.format('tongue'),
+                            THROAT_SENSOR_ID: output_path + TIME_INDEX_FILENAME.format('throat')}
+    file_sizes = {TONGUE_SENSOR_ID: 0, THROAT_SENSOR_ID: 0}
 
     def setup_files(config):
-        global output_tongue, output_throat, output_tongue_no_modification, output_throat_no_modification
+        # This is nonlocal (rather than global) so that several captures can be written at once on different threads.
+        nonlocal output, rate_monitor
 
+        rate_monitor = RateMonitor(config.capture_rate)
         os.makedirs(output_path)
-
-        output_tongue = open(output_filename_tongue, 'w')
-        output_throat = open(output_filename_throat, 'w')
-        output_tongue_no_modification = open(output_filename_tongue_no_modification, 'w')
-        output_throat_no_modification = open(output_filename_throat_no_modification, 'w')
+        output = BufferedWriter(output_filenames)
+        if trigger is not None:
+            trigger.start(config)
 
         # Write the csv headers.
-        output_tongue.write(format_csv(HEADERS) + '\n')
-        output_throat.write(format_csv(HEADERS) + '\n')
-        output_tongue_no_modification.write(format_csv(HEADERS) + '\n')
-        output_throat_no_modification.write(format_csv(HEADERS) + '\n')
+        for key in output_filenames:
+            output.write(key, format_csv(HEADERS) + '\n')
+        for sensor in file_sizes:
+            # Our lines are plain ascii, so their length is their size in bytes.
+            file_sizes[sensor] = len(format_csv(HEADERS) + '\n')
 
         # Save config data as empty files (these are not currently used).
         open(output_path + 'capture_rate_' + str(config.capture_rate), 'w').close()
         open(output_path + 'gyro_scale_' + str(config.gyro_scale), 'w').close()
         open(output_path + 'accl_scale_' + str(config.accl_scale), 'w').close()
+        # The trigger unwraps the times that it lets through, so readers must not unwrap them again (see query.load_range).
+        if trigger is not None:
+            open(output_path + UNWRAPPED_MARKER_FILENAME, 'w').close()
+
+    def write_frames(batch, config):
+        rate_monitor.add(batch)
+        warn_about_rate()
+
+        # We collect the lines of the whole batch, and hand them to the writer all at once.
+        lines = {key: [] for key in output_filenames}
+        for frame in (batch if trigger is None else trigger.filter(batch)):
+            if frame.flag.sensor in sensor_frame_counts:
+                sensor_frame_counts[frame.flag.sensor] += 1
+                output_string, output_string_raw = format_frame(frame, config)
+                time_indexes[frame.flag.sensor].add(frame.time, file_sizes[frame.flag.sensor])
+                file_sizes[frame.flag.sensor] += len(output_string)
+                lines[frame.flag.sensor].append(output_string)
+                lines[(frame.flag.sensor, 'raw')].append(output_string_raw)
+        for key, key_lines in lines.items():
+            if key_lines:
+                output.write(key, ''.join(key_lines))
+
+        if stop_event is not None and stop_event.is_set():
+            return False
+        return duration_seconds is None or rate_monitor.elapsed_seconds < duration_seconds
+
+    def warn_about_rate():
+        nonlocal last_rate_warning_time
+        if last_rate_warning_time is not None \
+                and rate_monitor.last_time - last_rate_warning_time < rate_monitor.window_ms:
+            return
+        for sensor, sensor_name in ((TONGUE_SENSOR_ID, 'tongue'), (THROAT_SENSOR_ID, 'throat')):
+            drift = rate_monitor.drift(sensor)
+            if drift is not None and abs(drift) > RATE_DRIFT_WARNING:
+                last_rate_warning_time = rate_monitor.last_time
+                # debug
+                print('$ The {} sensor is running at {:.0f} Hz, {:+.1%} from the declared {} Hz.'.format(
+                    sensor_name, rate_monitor.get_rate(sensor), drift, rate_monitor.declared_rate))
 
-        # debug
-        #print('$ Writing:', output_filename_tongue)
-        #print('$ Writing:', output_filename_throat)
-
-    def write_frames(frame, frame_count, config):
-        global output_tongue, output_throat, output_tongue_no_modification, output_throat_no_modification
-
-        flag = frame.flag
-        reading = frame.reading
-
-        # Make a raw output string, with no calibration or scaling applied.
-        output_string_raw = format_csv((
-            frame.time,
-            reading.gyro_x, reading.gyro_y, reading.gyro_z,
-            reading.accl_x, reading.accl_y, reading.accl_z,
-            flag.button
-        )) + '\n'
-
-        # Our sensor_id flag tells us which calibration numbers to use.
-        if flag.sensor == TONGUE_SENSOR_ID:
-            reading.gyro_x -= calib.tongue.gyro.x
-            reading.gyro_y -= calib.tongue.gyro.y
-            reading.gyro_z -= calib.tongue.gyro.z
-
-            reading.accl_x -= calib.tongue.accl.x
-            reading.accl_y -= calib.tongue.accl.y
-            reading.accl_z -= calib.tongue.accl.z
-        elif flag.sensor == THROAT_SENSOR_ID:
-            reading.gyro_x -= calib.throat.gyro.x
-            reading.gyro_y -= calib.throat.gyro.y
-            reading.gyro_z -= calib.throat.gyro.z
-
-            reading.accl_x -= calib.throat.accl.x
-            reading.accl_y -= calib.throat.accl.y
-            reading.accl_z -= calib.throat.accl.z
-
-        # Now we can scale the numbers from raw values to dps (for gyro) or gs (for accl).
-        reading.gyro_x = calculate_dps(reading.gyro_x, config.gyro_scale)
-        reading.gyro_y = calculate_dps(reading.gyro_y, config.gyro_scale)
-        reading.gyro_z = calculate_dps(reading.gyro_z, config.gyro_scale)
-
-        reading.accl_x = calculate_gs(reading.accl_x, config.accl_scale)
-        reading.accl_y = calculate_gs(reading.accl_y, config.accl_scale)
-        reading.accl_z = calculate_gs(reading.accl_z, config.accl_scale)
-
-        # Prepare a line of csv output.
-        output_string = format_csv((
-            frame.time,
-            reading.gyro_x, reading.gyro_y, reading.gyro_z,
-            reading.accl_x, reading.accl_y, reading.accl_z,
-            flag.button
-        )) + '\n'
-
-        # Our sensor_id flag tells us where to output.
-        if flag.sensor == TONGUE_SENSOR_ID:
-            output_tongue.write(output_string)
-            output_tongue_no_modification.write(output_string_raw)
-        elif flag.sensor == THROAT_SENSOR_ID:
-            output_throat.write(output_string)
-            output_throat_no_modification.write(output_string_raw)
-
-        # We divide by two because we are capturing from two sensors.
-        return duration_seconds is None or (frame_count / config.capture_rate / 2 < duration_seconds)
-
-    def close_files(frame_count, bad_checksum_count, _config):
-        global output_tongue, output_throat, output_tongue_no_modification, output_throat_no_modification
-
-        output_tongue.close()
-        output_throat.close()
-        output_tongue_no_modification.close()
-        output_throat_no_modification.close()
+    def close_files(frame_count, bad_checksum_count, config, truncated=False):
+        """Finish the capture. If it was cut short (truncated) the counts are those up to where it was cut."""
+        if output is None:
+            # setup_files failed, so there is nothing to finish.
+            # debug
+            print('$ The capture was never set up.')
+            return
+
+        # This waits until everything is on the disk.
+        output.close()
+        # The index is saved after the csv file is finished, so that it is newer than the file (see query.load_time_index).
+        for sensor, time_index in time_indexes.items():
+            time_index.save(time_index_filenames[sensor])
 
         # Write the name file.
         name_file = open(output_path + 'name.txt', 'w')
         name_file.write(NAME)
         name_file.close()
 
+        if capture_number is not None:
+            catalog.finish_capture(capture_number, config=config, frame_count=frame_count,
+                                   tongue_frame_count=sensor_frame_counts[TONGUE_SENSOR_ID],
+                                   throat_frame_count=sensor_frame_counts[THROAT_SENSOR_ID],
+                                   bad_checksum_count=bad_checksum_count,
+                                   duration_seconds=rate_monitor.elapsed_seconds,
+                                   tongue_rate=rate_monitor.get_average_rate(TONGUE_SENSOR_ID),
+                                   throat_rate=rate_monitor.get_average_rate(THROAT_SENSOR_ID),
+                                   status=catalog.STATUS_TRUNCATED if truncated else catalog.STATUS_COMPLETE)
+
         # debug
+        if truncated:
+            print('$ The capture was cut short.')
+        if trigger is not None:
+            print('$ Kept', trigger.kept_frame_count, 'of', trigger.frame_count, 'frames in', trigger.window_count, 'windows.')
         print('$ Captured', frame_count, 'frames.')
         print('$ Found', bad_checksum_count, 'bad checksums.')
-
-    return write_frames, setup_files, close_files
+        for sensor, sensor_name in ((TONGUE_SENSOR_ID, 'tongue'), (THROAT_SENSOR_ID, 'throat')):
+            rate = rate_monitor.get_average_rate(sensor)
+            if rate is not None:
+                print('$ The {} sensor ran at {:.1f} Hz (declared {} Hz).'.format(sensor_name, rate, config.capture_rate))
+
+    def close_truncated_files(frame_count, bad_checksum_count, config):
+        close_files(frame_count, bad_checksum_count, config, truncated=True)
+
+    # The capture waits for the writer rather than lose frames.
+    return Consumer(write_frames, start_handler=setup_files, end_handler=close_files, abort_handler=close_truncated_files,
+                    policy=BLOCK, name='writer')
+
+
+def format_frame(frame, config):
+    """Return the csv lines for a frame: calibrated and scaled, and exactly as it was received."""
+    flag = frame.flag
+    reading = frame.reading
+
+    # Make a raw output string, with no calibration or scaling applied.
+    output_string_raw = format_csv((
+        frame.time,
+        reading.gyro_x, reading.gyro_y, reading.gyro_z,
+        reading.accl_x, reading.accl_y, reading.accl_z,
+        flag.button
+    )) + '\n'
+
+    # The frame may be shared with other consumers (see pipeline.py), so we calibrate and scale copies of its values.
+    gyro_x, gyro_y, gyro_z = reading.gyro_x, reading.gyro_y, reading.gyro_z
+    accl_x, accl_y, accl_z = reading.accl_x, reading.accl_y, reading.accl_z
+
+    # Our sensor_id flag tells us which calibration numbers to use.
+    if flag.sensor == TONGUE_SENSOR_ID:
+        gyro_x -= calib.tongue.gyro.x
+        gyro_y -= calib.tongue.gyro.y
+        gyro_z -= calib.tongue.gyro.z
+
+        accl_x -= calib.tongue.accl.x
+        accl_y -= calib.tongue.accl.y
+        accl_z -= calib.tongue.accl.z
+    elif flag.sensor == THROAT_SENSOR_ID:
+        gyro_x -= calib.throat.gyro.x
+        gyro_y -= calib.throat.gyro.y
+        gyro_z -= calib.throat.gyro.z
+
+        accl_x -= calib.throat.accl.x
+        accl_y -= calib.throat.accl.y
+        accl_z -= calib.throat.accl.z
+
+    # Now we can scale the numbers from raw values to dps (for gyro) or gs (for accl).
+    gyro_x = calculate_dps(gyro_x, config.gyro_scale)
+    gyro_y = calculate_dps(gyro_y, config.gyro_scale)
+    gyro_z = calculate_dps(gyro_z, config.gyro_scale)
+
+    accl_x = calculate_gs(accl_x, config.accl_scale)
+    accl_y = calculate_gs(accl_y, config.accl_scale)
+    accl_z = calculate_gs(accl_z, config.accl_scale)
+
+    # Prepare a line of csv output.
+    output_string = format_csv((
+        frame.time,
+        gyro_x, gyro_y, gyro_z,
+        accl_x, accl_y, accl_z,
+        flag.button
+    )) + '\n'
+
+    return output_string, output_string_raw
 
 
 def get_bit(number, index):
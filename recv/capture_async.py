@@ -0,0 +1,196 @@
+"""An asyncio interface to the transmitter, as an alternative to the handlers of capture.py.
+
+Instead of plugging handlers into capture_frames, we await the device and iterate over the capture:
+
+    device = await open_device()
+    async with await device.request_capture() as stream:
+        async for batch in stream:
+            ...  # batch is a FrameBlock (see frame.py) of good frames, in order.
+    print(stream.trailer)
+    await device.close()
+
+This lets a single event loop drive the capture along with anything else (live analysis, writing to disk)
+without spawning threads or generating events by hand.
+
+Pyserial has no asynchronous interface, so every device has a single thread of its own that does the blocking reads.
+That thread reads ahead into a bounded queue of batches. When the queue is full it waits for the consumer,
+so a slow consumer gets backpressure rather than an ever-growing backlog (although if it is slow for too long,
+the serial buffer itself will overflow, exactly as it would with a slow handler).
+
+Leaving the 'async with' block early (by break, an exception, or cancellation of the consuming task)
+sends a SIG_ENOUGH, just like a handler returning False, and waits for the transmitter to end the capture.
+Calling stream.stop() does the same without leaving the block; the remaining frames are still delivered.
+
+@precondition: TRANSMIT_MODE 1
+               DEBUG_MODE 0
+"""
+
+__author__ = 'Joseph Rubin'
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from serial import SerialException
+
+from const import *
+import capture
+
+# The most frames that we put in a single batch. Batches are smaller when fewer frames are waiting on the connection.
+BATCH_FRAME_COUNT = 64
+# How many batches may be waiting for the consumer before the reader waits too.
+QUEUE_BATCH_COUNT = 32
+
+
+async def open_device(*, resetting=True, timeout=4):
+    """Open a connection to the transmitter and wait until it is ready for requests.
+
+    See capture.make_con for the meaning of resetting.
+    """
+    device = Device(capture.make_con(resetting=resetting, timeout=timeout))
+    try:
+        await device.run(device.con.open)
+        if resetting:
+            await device.run(capture.wait_for_sig_ready, device.con)
+    except SerialException:
+        await device.close()
+        raise
+    return device
+
+
+class Device(object):
+    """A connection to a transmitter whose blocking calls are run on a thread of its own."""
+
+    def __init__(self, con):
+        self.con = con
+        # A single thread, so the calls on the connection happen in the order that they were made.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def run(self, function, *args):
+        """Run a blocking function on the thread of this device and wait for its result."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def request_capture(self, *, batch_frame_count=BATCH_FRAME_COUNT, queue_batch_count=QUEUE_BATCH_COUNT):
+        """Send a SIG_REQUEST and return a CaptureStream once the transmitter has begun the capture.
+
+        Raises a RequestDeniedException if the request was denied.
+        """
+        await self.write(SIG_REQUEST)
+        if not await self.run(capture.wait_for_sig_head, self.con):
+            raise RequestDeniedException()
+        config = await self.run(capture.read_config, self.con)
+        return CaptureStream(self, config, batch_frame_count, queue_batch_count)
+
+    async def write(self, data):
+        """Write to the connection and flush it."""
+        def write_and_flush():
+            self.con.write(data)
+            self.con.flush()
+        await self.run(write_and_flush)
+
+    async def close(self):
+        """Close the connection and stop the thread of this device."""
+        await self.run(self.con.close)
+        self._executor.shutdown()
+
+
+class CaptureStream(object):
+    """The frames of a single capture, delivered in batches. See the top of this file for how to use it.
+
+    After the stream is exhausted, frame_count, bad_checksum_count, trailer and metadata (parsed from the trailer) are final.
+    """
+
+    def __init__(self, device, config, batch_frame_count, queue_batch_count):
+        self.device = device
+        self.config = config
+        self.batch_frame_count = batch_frame_count
+        self.frame_count = 0
+        self.bad_checksum_count = 0
+        self.trailer = None
+        self.metadata = None
+        self._stop_sent = False
+        # Holds lists of frames, then None when the capture is over (or the exception that ended it).
+        self._queue = asyncio.Queue(maxsize=queue_batch_count)
+        self._reader = asyncio.ensure_future(self._read())
+        self._finished = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, _exc_type, _exc, _traceback):
+        await self.aclose()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._finished:
+            raise StopAsyncIteration
+        batch = await self._queue.get()
+        if batch is None:
+            self._finished = True
+            raise StopAsyncIteration
+        if isinstance(batch, Exception):
+            self._finished = True
+            raise batch
+        return batch
+
+    async def stop(self):
+        """Tell the transmitter that we are done (send a SIG_ENOUGH). Frames it has already sent are still delivered."""
+        if not self._stop_sent:
+            self._stop_sent = True
+            await self.device.write(SIG_ENOUGH)
+
+    async def aclose(self):
+        """Stop the capture and discard the remaining frames, waiting until the transmitter has ended the capture."""
+        if self._reader.done():
+            return
+        await self.stop()
+        # Make room in the queue until the reader is done.
+        while not self._reader.done():
+            try:
+                self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                await asyncio.wait([self._reader], timeout=0.05)
+        self._finished = True
+
+    async def _read(self):
+        """Read batches from the connection (on the device's thread) and queue them for the consumer."""
+        try:
+            while True:
+                batch, trailer_prefix = await self.device.run(self._read_batch)
+                if batch:
+                    await self._queue.put(batch)
+                if trailer_prefix is not None:
+                    break
+            self.trailer = await self.device.run(capture.read_trailer, self.device.con, trailer_prefix)
+            self.metadata = capture.parse_trailer(self.trailer)
+        except asyncio.CancelledError:
+            # (Before Python 3.8 this is an Exception too.) Whoever cancelled us isn't waiting on the queue.
+            raise
+        except Exception as e:
+            # Not only a disconnected board: a frame or trailer that can't be decoded, or a device that was closed.
+            # Whatever it is, the consumer must hear of it, or it would wait on the queue forever.
+            await self._queue.put(e)
+        else:
+            await self._queue.put(None)
+
+    def _read_batch(self):
+        """Read and decode up to batch_frame_count frames. This is blocking, so it runs on the device's thread.
+
+        Returns a FrameBlock of the good frames, and if the end frame was found, the bytes after it (which belong to the trailer).
+        Otherwise the second value is None.
+        """
+        con = self.device.con
+        # Read every frame that is already waiting (up to our batch size), but at least one.
+        frame_count = max(1, min(self.batch_frame_count, con.in_waiting // capture.FRAME_SIZE))
+        raw_frames = con.read(frame_count * capture.FRAME_SIZE)
+        received = time.perf_counter()
+        if len(raw_frames) < frame_count * capture.FRAME_SIZE:
+            raise SerialException('Timeout occurred. Perhaps the board was disconnected.')
+
+        batch, frame_count, bad_checksum_count, trailer_prefix = capture.decode_block(raw_frames)
+        batch.received = received
+        self.frame_count += frame_count
+        self.bad_checksum_count += bad_checksum_count
+        return batch, trailer_prefix
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Record from every attached transmitter at once, so that one machine can monitor several beds.
+
+Each transmitter gets a recorder thread of its own, which opens its connection, requests a capture, and writes it
+to a separate capture (see capture.do_writing_capture) until the duration is up or until Ctrl+C is pressed.
+Each capture also runs its consumers (the writer, saturation and latency, see pipeline.py) and its BufferedWriter
+on threads of their own, so a device uses several threads.
+The captures share nothing except the catalog, which they only touch at the start and end of a capture,
+so the work (and the CPU time) per frame stays the same no matter how many devices there are.
+The blocking reads release the GIL while they wait, which is most of the time.
+
+When every capture is finished we print statistics for each device, then the CPU time of the whole process per frame,
+so that the scaling can be checked. The threads of the devices are mixed together in the CPU time of the process,
+so the CPU time of each device on its own is not known.
+
+The capture duration can be given (in seconds) as the first command line argument.
+Otherwise we record until Ctrl+C is pressed.
+For long monitoring sessions, give the pre-trigger and post-trigger times (in seconds) as the second and third arguments,
+and only the frames around button presses are saved (see trigger.py).
+"""
+
+__author__ = 'Joseph Rubin'
+
+import sys
+import threading
+import time
+
+from serial import SerialException
+
+from const import *
+from util import *
+import capture
+import catalog
+from trigger import PreTrigger
+
+# How often the main thread checks whether the recorders are done. This is also how fast we notice Ctrl+C.
+JOIN_INTERVAL_SECONDS = 0.2
+
+
+def main():
+    duration_seconds = float(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != 'none' else None
+    trigger_seconds = (float(sys.argv[2]), float(sys.argv[3])) if len(sys.argv) > 3 else None
+
+    ports = get_arduino_ports()
+    if not ports:
+        raise Exception('No transmitters were found. Please make sure they are plugged in!')
+    # debug
+    print('$ Found', len(ports), 'transmitters:', ', '.join(ports))
+
+    stop_event = threading.Event()
+    # The work of a capture is spread over several threads (see the top of this file), so we measure the whole process.
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    recorders = [DeviceRecorder(port, duration_seconds, stop_event, trigger_seconds) for port in ports]
+    for recorder in recorders:
+        recorder.start()
+
+    try:
+        while any(recorder.is_alive() for recorder in recorders):
+            for recorder in recorders:
+                recorder.join(JOIN_INTERVAL_SECONDS)
+    except KeyboardInterrupt:
+        # debug
+        print('$ Stopping every capture...')
+        stop_event.set()
+        for recorder in recorders:
+            recorder.join()
+
+    print_statistics(recorders, time.process_time() - start_cpu, time.perf_counter() - start_wall)
+
+
+class DeviceRecorder(threading.Thread):
+    """Records a single capture from the transmitter on one serial port, and keeps statistics about it."""
+
+    def __init__(self, port, duration_seconds, stop_event, trigger_seconds=None):
+        threading.Thread.__init__(self, name='recorder ' + port)
+        self.port = port
+        self.duration_seconds = duration_seconds
+        self.stop_event = stop_event
+        # Every device needs a trigger of its own, since a trigger holds the recent frames of its capture.
+        self.trigger = PreTrigger(*trigger_seconds) if trigger_seconds is not None else None
+
+        # Statistics.
+        self.capture_number = None
+        self.frame_count = 0
+        self.bad_checksum_count = 0
+        # The sample rate of each sensor, measured from the timestamps (see rate.py).
+        self.tongue_rate = None
+        self.throat_rate = None
+        self.wall_seconds = 0
+        self.error = None
+
+    def run(self):
+        con = capture.make_con(resetting=True, timeout=4, port=self.port)
+        try:
+            con.open()
+            capture.wait_for_sig_ready(con)
+            # The read timeout only had to be long enough for the board to reset.
+            con.timeout = 1
+            con.write(SIG_REQUEST)
+            con.flush()
+
+            start_wall = time.perf_counter()
+            self.capture_number = capture.do_writing_capture(con, duration_seconds=self.duration_seconds,
+                                                             stop_event=self.stop_event, trigger=self.trigger)
+            self.wall_seconds = time.perf_counter() - start_wall
+        except (SerialException, RequestDeniedException) as e:
+            # One bad device shouldn't stop the others.
+            self.error = e
+            return
+        finally:
+            con.close()
+
+        row = catalog.get_capture(self.capture_number)
+        self.frame_count = row['frame_count']
+        self.bad_checksum_count = row['bad_checksum_count']
+        self.tongue_rate = row['tongue_rate']
+        self.throat_rate = row['throat_rate']
+
+
+def print_statistics(recorders, cpu_seconds, wall_seconds):
+    """Print a line of statistics for every device, then the totals, given the CPU time (of the whole process)
+    and the wall time that every capture took together."""
+    print('{:<16}{:>9}{:>10}{:>10}{:>10}{:>10}{:>16}'.format(
+        'port', 'capture', 'frames', 'bad', 'seconds', 'frames/s', 'sensor Hz'))
+    for recorder in recorders:
+        if recorder.error is not None:
+            print('{:<16}failed: {}'.format(recorder.port, recorder.error))
+            continue
+        print('{:<16}{:>9}{:>10}{:>10}{:>10.1f}{:>10.0f}{:>16}'.format(
+            recorder.port, recorder.capture_number, recorder.frame_count, recorder.bad_checksum_count,
+            recorder.wall_seconds, recorder.frame_count / recorder.wall_seconds if recorder.wall_seconds else 0,
+            '/'.join('{:.0f}'.format(rate) if rate is not None else '?'
+                     for rate in (recorder.tongue_rate, recorder.throat_rate))))
+
+    succeeded = [recorder for recorder in recorders if recorder.error is None]
+    total_frames = sum(recorder.frame_count for recorder in succeeded)
+    # The CPU time per frame should not grow with the number of devices.
+    print('$ {} devices, {} frames, {:.1f} us of CPU per frame ({:.1f}% of a core).'.format(
+        len(succeeded), total_frames, 1e6 * cpu_seconds / total_frames if total_frames else 0,
+        100 * cpu_seconds / wall_seconds if wall_seconds else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""A catalog of every capture, kept in a small SQLite database next to the raw data.
+
+Before the catalog, listing the captures meant scanning 'raw/' and opening every name.txt,
+and finding a free capture number meant probing for directories from 0 upward.
+Now both are a single indexed query, no matter how many captures are in the archive.
+
+The capture subdirectories are still the real data; the catalog only indexes them.
+It is updated (in a transaction) whenever a capture is made, named, processed, or deleted.
+The metadata that the transmitter reports at the end of a capture is recorded too (see set_metadata).
+Processing also records summary statistics of the capture and of every chunk of time of it (see set_stats),
+so that the captures of interest can be found with find_captures without opening any of them.
+If the catalog is missing (for example, on an archive that predates it) it is rebuilt from the subdirectories.
+Run this file directly to force such a rebuild.
+
+Every function opens its own short-lived connection, so the catalog may be used from any thread.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import sqlite3
+import shutil
+import time
+from contextlib import contextmanager
+
+from util import *
+
+# Where the raw and processed captures are kept (see capture.py and process.py).
+RAW_DIRECTORY_ROOT = 'raw/'
+PROCESSED_DIRECTORY_ROOT = 'processed/'
+# Where the compressed archives of captures are kept (see archive.py).
+ARCHIVE_DIRECTORY_ROOT = 'archive/'
+
+CATALOG_FILENAME = RAW_DIRECTORY_ROOT + 'catalog.sqlite3'
+
+# How long to wait for another thread (or process) to finish writing before giving up.
+LOCK_TIMEOUT_SECONDS = 10
+
+# The status of a capture.
+STATUS_CAPTURING = 'capturing'
+STATUS_COMPLETE = 'complete'
+# The capture was cut short (e.g. the board was disconnected), but everything that was received was kept.
+STATUS_TRUNCATED = 'truncated'
+
+# Each migration brings the schema up by one version. The current version is kept in PRAGMA user_version.
+# Never change a migration once it has been released, add a new one instead.
+_MIGRATIONS = (
+    """
+    CREATE TABLE captures (
+        number INTEGER PRIMARY KEY,
+        title TEXT,
+        status TEXT NOT NULL,
+        started REAL,
+        finished REAL,
+        duration_seconds REAL,
+        capture_rate INTEGER,
+        gyro_scale INTEGER,
+        accl_scale INTEGER,
+        frame_count INTEGER,
+        tongue_frame_count INTEGER,
+        throat_frame_count INTEGER,
+        bad_checksum_count INTEGER,
+        processed INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX captures_started ON captures (started);
+    """,
+    # The serial port that a capture was recorded from, since we may record from several transmitters at once.
+    """
+    ALTER TABLE captures ADD COLUMN port TEXT;
+    """,
+    # The sample rate (in Hz) that each sensor really ran at, measured from the timestamps (see rate.py).
+    """
+    ALTER TABLE captures ADD COLUMN tongue_rate REAL;
+    ALTER TABLE captures ADD COLUMN throat_rate REAL;
+    """,
+    # Summary statistics, computed when a capture is processed (see process.process_stats),
+    # so that captures (and the parts of them) that are of interest can be found without opening them.
+    """
+    ALTER TABLE captures ADD COLUMN press_count INTEGER;
+    ALTER TABLE captures ADD COLUMN gap_count INTEGER;
+    ALTER TABLE captures ADD COLUMN tongue_gyro_m_min REAL;
+    ALTER TABLE captures ADD COLUMN tongue_gyro_m_max REAL;
+    ALTER TABLE captures ADD COLUMN tongue_gyro_m_mean REAL;
+    ALTER TABLE captures ADD COLUMN tongue_gyro_m_p50 REAL;
+    ALTER TABLE captures ADD COLUMN tongue_gyro_m_p95 REAL;
+    ALTER TABLE captures ADD COLUMN tongue_gyro_m_p99 REAL;
+    ALTER TABLE captures ADD COLUMN throat_gyro_m_min REAL;
+    ALTER TABLE captures ADD COLUMN throat_gyro_m_max REAL;
+    ALTER TABLE captures ADD COLUMN throat_gyro_m_mean REAL;
+    ALTER TABLE captures ADD COLUMN throat_gyro_m_p50 REAL;
+    ALTER TABLE captures ADD COLUMN throat_gyro_m_p95 REAL;
+    ALTER TABLE captures ADD COLUMN throat_gyro_m_p99 REAL;
+    CREATE TABLE chunk_stats (
+        capture INTEGER NOT NULL,
+        sensor TEXT NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        frame_count INTEGER NOT NULL,
+        gyro_m_min REAL,
+        gyro_m_max REAL,
+        gyro_m_mean REAL,
+        press_count INTEGER NOT NULL,
+        PRIMARY KEY (capture, sensor, start_time)
+    );
+    """,
+    # The metadata that the transmitter reported in the trailer of a capture (see capture.parse_trailer), one row per key.
+    # The values keep their type (SQLite allows that), so numbers can be compared in find_captures.
+    """
+    CREATE TABLE metadata (
+        capture INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value,
+        PRIMARY KEY (capture, key)
+    );
+    """,
+)
+
+# The summary statistics of a capture that set_stats records (see the last migration).
+STATS_COLUMNS = (
+    'press_count', 'gap_count',
+    'tongue_gyro_m_min', 'tongue_gyro_m_max', 'tongue_gyro_m_mean', 'tongue_gyro_m_p50', 'tongue_gyro_m_p95', 'tongue_gyro_m_p99',
+    'throat_gyro_m_min', 'throat_gyro_m_max', 'throat_gyro_m_mean', 'throat_gyro_m_p50', 'throat_gyro_m_p95', 'throat_gyro_m_p99',
+)
+# And of each chunk of a sensor.
+CHUNK_STATS_COLUMNS = ('start_time', 'end_time', 'frame_count', 'gyro_m_min', 'gyro_m_max', 'gyro_m_mean', 'press_count')
+
+
+@contextmanager
+def connect():
+    """Open the catalog and yield a connection inside of a transaction.
+
+    The transaction is committed when the block finishes, or rolled back if an exception escapes it.
+    Rows can be accessed by column name.
+    """
+    is_new = not os.path.isfile(CATALOG_FILENAME)
+    con = sqlite3.connect(CATALOG_FILENAME, timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    try:
+        # Take the write lock right away, so that two threads can't both allocate the same capture number.
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            _migrate(con)
+            if is_new:
+                _import_existing_captures(con)
+            yield con
+        except BaseException:
+            con.execute('ROLLBACK')
+            raise
+        else:
+            con.execute('COMMIT')
+    finally:
+        con.close()
+
+
+def _migrate(con):
+    """Bring the schema up to date."""
+    version = con.execute('PRAGMA user_version').fetchone()[0]
+    for migration in _MIGRATIONS[version:]:
+        for statement in migration.split(';'):
+            if statement.strip():
+                con.execute(statement)
+    if version != len(_MIGRATIONS):
+        # PRAGMA does not accept parameters.
+        con.execute('PRAGMA user_version = {}'.format(len(_MIGRATIONS)))
+
+
+def _import_existing_captures(con):
+    """Fill the catalog from the capture subdirectories that are already on disk."""
+    for capture_directory in os.listdir(RAW_DIRECTORY_ROOT):
+        # Each capture subdirectory should start with 'capture*'. Ignore all other garbage in the directory.
+        if not capture_directory.startswith('capture') or not os.path.isdir(RAW_DIRECTORY_ROOT + capture_directory):
+            continue
+        number = int(capture_directory.replace('capture', ''))
+        path = RAW_DIRECTORY_ROOT + capture_directory + '/'
+
+        try:
+            with open(path + 'name.txt') as name_file:
+                title = name_file.readline()
+        except FileNotFoundError:
+            title = None
+
+        # The config is saved as empty files such as 'capture_rate_833' (see capture.py).
+        config = {'capture_rate': None, 'gyro_scale': None, 'accl_scale': None}
+        for filename in os.listdir(path):
+            for key in config:
+                if filename.startswith(key + '_'):
+                    config[key] = int(filename[len(key) + 1:])
+
+        con.execute('INSERT OR REPLACE INTO captures (number, title, status, started, capture_rate, gyro_scale, accl_scale, processed) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (number, title, STATUS_COMPLETE, os.path.getmtime(path),
+                     config['capture_rate'], config['gyro_scale'], config['accl_scale'],
+                     os.path.isfile(path + 'processed')))
+
+        # The trailer is kept with the capture (see capture.do_writing_capture).
+        if os.path.isfile(path + 'trailer.txt'):
+            # capture imports us, so we import it only when we need it.
+            from capture import parse_trailer
+            with open(path + 'trailer.txt') as trailer_file:
+                _insert_metadata(con, number, parse_trailer(trailer_file.read()))
+
+
+def rebuild():
+    """Throw away the catalog and build it again from the capture subdirectories."""
+    if os.path.isfile(CATALOG_FILENAME):
+        os.remove(CATALOG_FILENAME)
+    with connect():
+        pass
+
+
+def allocate_capture_number(title=None, port=None):
+    """Reserve and return the next free capture number.
+
+    Several threads (or processes) may allocate at once, they will always get different numbers.
+
+    The capture is entered into the catalog with STATUS_CAPTURING until finish_capture is called.
+    Its subdirectory is not created here.
+    """
+    with connect() as con:
+        number = con.execute('SELECT COALESCE(MAX(number) + 1, 0) FROM captures').fetchone()[0]
+        # A subdirectory that the catalog doesn't know about (maybe it was copied in by hand) must not be overwritten.
+        while os.path.isdir(RAW_DIRECTORY_ROOT + get_capture_subdirectory(number)):
+            number += 1
+        con.execute('INSERT INTO captures (number, title, status, started, port) VALUES (?, ?, ?, ?, ?)',
+                    (number, title, STATUS_CAPTURING, time.time(), port))
+    return number
+
+
+def finish_capture(number, *, config, frame_count, tongue_frame_count, throat_frame_count, bad_checksum_count,
+                   duration_seconds, tongue_rate=None, throat_rate=None, status=STATUS_COMPLETE):
+    """Record the results of a capture and mark it as complete (or as truncated)."""
+    with connect() as con:
+        con.execute('UPDATE captures SET status = ?, finished = ?, duration_seconds = ?, '
+                    'capture_rate = ?, gyro_scale = ?, accl_scale = ?, '
+                    'frame_count = ?, tongue_frame_count = ?, throat_frame_count = ?, bad_checksum_count = ?, '
+                    'tongue_rate = ?, throat_rate = ? '
+                    'WHERE number = ?',
+                    (status, time.time(), duration_seconds,
+                     config.capture_rate, config.gyro_scale, config.accl_scale,
+                     frame_count, tongue_frame_count, throat_frame_count, bad_checksum_count,
+                     tongue_rate, throat_rate,
+                     number))
+
+
+def set_title(number, title):
+    """Change the title of a capture."""
+    with connect() as con:
+        con.execute('UPDATE captures SET title = ? WHERE number = ?', (title, number))
+
+
+def set_processed(number, processed=True):
+    """Mark a capture as processed (or not)."""
+    with connect() as con:
+        con.execute('UPDATE captures SET processed = ? WHERE number = ?', (int(processed), number))
+
+
+def delete_capture(number):
+    """Remove a capture from the catalog, along with its raw and processed subdirectories and its archive."""
+    with connect() as con:
+        con.execute('DELETE FROM chunk_stats WHERE capture = ?', (number,))
+        con.execute('DELETE FROM metadata WHERE capture = ?', (number,))
+        con.execute('DELETE FROM captures WHERE number = ?', (number,))
+        # The files are removed while we still hold the write lock, so nobody can list this capture halfway through its removal.
+        # The call to shutil.rmtree with ignore_errors=True will recursively delete a directory.
+        shutil.rmtree(RAW_DIRECTORY_ROOT + get_capture_subdirectory(number), ignore_errors=True)
+        shutil.rmtree(PROCESSED_DIRECTORY_ROOT + get_capture_subdirectory(number), ignore_errors=True)
+        # See archive.get_archive_filename.
+        archive_filename = ARCHIVE_DIRECTORY_ROOT + get_capture_subdirectory(number).rstrip('/') + '.elijah'
+        if os.path.isfile(archive_filename):
+            os.remove(archive_filename)
+
+
+def set_stats(number, stats, chunk_stats, duration_seconds=None):
+    """Record the summary statistics of a capture, replacing any that it had.
+
+    stats is a dict with a value for each of STATS_COLUMNS, and chunk_stats a dict from sensor name
+    to a list of tuples, one per chunk, in the order of CHUNK_STATS_COLUMNS.
+    The duration is only recorded if the capture didn't already have one (old captures don't).
+    """
+    with connect() as con:
+        con.execute('UPDATE captures SET {}, duration_seconds = COALESCE(duration_seconds, ?) WHERE number = ?'.format(
+                        ', '.join(column + ' = ?' for column in STATS_COLUMNS)),
+                    [stats[column] for column in STATS_COLUMNS] + [duration_seconds, number])
+        con.execute('DELETE FROM chunk_stats WHERE capture = ?', (number,))
+        con.executemany('INSERT INTO chunk_stats (capture, sensor, {}) VALUES (?, ?{})'.format(
+                            ', '.join(CHUNK_STATS_COLUMNS), ', ?' * len(CHUNK_STATS_COLUMNS)),
+                        ((number, sensor_name) + tuple(chunk) for sensor_name, chunks in chunk_stats.items() for chunk in chunks))
+
+
+def set_metadata(number, metadata):
+    """Record the metadata of a capture (a dict of key to value, see capture.parse_trailer), replacing any that it had."""
+    with connect() as con:
+        con.execute('DELETE FROM metadata WHERE capture = ?', (number,))
+        _insert_metadata(con, number, metadata)
+
+
+def _insert_metadata(con, number, metadata):
+    con.executemany('INSERT OR REPLACE INTO metadata (capture, key, value) VALUES (?, ?, ?)',
+                    ((number, key, value) for key, value in metadata.items()))
+
+
+def get_metadata(number):
+    """Return the metadata of a capture as a dict (empty if it has none)."""
+    with connect() as con:
+        return dict(con.execute('SELECT key, value FROM metadata WHERE capture = ? ORDER BY key', (number,)).fetchall())
+
+
+def find_captures(condition, parameters=()):
+    """Return the catalog rows of the captures (that are not still being recorded) that match an SQL condition,
+    in order of capture number. Only the catalog is read, so this is fast however many captures there are, e.g.
+
+        find_captures('press_count > ? AND throat_gyro_m_max > ?', (20, 150))
+
+    The metadata can be used in a subquery, e.g.
+
+        find_captures("number IN (SELECT capture FROM metadata WHERE key = 'peakCount' AND value > ?)", (100,))
+
+    Captures that were not processed since the statistics were added have NULL statistics, and never match such conditions.
+    """
+    with connect() as con:
+        return con.execute('SELECT * FROM captures WHERE status != ? AND ({}) ORDER BY number'.format(condition),
+                           (STATUS_CAPTURING,) + tuple(parameters)).fetchall()
+
+
+def get_chunk_stats(number, sensor_name):
+    """Return the statistics of each chunk of a sensor of a capture, in order of time (an empty list if there are none)."""
+    with connect() as con:
+        return con.execute('SELECT * FROM chunk_stats WHERE capture = ? AND sensor = ? ORDER BY start_time',
+                           (number, sensor_name)).fetchall()
+
+
+def get_capture(number):
+    """Return the catalog row of a capture, or None if there is no such capture."""
+    with connect() as con:
+        return con.execute('SELECT * FROM captures WHERE number = ?', (number,)).fetchone()
+
+
+def list_captures():
+    """Return the catalog rows of every capture that is not still being recorded, in order of capture number."""
+    with connect() as con:
+        return con.execute('SELECT * FROM captures WHERE status != ? ORDER BY number', (STATUS_CAPTURING,)).fetchall()
+
+
+def get_display_title(row):
+    """Return the title that should be shown for a capture.
+
+    If a capture has no title we just use the capture number.
+    So capture 00013 will be shown as '13' if it has not otherwise been provided a name.
+    """
+    return row['title'] if row['title'] is not None else str(row['number'])
+
+
+if __name__ == '__main__':
+    rebuild()
+    # debug
+    print('$ Cataloged', len(list_captures()), 'captures.')
@@ -14,6 +14,12 @@ THROAT_SENSOR_ID = 1
 TRANSMITTER_BAUD_RATE = 1000000
 MS_PER_SECOND = 1000
 
+# The 16 bit ms timestamps of the transmitter overflow at this value (see util.TimeUnwrapper).
+TIME_OVERFLOW = 2 ** 16
+
+# The thumbnail of a capture, in its processed subdirectory (see render.py). The GUI shows it in the capture list.
+THUMBNAIL_FILENAME = 'thumbnail.png'
+
 # Signals. See spec/ for more information on what they mean.
 
 # Transmitter is ready for requests.
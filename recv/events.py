@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Extract the window of sensor data around every button press of every capture, for research.
+
+The result is a single array of shape (events, channels, samples) in EVENTS_DIRECTORY_ROOT + WINDOWS_FILENAME,
+which can be memory-mapped by analysis scripts so that they never have to hold the whole thing in memory:
+
+    windows = np.load('events/windows.npy', mmap_mode='r')
+
+Row i of EVENTS_FILENAME tells which capture event i came from and the time of its button press.
+The channels are the readings of the tongue and then of the throat, in the order of EVENT_CHANNELS.
+
+Every window covers -window_ms to +window_ms around its press, resampled (by linear interpolation)
+to one sample every SAMPLE_INTERVAL_MS, so that the windows line up even if the captures had different capture rates.
+Samples where the capture has no data (before it began or after it ended) are NaN.
+
+Each capture is read in one pass: the windows are merged where they overlap, and each merged range is read
+with query.load_range, which only reads that part of the capture. The captures are handled in a pool of processes,
+each writing its windows straight into its own slice of the output file.
+
+The half-width of the window (in ms) can be given as the first command line argument.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from util import *
+import catalog
+
+EVENTS_DIRECTORY_ROOT = 'events/'
+WINDOWS_FILENAME = 'windows.npy'
+EVENTS_FILENAME = 'events.csv'
+
+# How far (in ms) the window extends to either side of the button press.
+WINDOW_MS = 500
+# The spacing (in ms) of the samples of a window.
+SAMPLE_INTERVAL_MS = 2
+
+SENSOR_NAMES = ('tongue', 'throat')
+READING_COLUMNS = ('gyroX', 'gyroY', 'gyroZ', 'acclX', 'acclY', 'acclZ')
+EVENT_CHANNELS = tuple(sensor_name + '_' + column for sensor_name in SENSOR_NAMES for column in READING_COLUMNS)
+
+
+def main():
+    window_ms = int(sys.argv[1]) if len(sys.argv) > 1 else WINDOW_MS
+    capture_numbers = [row['number'] for row in catalog.list_captures()]
+
+    with ProcessPoolExecutor() as executor:
+        # First find out how many presses each capture has, so we know where its windows go in the output file.
+        press_times = list(executor.map(load_press_times, capture_numbers))
+        event_count = sum(len(times) for times in press_times)
+        # debug
+        print('$ Found', event_count, 'button presses in', len(capture_numbers), 'captures.')
+
+        os.makedirs(EVENTS_DIRECTORY_ROOT, exist_ok=True)
+        windows = np.lib.format.open_memmap(EVENTS_DIRECTORY_ROOT + WINDOWS_FILENAME, mode='w+', dtype=np.float32,
+                                            shape=(event_count, len(EVENT_CHANNELS), get_sample_count(window_ms)))
+        # Make sure the header is on the disk before the workers open the file.
+        windows.flush()
+        del windows
+
+        with open(EVENTS_DIRECTORY_ROOT + EVENTS_FILENAME, 'w') as events_file:
+            events_file.write(format_csv(('event', 'capture', 'time')) + '\n')
+            futures = []
+            first_event = 0
+            for capture_number, times in zip(capture_numbers, press_times):
+                for i, time in enumerate(times):
+                    events_file.write(format_csv((first_event + i, capture_number, time)) + '\n')
+                if len(times):
+                    futures.append(executor.submit(extract_windows, capture_number, times, first_event, window_ms))
+                first_event += len(times)
+
+        for future in futures:
+            future.result()
+
+    # debug
+    print('$ Wrote', event_count, 'windows to', EVENTS_DIRECTORY_ROOT + WINDOWS_FILENAME)
+
+
+def get_sample_count(window_ms):
+    """Return how many samples there are in a window."""
+    return 2 * window_ms // SAMPLE_INTERVAL_MS + 1
+
+
+def load_press_times(capture_number):
+    """Return the times of the button presses of a capture in order, processing it first if necessary."""
+    import pandas as pd
+    import process
+
+    button_filename = process.OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + 'button.csv'
+    if not os.path.isfile(button_filename):
+        process.process_capture(capture_number)
+    # In order, and each press only once (see process_button).
+    return np.unique(pd.read_csv(button_filename, delimiter=',').time.values.astype(np.int64))
+
+
+def extract_windows(capture_number, press_times, first_event, window_ms):
+    """Write the windows around the given (sorted) press times of a capture into the output file, starting at row first_event."""
+    import query
+
+    windows = np.load(EVENTS_DIRECTORY_ROOT + WINDOWS_FILENAME, mmap_mode='r+')
+    offsets = np.arange(-window_ms, window_ms + 1, SAMPLE_INTERVAL_MS)
+
+    # Merge the windows that overlap, so every part of the capture is read at most once.
+    spans = []
+    for time in press_times:
+        if spans and time - window_ms <= spans[-1][1]:
+            spans[-1][1] = time + window_ms
+        else:
+            spans.append([time - window_ms, time + window_ms])
+
+    event = first_event
+    for start_time, end_time in spans:
+        # The presses whose windows are in this span.
+        span_press_times = press_times[(press_times - window_ms >= start_time) & (press_times + window_ms <= end_time)]
+        for sensor_number, sensor_name in enumerate(SENSOR_NAMES):
+            data = query.load_range(capture_number, sensor_name, start_time, end_time, ('time',) + READING_COLUMNS)
+            for i, time in enumerate(span_press_times):
+                for column_number, column in enumerate(READING_COLUMNS):
+                    channel = sensor_number * len(READING_COLUMNS) + column_number
+                    if len(data['time']):
+                        windows[event + i, channel] = np.interp(time + offsets, data['time'], data[column],
+                                                                left=np.nan, right=np.nan)
+                    else:
+                        windows[event + i, channel] = np.nan
+        event += len(span_press_times)
+
+    windows.flush()
+
+
+if __name__ == '__main__':
+    main()
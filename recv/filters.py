@@ -0,0 +1,261 @@
+"""Streaming digital filters, which give the same result whether the data comes all at once or a block at a time.
+
+Every filter here keeps its state between calls to process, so a capture can be filtered live, block by block
+(see make_filter_consumer), or offline in chunks of a file (see process.process_filtered), and the output is the same.
+
+Biquad is a second order IIR filter (we design low-pass and high-pass filters with the formulas of the
+'Audio EQ Cookbook'), and Cascade runs several of them one after another, e.g. for a 4th order Butterworth filter.
+An IIR filter depends on its own previous outputs, so it can't simply be vectorized over the samples.
+Instead we split the input into blocks of BLOCK_LENGTH samples and solve each block at once:
+the output of a block is its filtered input (a matrix product with the impulse response of the filter)
+plus the response of the filter to the state that the previous block left behind.
+Every channel is filtered at once, too.
+
+MovingStats gives the mean, variance and RMS of the last window samples, at a constant cost per sample
+(from running sums), however long the window is.
+
+SensorFilter puts these together the way we use them for a sensor: a high-pass filter removes the slow drift
+of the readings (what calibration can't remove), a low-pass filter removes the noise above the frequencies
+of swallowing (see spectral.SWALLOW_FREQUENCY_MAX), and then we take the gyro magnitude and its moving RMS.
+"""
+
+__author__ = 'Joseph Rubin'
+
+from math import cos, pi, sin, sqrt
+
+import numpy as np
+
+from const import *
+from calibration_generated import *
+from pipeline import Consumer, DROP_OLDEST
+from util import SIXTEEN_BIT_MAX_VALUE, TimeUnwrapper
+
+# The filters are solved this many samples at a time. Larger blocks mean fewer steps but more work per step.
+BLOCK_LENGTH = 128
+
+# The Q factors of the biquads of Butterworth filters, by order. (A Butterworth biquad on its own has a Q of 1/sqrt(2).)
+BUTTERWORTH_Q = {
+    2: (1 / sqrt(2),),
+    4: (0.54119610, 1.30656296),
+    6: (0.51763809, 0.70710678, 1.93185165),
+}
+
+# SensorFilter settings.
+HIGH_PASS_HZ = 0.5
+LOW_PASS_HZ = 40.0
+FILTER_ORDER = 4
+MOVING_WINDOW_SECONDS = 0.25
+
+# The reading fields of a frame (see frame.py), in the order that SensorFilter expects them.
+READING_NAMES = ('gyro_x', 'gyro_y', 'gyro_z', 'accl_x', 'accl_y', 'accl_z')
+
+# What a SensorFilter returns, in order. The readings are filtered, and the moving statistics are of the gyro magnitude.
+FILTER_HEADERS = ('time', 'gyro_m', 'gyro_x', 'gyro_y', 'gyro_z', 'accl_x', 'accl_y', 'accl_z', 'gyro_m_rms', 'gyro_m_std')
+
+
+class Biquad(object):
+    """A second order IIR filter with coefficients b (numerator) and a (denominator, with a[0] == 1)."""
+
+    def __init__(self, b, a, block_length=BLOCK_LENGTH):
+        self.b = np.asarray(b, dtype=np.float64)
+        self.a = np.asarray(a, dtype=np.float64)
+        _, a1, a2 = self.a
+
+        # The impulse response of the recursive part of the filter, 1 / (1 + a1 z^-1 + a2 z^-2),
+        # and its response to each of the two previous outputs, all for a whole block.
+        impulse = _recursive_response(a1, a2, block_length, x0=1)
+        from_y1 = _recursive_response(a1, a2, block_length, y1=1)
+        from_y2 = _recursive_response(a1, a2, block_length, y2=1)
+        # A lower triangular matrix, so that (matrix @ v)[n] is the sum of impulse[n - k] * v[k].
+        indexes = np.arange(block_length)
+        lags = indexes[:, None] - indexes[None, :]
+        self.matrix = np.where(lags >= 0, impulse[np.maximum(lags, 0)], 0)
+        self.from_y1 = from_y1
+        self.from_y2 = from_y2
+
+        # The state: the last two inputs and outputs, per channel. None until the first call to process.
+        self.x1 = self.x2 = self.y1 = self.y2 = None
+
+    def reset(self):
+        self.x1 = self.x2 = self.y1 = self.y2 = None
+
+    def process(self, x):
+        """Filter x, of shape (samples, channels), continuing from where the previous call left off."""
+        x = np.asarray(x, dtype=np.float64)
+        if not len(x):
+            return x.copy()
+        if self.x1 is None:
+            # Start as if the first value had always been there, so that the filter doesn't ring at the start.
+            gain = self.b.sum() / self.a.sum()
+            self.x1 = self.x2 = x[0].copy()
+            self.y1 = self.y2 = x[0] * gain
+
+        output = np.empty_like(x)
+        block_length = len(self.from_y1)
+        for start in range(0, len(x), block_length):
+            block = x[start:start + block_length]
+            length = len(block)
+
+            # The non-recursive part, b0 x[n] + b1 x[n - 1] + b2 x[n - 2], using the inputs of the previous block.
+            previous = np.concatenate((self.x2[None], self.x1[None], block))
+            v = self.b[0] * previous[2:] + self.b[1] * previous[1:-1] + self.b[2] * previous[:-2]
+
+            y = self.matrix[:length, :length] @ v \
+                + self.from_y1[:length, None] * self.y1 + self.from_y2[:length, None] * self.y2
+            output[start:start + length] = y
+
+            self.x1, self.x2 = previous[-1], previous[-2]
+            self.y1, self.y2 = y[-1], (y[-2] if length >= 2 else self.y1)
+        return output
+
+
+def _recursive_response(a1, a2, length, *, x0=0, y1=0, y2=0):
+    """Run y[n] = x[n] - a1 y[n - 1] - a2 y[n - 2] for length samples, where x is x0 at n = 0 and zero after,
+    and y1, y2 are the outputs before the start."""
+    y = np.zeros(length)
+    for n in range(length):
+        y[n] = (x0 if n == 0 else 0) - a1 * y1 - a2 * y2
+        y1, y2 = y[n], y1
+    return y
+
+
+class Cascade(object):
+    """Several filters, one after another."""
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+
+    def process(self, x):
+        for f in self.filters:
+            x = f.process(x)
+        return x
+
+
+def make_biquad(kind, cutoff_hz, sample_rate, q=1 / sqrt(2)):
+    """Design a 'lowpass' or 'highpass' biquad (see the Audio EQ Cookbook)."""
+    w0 = 2 * pi * cutoff_hz / sample_rate
+    alpha = sin(w0) / (2 * q)
+    if kind == 'lowpass':
+        b = ((1 - cos(w0)) / 2, 1 - cos(w0), (1 - cos(w0)) / 2)
+    elif kind == 'highpass':
+        b = ((1 + cos(w0)) / 2, -(1 + cos(w0)), (1 + cos(w0)) / 2)
+    else:
+        raise ValueError('Unknown kind of filter: ' + kind)
+    a0 = 1 + alpha
+    a = (1, -2 * cos(w0), 1 - alpha)
+    return Biquad([value / a0 for value in b], [value / a0 for value in a])
+
+
+def make_butterworth(kind, cutoff_hz, sample_rate, order=FILTER_ORDER):
+    """Design a Butterworth 'lowpass' or 'highpass' filter of an even order, as a cascade of biquads."""
+    return Cascade(make_biquad(kind, cutoff_hz, sample_rate, q) for q in BUTTERWORTH_Q[order])
+
+
+class MovingStats(object):
+    """The mean, variance and RMS of the last window samples of every channel.
+
+    Until window samples have been seen, the statistics are of every sample so far.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        # The last window - 1 samples, which the next block needs.
+        self.history = None
+
+    def reset(self):
+        self.history = None
+
+    def process(self, x):
+        """Return the moving mean, variance and RMS of x (of shape (samples, channels)), each of the same shape as x."""
+        x = np.asarray(x, dtype=np.float64)
+        history = self.history if self.history is not None else np.zeros((0,) + x.shape[1:])
+        extended = np.concatenate((history, x))
+
+        # Running sums, from which the sum of any window is a single subtraction.
+        # We only sum over this block (and the history), so the sums never get big enough to lose precision.
+        zero = np.zeros((1,) + x.shape[1:])
+        sums = np.concatenate((zero, np.cumsum(extended, axis=0)))
+        square_sums = np.concatenate((zero, np.cumsum(extended ** 2, axis=0)))
+
+        ends = np.arange(len(history) + 1, len(extended) + 1)
+        starts = np.maximum(ends - self.window, 0)
+        counts = (ends - starts)[:, None]
+        mean = (sums[ends] - sums[starts]) / counts
+        mean_square = (square_sums[ends] - square_sums[starts]) / counts
+        # Rounding can make the variance slightly negative.
+        variance = np.maximum(mean_square - mean ** 2, 0)
+
+        self.history = extended[-(self.window - 1):] if self.window > 1 else extended[:0]
+        return mean, variance, np.sqrt(mean_square)
+
+
+class SensorFilter(object):
+    """Filters the frames of one sensor (see the top of this file)."""
+
+    def __init__(self, sample_rate, *, high_pass_hz=HIGH_PASS_HZ, low_pass_hz=LOW_PASS_HZ, order=FILTER_ORDER,
+                 moving_window_seconds=MOVING_WINDOW_SECONDS):
+        stages = [make_butterworth('highpass', high_pass_hz, sample_rate, order)]
+        # A low-pass filter above the nyquist frequency would do nothing (and can't be designed).
+        if low_pass_hz < sample_rate / 2:
+            stages.append(make_butterworth('lowpass', low_pass_hz, sample_rate, order))
+        self.filter = Cascade(stages)
+        self.moving_stats = MovingStats(max(1, int(round(moving_window_seconds * sample_rate))))
+
+    def process(self, times, readings):
+        """Filter readings, of shape (samples, 6) in the order gyro x, y, z, accl x, y, z.
+
+        Returns an array of shape (samples, len(FILTER_HEADERS)).
+        """
+        filtered = self.filter.process(readings)
+        gyro_m = np.sqrt((filtered[:, :3] ** 2).sum(axis=1))
+        _mean, variance, rms = self.moving_stats.process(gyro_m[:, None])
+        return np.column_stack((times, gyro_m, filtered, rms[:, 0], np.sqrt(variance[:, 0])))
+
+
+def make_filter_consumer(handler, *, policy=DROP_OLDEST, name='filter'):
+    """Return a consumer (see pipeline.py) that filters each sensor of a capture as it happens.
+
+    handler is called with (sensor_name, output) for every batch, where output is like that of SensorFilter.process.
+    The times are the timestamps of the transmitter, unwrapped. The frames are calibrated and scaled here,
+    the same way as capture.format_frame does it, and the filters use the declared capture rate,
+    just like process.process_filtered, so the output is the same as that of processing the capture afterwards.
+    """
+    filters = {}
+    # Per sensor: the calibration offsets, and the scales of the gyro and accl readings.
+    offsets = {}
+    scales = {}
+    # To unwrap the timestamps of each sensor, carried on from the previous batch.
+    unwrappers = {TONGUE_SENSOR_ID: TimeUnwrapper(), THROAT_SENSOR_ID: TimeUnwrapper()}
+
+    def start(config):
+        for sensor, sensor_calib in ((TONGUE_SENSOR_ID, calib.tongue), (THROAT_SENSOR_ID, calib.throat)):
+            filters[sensor] = SensorFilter(config.capture_rate)
+            offsets[sensor] = np.array((sensor_calib.gyro.x, sensor_calib.gyro.y, sensor_calib.gyro.z,
+                                        sensor_calib.accl.x, sensor_calib.accl.y, sensor_calib.accl.z))
+            scales[sensor] = np.repeat((config.gyro_scale / SIXTEEN_BIT_MAX_VALUE, config.accl_scale / SIXTEEN_BIT_MAX_VALUE), 3)
+
+    def filter_batch(batch, _config):
+        sensors = np.array([frame.flag.sensor for frame in batch]) if isinstance(batch, list) \
+            else np.frombuffer(batch.sensor, dtype=np.uint8)
+        columns = [[getattr(frame.reading, name) for frame in batch] for name in READING_NAMES] \
+            if isinstance(batch, list) else [np.frombuffer(getattr(batch, name), dtype=np.int16) for name in READING_NAMES]
+        times = np.array([frame.time for frame in batch]) if isinstance(batch, list) \
+            else np.frombuffer(batch.time, dtype=np.uint16)
+        readings = np.column_stack(columns).astype(np.float64)
+
+        for sensor, sensor_name in ((TONGUE_SENSOR_ID, 'tongue'), (THROAT_SENSOR_ID, 'throat')):
+            mask = sensors == sensor
+            if not mask.any():
+                continue
+            sensor_times = unwrappers[sensor].unwrap_array(times[mask])
+            sensor_readings = (readings[mask] - offsets[sensor]) * scales[sensor]
+            handler(sensor_name, filters[sensor].process(sensor_times, sensor_readings))
+        return True
+
+    # A live display can afford to miss a batch, but the filter state must then continue across the gap.
+    return Consumer(filter_batch, start_handler=start, policy=policy, name=name)
+
@@ -3,10 +3,16 @@
 By using __slots__, we essentially make a dictionary that we can access using '.' rather than '[]'.
 It also allows our editor to complete our typing,
 and the compiler will give us an error if we try to access an illegal field (rather than have a runtime error).
+
+A single Frame is three objects plus an int for every field, which adds up to hundreds of bytes per frame.
+To hold many frames (a batch, or a whole capture) use a FrameBlock, which keeps each field in a column
+(an array.array) so that a frame costs only 16 bytes.
 """
 
 __author__ = 'Joseph Rubin'
 
+from array import array
+
 
 class Reading(object):
     __slots__ = ['gyro_x', 'gyro_y', 'gyro_z', 'accl_x', 'accl_y', 'accl_z']
@@ -37,3 +43,80 @@ class Frame(object):
         self.time = time
         self.flag = flag
         self.reading = reading
+
+
+class FrameBlock(object):
+    """Many frames, stored column by column.
+
+    Each field is a column that can be accessed by name, e.g. block.gyro_x or block.sensor,
+    and works like a list of the values of that field (and can be given to numpy without copying).
+    Indexing or iterating over a block gives Frame objects, which are made on the fly, so code written
+    for lists of frames works with blocks too.
+
+    received is when (by time.perf_counter) the frames were read from the connection, or None if that isn't known.
+    """
+
+    # The type of each column (see the array module). The time and readings are 16 bit like on the transmitter.
+    COLUMNS = (
+        ('time', 'H'),
+        ('gyro_x', 'h'), ('gyro_y', 'h'), ('gyro_z', 'h'),
+        ('accl_x', 'h'), ('accl_y', 'h'), ('accl_z', 'h'),
+        ('end', 'B'), ('sensor', 'B'), ('button', 'B'),
+    )
+    __slots__ = [name for name, _typecode in COLUMNS] + ['received']
+
+    def __init__(self):
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self.received = None
+
+    def append(self, time, gyro_x, gyro_y, gyro_z, accl_x, accl_y, accl_z, end, sensor, button):
+        """Add a frame given the values of its fields."""
+        self.time.append(time)
+        self.gyro_x.append(gyro_x)
+        self.gyro_y.append(gyro_y)
+        self.gyro_z.append(gyro_z)
+        self.accl_x.append(accl_x)
+        self.accl_y.append(accl_y)
+        self.accl_z.append(accl_z)
+        self.end.append(end)
+        self.sensor.append(sensor)
+        self.button.append(button)
+
+    def append_frame(self, frame):
+        """Add a Frame."""
+        reading = frame.reading
+        self.append(frame.time, reading.gyro_x, reading.gyro_y, reading.gyro_z,
+                    reading.accl_x, reading.accl_y, reading.accl_z,
+                    frame.flag.end, frame.flag.sensor, frame.flag.button)
+
+    def extend(self, block):
+        """Add every frame of another block."""
+        for name, _typecode in self.COLUMNS:
+            getattr(self, name).extend(getattr(block, name))
+
+    def of_sensor(self, sensor):
+        """Return a new block of only the frames from the given sensor."""
+        return self.take([i for i, frame_sensor in enumerate(self.sensor) if frame_sensor == sensor])
+
+    def take(self, indexes):
+        """Return a new block of only the frames at the given indexes, in that order."""
+        block = FrameBlock()
+        block.received = self.received
+        for name, _typecode in self.COLUMNS:
+            column = getattr(self, name)
+            getattr(block, name).extend(column[i] for i in indexes)
+        return block
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        return Frame(self.time[index],
+                     Flag(end=self.end[index], sensor=self.sensor[index], button=self.button[index]),
+                     Reading(self.gyro_x[index], self.gyro_y[index], self.gyro_z[index],
+                             self.accl_x[index], self.accl_y[index], self.accl_z[index]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
@@ -8,21 +8,28 @@ Our strings are declared at the start of this file (see below) so they are not h
 
 __author__ = 'Joseph Rubin'
 
-import shutil
+import time
+# Used to measure how long it takes for the window to appear (see report_startup).
+_START_TIME = time.perf_counter()
+
+import queue
+import sys
 import threading
 
 import tkinter as tk
-import tkinter.scrolledtext
 import tkinter.messagebox as message
 import tkinter.simpledialog as dialog
-from serial import SerialException, SerialTimeoutException
+from serial import SerialException
 
-from gui_custom import CustomLabel, CustomFrame, CustomButton, BG_COLOR
+from gui_custom import CustomLabel, CustomFrame, CustomButton, CaptureList, BG_COLOR
 from const import *
 from util import *
-import plot_mag
-import process
 import capture
+import catalog
+from session import DeviceSession
+
+# Note that plot_mag and process are not imported here. They pull in pandas and matplotlib,
+# which take a long time to load, so the plot worker imports them the first time that a capture is plotted.
 
 # Strings.
 # In an attempt to separate data from code, please place all strings here, and do not hard-code in any of them!
@@ -32,6 +39,7 @@ STR_START_BUTTON = 'Start'
 STR_STOP_BUTTON = 'Stop'
 STR_ACTION_HEADER = 'New Capture'
 STR_CAPTURES_HEADER = 'Captures'
+STR_SEARCH = 'Search'
 STR_NAME_CAPTURE = '\nEnter a title for this capture,\nor press Cancel to delete it.\n'
 STR_NAME_CAPTURE_TITLE_BAR = 'Please Name Your Capture'
 STR_FOOTER = 'Developed by Sixdof Space.'
@@ -41,6 +49,11 @@ STR_STATUS_3 = 'Capturing...'
 STR_STATUS_4 = 'Entering title.'
 STR_STATUS_5 = 'Capture saved!'
 STR_STATUS_6 = 'Capture not saved.'
+STR_STATUS_7 = 'Board disconnected.\nWaiting for it to return.'
+STR_PLOT_TITLE_BAR = 'Capture {}'
+STR_PLOT_LOADING_TITLE_BAR = 'Capture {} (loading...)'
+STR_PLOT_ERROR_TITLE_BAR = 'Could not plot'
+STR_PLOT_ERROR = 'This capture could not be plotted.\n\n{}'
 
 # Fonts.
 FONT_MAIN = ('Helvetica', 12)
@@ -49,17 +62,28 @@ FONT_SUB_TITLE = ('Helvetica', 12)
 FONT_CLICK = ('Helvetica', 12, 'underline')
 FONT_FINE = ('Helvetica', 10)
 
+# When this environment variable is set, we show the window, report how long it took to appear, and quit.
+# See bench_startup.py.
+STARTUP_BENCHMARK_ENVIRONMENT_VARIABLE = 'ELIJAH_STARTUP_BENCHMARK'
+
 # Virtual events allow the spawned thread to interact with the main thread.
 # Used to kill the main thread.
 EVENT_DIE = '<<event_die>>'
-# We generate this when there was a good connection at the start of the program but the board was subsequently disconnected.
-# There is no way to salvage an invalidated connection (short of creating a new one)
-# so we respond to this event by showing an error message and terminating the program.
+# We generate this when the device session (see session.py) has a connection that is ready for a capture.
+EVENT_BOARD_CONNECTED = '<<event_board_connected>>'
+# We generate this when the device session lost the connection (the board was disconnected).
+# The session reconnects by itself when the board comes back, so we only have to wait for EVENT_BOARD_CONNECTED.
 EVENT_BOARD_DISCONNECTED = '<<event_board_disconnected>>'
 # Used when a capture is finished to update the state of the main thread and save the capture title.
 EVENT_CAPTURE_FINISHED = '<<event_capture_finished>>'
 # Used when we receive a SIG_DENIED. Update the state of the main thread.
 EVENT_CAPTURE_DENIED = '<<event_capture_denied>>'
+# Used when the plot worker has loaded a capture, so that the main thread can draw it.
+EVENT_PLOT_READY = '<<event_plot_ready>>'
+
+# How many recently plotted captures to keep in memory, so that switching between them is instant.
+PLOT_CACHE_SIZE = 8
+
 
 
 def main():
@@ -69,6 +93,12 @@ def main():
     if not os.path.isdir('processed'):
         os.mkdir('processed')
 
+    if os.environ.get(STARTUP_BENCHMARK_ENVIRONMENT_VARIABLE):
+        # We don't connect to the board, since that happens in the background and doesn't delay the window.
+        window = GraphicalWindow(connect=False)
+        window.report_startup()
+        return
+
     # Now build and show the GUI.
     window = GraphicalWindow()
     window.show()
@@ -81,27 +111,32 @@ class GraphicalWindow(object):
     member fields and methods. This way, we don't need to use global variables.
     """
 
-    def __init__(self):
+    def __init__(self, connect=True):
         # Instance variables that we won't construct later.
         # It is considered good practice to define all members in the constructor.
         self.FRM_files_panel = None
         self.FRM_action_panel = None
-        self.SCT_capture_panel = None
+        self.LST_capture_panel = None
         self.LBL_status = None
         self.BTN_start = None
         self.BTN_stop = None
         self.con = None
+        self.session = None
         self.capture_thread = None
-        # To ensure that we only show the disconnected error once (even though multiple
-        # threads may encounter the same error) we remember if it has already been triggered.
-        # We also use a threading lock to eliminate race conditions.
-        self.board_disconnected_triggered = False
-        self.board_disconnected_lock = threading.Lock()
+        # The plot window is made the first time that we plot something (see draw_plot).
+        self.TOP_plot = None
+        self.plot_axes = None
+        self.plot_canvas = None
+        # The capture that the user most recently asked to plot.
+        self.plot_capture_number = None
+        # The thumbnails shown in the capture panel, by capture number, as (file modification time, tk.PhotoImage).
+        self.thumbnails = {}
 
         # Root element of the GUI.
         self.root = tk.Tk()
         self.root.config(bg=BG_COLOR)
-        self.root.geometry('614x455')
+        # Wide enough for the thumbnails in the capture panel.
+        self.root.geometry('740x455')
         self.root.option_add('*Font', FONT_MAIN)
         self.root.title(STR_TITLE_BAR)
 
@@ -117,60 +152,26 @@ class GraphicalWindow(object):
 
         # Bind the virtual events.
         self.root.bind(EVENT_DIE, self.on_die)
+        self.root.bind(EVENT_BOARD_CONNECTED, self.on_board_connected)
         self.root.bind(EVENT_BOARD_DISCONNECTED, self.on_board_disconnected)
         self.root.bind(EVENT_CAPTURE_FINISHED, self.on_capture_finished)
         self.root.bind(EVENT_CAPTURE_DENIED, self.on_capture_denied)
-
-        def serial_initial_setup():
-            """This function will be called by a separate thread and its purpose is to establish a serial connection."""
-            # Make a connection right away and open it.
-            # This ensures that we reserve the serial device for the entire lifespan of this program.
-            self.con = capture.make_con(resetting=True, timeout=4)
-            try:
-                self.con.open()
-            except SerialException:
-                response = dialog.messagebox.askretrycancel(
-                    'Unplugged or shared serial device',
-                    'Please make sure the device is plugged in\n'
-                    'and no other program is using it.'
-                )
-                if response:
-                    # User clicked 'retry'.
-                    serial_initial_setup()
-                    return
-                else:
-                    # User clicked 'cancel'.
-                    # We can destroy the application even though we are not
-                    # on the main thread by invoking a virtual event.
-                    self.root.event_generate(EVENT_DIE)
-                    # Now we have to end our own thread.
-                    exit(0)
-
-            # Look for SIG_READY.
-            try:
-                capture.wait_for_sig_ready(self.con)
-            # Timeout.
-            except SerialException:
-                # If we timed out when waiting for SIG_READY that means the board was previously
-                # connected but subsequently disconnected.
-                self.root.event_generate(EVENT_BOARD_DISCONNECTED)
-                # Now close our own thread.
-                exit(1)
-            # debug
-            print('$ Got SIG_READY.')
-
-            # Since the Arduino is now fully booted, set the read timeout to a lower value.
-            # We only needed it to be so high in the first place because we needed to wait
-            # until the Arduino turned on before it could send the SIG_READY.
-            self.con.timeout = 1
-
-            # Now that the serial is set up and ready for a SIG_REQUEST,
-            # we allow the start button to be pressed.
-            self.BTN_start.config(state=tk.NORMAL)
-
-        # Set up the serial in a new thread so that we aren't waiting for the program to start.
-        # The start button will be disabled until this thread finishes.
-        threading.Thread(target=serial_initial_setup).start()
+        self.root.bind(EVENT_PLOT_READY, self.on_plot_ready)
+
+        # Captures are processed and loaded for plotting on this thread, so the GUI never waits for them.
+        self.plot_worker = PlotWorker(self.root)
+        self.plot_worker.start()
+
+        # The device session finds the board and connects to it in the background, so that we aren't waiting for the program to start.
+        # This includes finding the serial port of the board, which can be slow.
+        # It keeps the connection open (reserving the serial device) for the entire lifespan of this program,
+        # and connects again by itself if the board is unplugged and plugged back in.
+        # The start button will be disabled until the connection is ready.
+        if connect:
+            self.session = DeviceSession(on_ready=lambda _con: self.root.event_generate(EVENT_BOARD_CONNECTED),
+                                         on_lost=lambda: self.root.event_generate(EVENT_BOARD_DISCONNECTED))
+            self.session.start()
+            self.LBL_status.config(text=STR_STATUS_2)
 
     def make_action_panel(self, ctx):
         """The action panel is where you can make a new capture.
@@ -210,13 +211,13 @@ class GraphicalWindow(object):
         # Although our connection is not configured to have a write_timeout, attempting to write the SIG_REQUEST after the board has
         # been disconnected will almost immediately trigger one. Therefore, we can catch the exception to let us know that this capture was
         # started after the board was disconnected (and therefore has no possibility of being successful).
-        except SerialTimeoutException:
-            # Since the device has been disconnected, even if it was subsequently reconnected, the connection that we previously
-            # established has been invalidated and is no longer usable.
-            self.root.event_generate(EVENT_BOARD_DISCONNECTED)
+        except SerialException:
+            # The connection that we had is no longer usable. The session will make a new one when it can,
+            # and let us know with EVENT_BOARD_DISCONNECTED and then EVENT_BOARD_CONNECTED.
+            self.session.report_failure()
         else:
             # No exception occurred, spawn a new thread to do the capture itself (we don't want to hog the main/gui thread).
-            self.capture_thread = CaptureThread(self.con, self.root)
+            self.capture_thread = CaptureThread(self.con, self.session, self.root)
             self.capture_thread.start()
             # The capture is ongoing now so we can allow the user to press the Stop button.
             self.BTN_stop.config(state=tk.NORMAL)
@@ -234,12 +235,10 @@ class GraphicalWindow(object):
         # Although our connection is not configured to have a write_timeout, attempting to write the SIG_ENOUGH after the board has
         # been disconnected will almost immediately trigger one. Therefore, we can catch the exception to let us know that the board
         # was disconnected during the course of this capture.
-        except SerialTimeoutException:
-            # Since the device has been disconnected, even if it was subsequently reconnected, the connection that we previously
-            # established has been invalidated and is no longer usable.
-            # We can't kill the capture thread directly, but it will die by itself due to a reading timeout.
-            # All we must do is generate the virtual event to kill the GUI.
-            self.root.event_generate(EVENT_BOARD_DISCONNECTED)
+        except SerialException:
+            # The connection is no longer usable. The capture thread will stop by itself due to a reading timeout
+            # (keeping what it got), and the session will connect again when it can.
+            self.session.report_failure()
 
     def make_files_panel(self, ctx):
         """The files panel is the left side of the screen.
@@ -259,104 +258,136 @@ class GraphicalWindow(object):
         self.FRM_files_panel.pack(side=tk.LEFT, fill=tk.Y)
 
         # The files panel lists all the captures.
-        self.update_capture_panel()
+        self.make_capture_panel(self.FRM_files_panel)
 
-    def update_capture_panel(self):
-        """Remove the old capture panel if it exists and make a new one.
+    def make_capture_panel(self, ctx):
+        """The capture panel lists the captures, with a search box under it to filter them by title or date.
 
-        This should be called when we list the captures initially,
-        and whenever we add or remove a capture.
+        The list is built once. After that we insert and remove single captures as they are made and deleted.
         """
-        if self.SCT_capture_panel is not None:
-            self.SCT_capture_panel.pack_forget()
-        self.make_capture_panel(self.FRM_files_panel)
-        self.SCT_capture_panel.config(state=tk.DISABLED)
-        self.SCT_capture_panel.pack(fill=tk.X)
+        self.LST_capture_panel = CaptureList(ctx, on_click=self.on_click_capture, on_remove=self.on_click_remove,
+                                             click_font=FONT_CLICK, get_thumbnail=self.get_thumbnail)
+        # The captures are listed from the catalog, so we don't have to scan 'raw/' and open every name file.
+        self.LST_capture_panel.set_captures(make_capture_list_entry(row) for row in catalog.list_captures())
         # Scroll to the end of the box automatically to see the newest captures.
-        self.SCT_capture_panel.see('end')
+        self.LST_capture_panel.see_end()
 
-    def make_capture_panel(self, ctx):
-        # Use a scrolled text widget for our captures, since we want
-        # to be able to view all of them if they overflow the box.
-        self.SCT_capture_panel = tk.scrolledtext.ScrolledText(ctx, bd=0, highlightthickness=1,
-            width=16, height=10, spacing1=3, spacing3=3, borderwidth=0, cursor='hand2')
-        # The captures are each a single subdirectory within 'raw/'.
-        captures = os.listdir('raw/')
-        capture_names = list()
-        capture_numbers = list()
-        for capture_directory in captures:
-            # Each capture subdirectory should start with 'capture*'. Ignore all other garbage in the directory.
-            if not capture_directory.startswith('capture'):
-                continue
-            # Get the capture number and remove the padding '0's. E.g. capture00001 -> 1.
-            number = str(int(capture_directory.replace('capture', '')))
+        FRM_search = CustomFrame(ctx)
+        LBL_search = CustomLabel(FRM_search, text=STR_SEARCH, font=FONT_FINE)
+        search_text = tk.StringVar()
+        search_text.trace_add('write', lambda *_args: self.LST_capture_panel.set_filter(search_text.get()))
+        ENT_search = tk.Entry(FRM_search, textvariable=search_text, width=14, bd=0, highlightthickness=1)
+
+        self.LST_capture_panel.pack(fill=tk.X)
+        LBL_search.pack(side=tk.LEFT)
+        ENT_search.pack(side=tk.LEFT, padx=(4, 0))
+        FRM_search.pack(fill=tk.X, pady=(6, 0))
+
+    def get_thumbnail(self, capture_number):
+        """Return the thumbnail of a capture as a tk.PhotoImage, or None if it has not been rendered (see render.py).
+
+        Thumbnails are loaded once and kept, unless their file changes. They are tiny, so loading one is instant.
+        """
+        filename = 'processed/' + get_capture_subdirectory(capture_number) + THUMBNAIL_FILENAME
+        try:
+            modified = os.path.getmtime(filename)
+        except OSError:
+            return None
+        cached = self.thumbnails.get(capture_number)
+        if cached is None or cached[0] != modified:
             try:
-                with open('raw/' + capture_directory + '/name.txt') as name_file:
-                    name = name_file.readline()
-                # Instead of checking if the name file was there in the first place,
-                # we just catch the error if it was not found. Using try/except for
-                # logic is considered 'Pythonic', and we get the bonus of avoiding
-                # race conditions if the file was deleted after it was found but
-                # before it was read.
-            except FileNotFoundError:
-                # If there was no name file we just use the capture number
-                # as the name. So capture 00013 will be shown as '13' if
-                # it has not otherwise been provided a name.
-                name = number
-            capture_names.append(name)
-            capture_numbers.append(number)
-
-        for i, cap in enumerate(zip(capture_numbers, capture_names)):
-            capture_number = cap[0]
-            capture_name = cap[1]
-            # Configure 'tags' which are bits of text that can listen to events (they can be clicked).
-            # We make plot tags for each capture (ending with 'P') and delete tags for each capture (ending with 'D').
-            self.SCT_capture_panel.tag_config(capture_number + 'P', foreground='blue', font=FONT_CLICK)
-            self.SCT_capture_panel.tag_config(capture_number + 'D', foreground='red')
-
-            # Inner closure to save the state of the capture_name variable for the event.
-            # Without this, the final state of capture_number would be used for all of the event listeners.
-            def do_bind(c):
-                # Here, we actually do the binding of the tag to the click event.
-                # Note that '<Button-1>' refers to the left mouse button.
-                self.SCT_capture_panel.tag_bind(capture_number + 'P', '<Button-1>', lambda e: self.on_click_capture(e, c))
-                self.SCT_capture_panel.tag_bind(capture_number + 'D', '<Button-1>', lambda e: self.on_click_remove(e, c))
-
-            # Bind the tags we configured earlier to the click events.
-            do_bind(capture_number)
-            # When we insert the text, we register it with the tags we configured earlier (this is the third parameter of 'insert').
-            # This completes the process of configure tag -> bind tag -> register text with tag.
-            self.SCT_capture_panel.insert(tk.INSERT, ' ')
-            self.SCT_capture_panel.insert(tk.INSERT, 'X', capture_number + 'D')
-            self.SCT_capture_panel.insert(tk.INSERT, '  ')
-            # Add a newline after each one except the last.
-            self.SCT_capture_panel.insert(tk.INSERT, capture_name + ('' if i == len(capture_names) - 1 else '\n'), capture_number + 'P')
-
-    def on_click_capture(self, _event, capture_number):
-        """Called when the user clicks on a capture name. We wish to plot the capture."""
-        capture_directory = plot_mag.INPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
-        # If we have not processed the capture before, or if we think we have
-        # but the processed data doesn't exist, we process the capture now.
-        if not process.capture_was_processed(capture_number) \
-                or not os.path.isfile(capture_directory + 'tongue.csv') \
-                or not os.path.isfile(capture_directory + 'throat.csv'):
-            # debug
-            print('Processing...')
-            process.process_capture(capture_number)
-        plot_mag.plot('processed/' + get_capture_subdirectory(capture_number))
+                cached = (modified, tk.PhotoImage(file=filename))
+            except tk.TclError:
+                # Not a readable image (maybe it is still being written).
+                return None
+            self.thumbnails[capture_number] = cached
+        return cached[1]
+
+    def update_capture_panel(self, capture_number):
+        """Bring a single capture in the capture panel up to date with the catalog.
+
+        This should be called whenever we add, rename, or remove a capture.
+        """
+        row = catalog.get_capture(capture_number)
+        if row is None:
+            self.LST_capture_panel.remove(capture_number)
+        else:
+            self.LST_capture_panel.insert(*make_capture_list_entry(row))
+
+    def on_click_capture(self, capture_number):
+        """Called when the user clicks on a capture name. We wish to plot the capture.
 
-    def on_click_remove(self, _event, capture_number):
+        If we plotted the capture recently we draw it right away.
+        Otherwise the plot worker processes and loads it in the background, and on_plot_ready draws it.
+        """
+        self.plot_capture_number = capture_number
+        data = self.plot_worker.cache.get(capture_number)
+        if data is not None:
+            self.draw_plot(capture_number, data)
+            return
+
+        if self.TOP_plot is not None:
+            self.TOP_plot.title(STR_PLOT_LOADING_TITLE_BAR.format(capture_number))
+        self.plot_worker.request(capture_number)
+
+    def on_plot_ready(self, _event):
+        """This virtual event is called when the plot worker has finished loading a capture."""
+        # The plot worker renders the thumbnail of every capture that it loads, so there may be a new one now.
+        self.LST_capture_panel.refresh()
+        while not self.plot_worker.results.empty():
+            capture_number, data, error = self.plot_worker.results.get()
+            # If the user clicked on another capture in the meantime, we only want to show that one.
+            if capture_number != self.plot_capture_number:
+                continue
+            if error is not None:
+                message.showerror(STR_PLOT_ERROR_TITLE_BAR, STR_PLOT_ERROR.format(error))
+            else:
+                self.draw_plot(capture_number, data)
+
+    def draw_plot(self, capture_number, data):
+        """Draw a capture in the plot window, making the window the first time we need it.
+
+        The same window, figure, and canvas are reused for every plot.
+        """
+        # By the time that we get here the plot worker has already imported plot_mag and matplotlib,
+        # so these imports are instant.
+        import plot_mag
+        if self.TOP_plot is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            try:
+                from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+            except ImportError:
+                # Older versions of matplotlib.
+                from matplotlib.backends.backend_tkagg import NavigationToolbar2TkAgg as NavigationToolbar2Tk
+
+            self.TOP_plot = tk.Toplevel(self.root)
+            # Closing the window only hides it, so that we can reuse it for the next plot.
+            self.TOP_plot.protocol('WM_DELETE_WINDOW', self.TOP_plot.withdraw)
+            figure = Figure(figsize=(8, 5))
+            self.plot_axes = figure.add_subplot(111)
+            self.plot_canvas = FigureCanvasTkAgg(figure, master=self.TOP_plot)
+            # The toolbar lets us zoom and pan, like the window of plt.show() used to.
+            NavigationToolbar2Tk(self.plot_canvas, self.TOP_plot)
+            self.plot_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+        plot_mag.draw(self.plot_axes, data)
+        self.plot_canvas.draw_idle()
+        self.TOP_plot.title(STR_PLOT_TITLE_BAR.format(capture_number))
+        self.TOP_plot.deiconify()
+        self.TOP_plot.lift()
+
+    def on_click_remove(self, capture_number):
         """When the 'X' is clicked next to a capture name, remove the capture (delete the files)."""
         # debug
         print('Removing...')
         # Confirm that the user wishes to delete this capture.
         result = message.askquestion('Delete', 'Delete this capture?', icon='warning')
         if result == 'yes':
-            # The call to shutil.rmtree with ignore_errors=True will recursively delete a directory.
-            # This is what we need, since we want to remove the capture folder along with the data files inside of it.
-            shutil.rmtree('raw/' + get_capture_subdirectory(capture_number), ignore_errors=True)
-            shutil.rmtree('processed/' + get_capture_subdirectory(capture_number), ignore_errors=True)
-            self.update_capture_panel()
+            # This removes the capture folders along with the data files inside of them.
+            catalog.delete_capture(capture_number)
+            self.plot_worker.cache.discard(capture_number)
+            self.update_capture_panel(capture_number)
 
     def on_die(self, _event):
         """Virtual event handler to kill the program."""
@@ -365,24 +396,29 @@ class GraphicalWindow(object):
         # Any stray capture threads must be themselves killed to exit cleanly.
         self.root.destroy()
 
+    def on_board_connected(self, _event):
+        """The device session has a connection that is ready for a SIG_REQUEST, either for the first time or after the board was replugged."""
+        self.con = self.session.con
+        # debug
+        print('$ Session:', self.session.get_metrics())
+        # A capture thread that is still running on the old connection will fail by itself, and finish up in on_capture_finished.
+        if self.capture_thread is None or not self.capture_thread.is_alive():
+            self.LBL_status.config(text=STR_STATUS_1)
+            self.BTN_start.config(state=tk.NORMAL)
+
     def on_board_disconnected(self, _event):
         """The board was disconnected during the course of this program.
-        There is no way to salvage an invalidated connection so we must show an error and quit.
-        The other possibility would be to create a new connection on the fly,
-        but successfully recovering from whatever state we were in before the board was disconnected
-        would be very difficult since the circumstances vary wildly.
-        For example, if we were in the middle of a capture, it would be impossible to recover
-        because any real-time delay jeopardises the serial buffer and we will lose information (it will be overwritten by new data).
+
+        We can't capture until the device session connects to the board again (see on_board_connected),
+        which it does by itself as soon as the board is plugged back in, so the program keeps running.
+        If we were in the middle of a capture, the capture thread keeps every frame that it got as a truncated capture.
         """
-        self.board_disconnected_lock.acquire()
-        # Ensure that we only call this once.
-        if not self.board_disconnected_triggered:
-            self.board_disconnected_triggered = True
-            # Now that we have set the flag we may release the lock.
-            self.board_disconnected_lock.release()
-            dialog.messagebox.showerror('Board disconnected.', 'The board was disconnected. Press OK to quit,\nthen plug in the board and'
-                                                               ' relaunch this program.')
-            self.root.event_generate(EVENT_DIE)
+        self.con = None
+        self.BTN_start.config(state=tk.DISABLED)
+        self.BTN_stop.config(state=tk.DISABLED)
+        self.LBL_status.config(text=STR_STATUS_7)
+        # A capture that was cut short was still saved, so list it.
+        self.LST_capture_panel.set_captures(make_capture_list_entry(row) for row in catalog.list_captures())
 
     def on_capture_finished(self, _event):
         """This virtual event is called when the transmitter actually stops transmitting the capture."""
@@ -403,15 +439,26 @@ class GraphicalWindow(object):
             # Whatever name was given by capture.py will be overwritten with the user's choice.
             self.capture_thread.write_name(title)
 
-        self.BTN_start.config(state=tk.NORMAL)
+        # If the board was disconnected in the meantime, on_board_connected enables it once we are connected again.
+        if self.session.ready.is_set():
+            self.BTN_start.config(state=tk.NORMAL)
 
-        self.update_capture_panel()
+        self.update_capture_panel(self.capture_thread.capture_number)
 
     def on_capture_denied(self, _event):
         """This virtual event is called when the transmitter actually stops transmitting the capture."""
         self.LBL_status.config(text=STR_STATUS_1)
         self.BTN_stop.config(state=tk.DISABLED)
-        self.BTN_start.config(state=tk.NORMAL)
+        if self.session.ready.is_set():
+            self.BTN_start.config(state=tk.NORMAL)
+
+    def report_startup(self):
+        """Draw the window, then print the time since startup and the heavy modules that were loaded (for bench_startup.py)."""
+        self.root.update()
+        heavy_modules = [name for name in ('pandas', 'matplotlib', 'numpy', 'serial.tools.list_ports') if name in sys.modules]
+        print('first_window_seconds', time.perf_counter() - _START_TIME)
+        print('heavy_modules', ','.join(heavy_modules))
+        self.root.destroy()
 
     def show(self):
         # We already built the GUI in the constructor,
@@ -419,16 +466,86 @@ class GraphicalWindow(object):
         self.root.mainloop()
 
 
+class PlotWorker(threading.Thread):
+    """This thread processes and loads captures so that the main/GUI thread can plot them without waiting.
+
+    Request a capture with request(). When it is loaded, the result is put in the results queue
+    as (capture_number, data, error) and a virtual event is generated.
+    Loaded captures are also kept in an LRU cache, so that switching between captures is instant.
+    """
+    def __init__(self, event_hook):
+        # We are a daemon so that we don't keep the program alive after the GUI is closed.
+        threading.Thread.__init__(self, daemon=True)
+        self.event_hook = event_hook
+        self.cache = LRUCache(PLOT_CACHE_SIZE)
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+
+    def request(self, capture_number):
+        """Ask for a capture to be loaded."""
+        self.requests.put(capture_number)
+
+    def run(self):
+        while True:
+            capture_number = self.requests.get()
+            # If the user clicked on several captures while we were busy, only the last one matters.
+            while not self.requests.empty():
+                capture_number = self.requests.get()
+
+            # This is slow to import the first time, so we wait until it is needed (see the note at the top of this file).
+            import plot_mag
+
+            try:
+                plot_mag.ensure_processed(capture_number)
+                data = plot_mag.load(plot_mag.INPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number))
+            # Missing or malformed data files, or anything else that went wrong while processing.
+            # Whatever it was, the GUI must hear about it (and we must keep going), or the plot would say 'loading' forever.
+            except Exception as e:
+                self.results.put((capture_number, None, e))
+            else:
+                self.cache.put(capture_number, data)
+                self.results.put((capture_number, data, None))
+
+            try:
+                self.event_hook.event_generate(EVENT_PLOT_READY)
+            except RuntimeError:
+                # The GUI was closed while we were loading.
+                return
+
+            # Now that the plot is on its way, render the thumbnail of the capture for the capture panel
+            # if it doesn't have an up to date one, and let the GUI know so that it shows it.
+            import render
+            try:
+                rendered = render.render_capture(capture_number)
+            except Exception as e:
+                # debug
+                print('$ Could not render capture', capture_number, '-', e)
+                continue
+            if rendered:
+                try:
+                    self.event_hook.event_generate(EVENT_PLOT_READY)
+                except RuntimeError:
+                    return
+
+
+def make_capture_list_entry(row):
+    """Given a catalog row, return the (number, title, date) that the capture panel shows."""
+    date = time.strftime('%Y-%m-%d', time.localtime(row['started'])) if row['started'] is not None else ''
+    return row['number'], catalog.get_display_title(row), date
+
+
 class CaptureThread(threading.Thread):
     """This class inherits from thread, and it's used to record a capture.
 
     We don't want to hog the main/GUI thread so we spawn these instead.
     A new instance is used for each capture.
     """
-    def __init__(self, con, event_hook):
+    def __init__(self, con, session, event_hook):
         threading.Thread.__init__(self)
-        self.output_path = None
+        self.capture_number = None
         self.con = con
+        # The device session that the connection belongs to, which we tell if the connection fails.
+        self.session = session
         # Event hook is the tkinter object we invoke our virtual events on.
         # In practice, it is always the root object.
         self.event_hook = event_hook
@@ -436,7 +553,7 @@ class CaptureThread(threading.Thread):
     def run(self):
         """Calling our start() method runs this in a new thread."""
         try:
-            self.output_path = capture.do_writing_capture(self.con, enable_trailer=True)
+            self.capture_number = capture.do_writing_capture(self.con, enable_trailer=True)
         except RequestDeniedException:
             # Our SIG_REQUEST was responded to with a SIG_DENIED.
             # debug
@@ -445,37 +562,23 @@ class CaptureThread(threading.Thread):
             self.event_hook.event_generate(EVENT_CAPTURE_DENIED)
         except SerialException:
             # There was a timeout while reading the data.
-            # Probably the board was disconnected during a capture,
-            # we cannot recover mid-capture so we must terminate this thread and show an error.
-            self._terminate_self()
+            # Probably the board was disconnected during a capture. We cannot recover mid-capture,
+            # but the frames that we got were saved as a truncated capture (see capture.do_writing_capture).
+            # The session will let the GUI know that the board is gone, and connect again when it is back.
+            self.session.report_failure()
         else:
             self.event_hook.event_generate(EVENT_CAPTURE_FINISHED)
 
     def write_name(self, name):
-        """Create a name.txt file for this thread's capture."""
-        name_file = open(self.output_path + 'name.txt', 'w')
+        """Create a name.txt file for this thread's capture, and record the name in the catalog."""
+        name_file = open(capture.OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(self.capture_number) + 'name.txt', 'w')
         name_file.write(name)
         name_file.close()
+        catalog.set_title(self.capture_number, name)
 
     def delete_capture(self):
         """Remove this thread's capture."""
-        # The call to shutil.rmtree with ignore_errors=True will recursively delete a directory.
-        # This is what we need, since we want to remove the capture folder along with the data files inside of it.
-        shutil.rmtree(self.output_path, ignore_errors=True)
-
-    def _terminate_self(self):
-        # The capture was not totally completed, only partially started.
-        # There is no way to recover in the middle of a capture, but we
-        # must trigger the disconnected event to let the GUI know before
-        # terminating ourself.
-        try:
-            self.event_hook.event_generate(EVENT_BOARD_DISCONNECTED)
-        finally:
-            # A RuntimeError is triggered if we have already killed the GUI thread
-            # and now we are trying to generate an event (to kill it). We are
-            # trying to end it anyway so the error itself does not represent
-            # unintended or unexpected behavior.
-            exit(1)
+        catalog.delete_capture(self.capture_number)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import bisect
 import tkinter as tk
 
 
@@ -24,3 +25,159 @@ class CustomButton(tk.Button):
     def __init__(self, ctx, *args, **kwargs):
         super(CustomButton, self).__init__(ctx, *args, **kwargs,
                                            width=12, height=-20, pady=-20, relief=tk.GROOVE)
+
+
+class CaptureList(CustomFrame):
+    """A scrollable list of captures that only builds widgets for the rows that are visible.
+
+    There is a fixed pool of row widgets (one per visible row). Scrolling doesn't create or destroy anything,
+    it just changes which captures the rows are showing. Inserting or removing a capture is a single
+    binary search in our sorted list of captures, so the list stays fast with thousands of captures.
+
+    Captures can be filtered by a search string, which matches any part of a capture's title
+    or the start of its date (YYYY-MM-DD). Filtering only looks at the captures we already know about.
+
+    Each row shows a red 'X' which calls on_remove(number) when clicked,
+    followed by the title which calls on_click(number) when clicked.
+    If get_thumbnail is given, the title is followed by get_thumbnail(number), a tk.PhotoImage (or None if there is none).
+    """
+    def __init__(self, ctx, *, on_click, on_remove, click_font, get_thumbnail=None, rows=10, width=16, **kwargs):
+        super(CaptureList, self).__init__(ctx, **kwargs)
+        self.on_click = on_click
+        self.on_remove = on_remove
+        self.get_thumbnail = get_thumbnail
+
+        # Every capture we know about as (number, title, date), sorted by number.
+        self.captures = []
+        # The captures that match the search filter, in the same order.
+        self.visible = []
+        self.filter_text = ''
+        # Index into self.visible of the first row that is shown.
+        self.offset = 0
+
+        FRM_rows = CustomFrame(self, bd=0, highlightthickness=1, highlightbackground='light gray')
+        self.SCB_scroll = tk.Scrollbar(self, command=self.on_scroll)
+
+        # The pool of rows.
+        self.rows = []
+        for i in range(rows):
+            FRM_row = CustomFrame(FRM_rows)
+            LBL_remove = CustomLabel(FRM_row, text='', fg='red', cursor='hand2', padx=4)
+            LBL_title = CustomLabel(FRM_row, text='', fg='blue', font=click_font, cursor='hand2', anchor=tk.W, width=width)
+            LBL_thumbnail = CustomLabel(FRM_row, cursor='hand2')
+            # A row does not know which capture it is showing until it is clicked, so look it up then.
+            LBL_remove.bind('<Button-1>', lambda _e, row=i: self._on_click_row(row, self.on_remove))
+            LBL_title.bind('<Button-1>', lambda _e, row=i: self._on_click_row(row, self.on_click))
+            LBL_thumbnail.bind('<Button-1>', lambda _e, row=i: self._on_click_row(row, self.on_click))
+            for widget in (FRM_row, LBL_remove, LBL_title, LBL_thumbnail):
+                widget.bind('<MouseWheel>', self.on_mouse_wheel)
+                # Linux reports the mouse wheel as buttons 4 and 5.
+                widget.bind('<Button-4>', lambda _e: self.scroll_by(-1))
+                widget.bind('<Button-5>', lambda _e: self.scroll_by(1))
+            LBL_remove.pack(side=tk.LEFT)
+            LBL_title.pack(side=tk.LEFT, fill=tk.X)
+            if get_thumbnail is not None:
+                LBL_thumbnail.pack(side=tk.LEFT, padx=(4, 0))
+            FRM_row.pack(fill=tk.X, pady=1)
+            self.rows.append((LBL_remove, LBL_title, LBL_thumbnail))
+
+        FRM_rows.pack(side=tk.LEFT, fill=tk.BOTH)
+        self.SCB_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def set_captures(self, captures):
+        """Replace every capture in the list. captures is an iterable of (number, title, date)."""
+        self.captures = sorted(captures)
+        self._refilter()
+
+    def insert(self, number, title, date):
+        """Add a capture to the list (or replace it if it is already there), and scroll to it."""
+        self.remove(number, render=False)
+        index = bisect.bisect(self.captures, (number,))
+        self.captures.insert(index, (number, title, date))
+        if self._matches((number, title, date)):
+            visible_index = bisect.bisect(self.visible, (number,))
+            self.visible.insert(visible_index, (number, title, date))
+            self.see(visible_index)
+        self._render()
+
+    def remove(self, number, render=True):
+        """Remove a capture from the list if it is there."""
+        for lst in (self.captures, self.visible):
+            index = bisect.bisect_left(lst, (number,))
+            if index < len(lst) and lst[index][0] == number:
+                del lst[index]
+        if render:
+            self._render()
+
+    def set_filter(self, text):
+        """Only show captures whose title contains text, or whose date starts with it."""
+        self.filter_text = text.strip().lower()
+        self._refilter()
+
+    def see(self, index):
+        """Scroll so that the index'th visible capture is shown."""
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + len(self.rows):
+            self.offset = index - len(self.rows) + 1
+        self._render()
+
+    def see_end(self):
+        """Scroll to the end of the list to see the newest captures."""
+        self.see(len(self.visible) - 1)
+
+    def scroll_by(self, count):
+        """Scroll down by count rows (up if count is negative)."""
+        self.offset += count
+        self._render()
+
+    def on_scroll(self, action, amount, unit=None):
+        """Called by the scrollbar when it is dragged or its arrows are clicked."""
+        if action == tk.MOVETO:
+            self.offset = int(round(float(amount) * len(self.visible)))
+        elif action == tk.SCROLL:
+            self.offset += int(amount) * (len(self.rows) if unit == tk.PAGES else 1)
+        self._render()
+
+    def on_mouse_wheel(self, event):
+        # Windows reports the wheel in multiples of 120.
+        self.scroll_by(-1 if event.delta > 0 else 1)
+
+    def _matches(self, capture):
+        _number, title, date = capture
+        return not self.filter_text or self.filter_text in title.lower() or date.startswith(self.filter_text)
+
+    def _refilter(self):
+        self.visible = [capture for capture in self.captures if self._matches(capture)]
+        self._render()
+
+    def _on_click_row(self, row, callback):
+        index = self.offset + row
+        if index < len(self.visible):
+            callback(self.visible[index][0])
+
+    def refresh(self):
+        """Show the rows again, e.g. because a thumbnail changed."""
+        self._render()
+
+    def _render(self):
+        """Show the captures starting at self.offset in our pool of rows."""
+        # Don't scroll past either end of the list.
+        self.offset = max(0, min(self.offset, len(self.visible) - len(self.rows)))
+        for row, (LBL_remove, LBL_title, LBL_thumbnail) in enumerate(self.rows):
+            index = self.offset + row
+            if index < len(self.visible):
+                LBL_remove.config(text='X')
+                LBL_title.config(text=self.visible[index][1])
+                thumbnail = self.get_thumbnail(self.visible[index][0]) if self.get_thumbnail is not None else None
+            else:
+                LBL_remove.config(text='')
+                LBL_title.config(text='')
+                thumbnail = None
+            # An empty string clears the image.
+            LBL_thumbnail.config(image=thumbnail if thumbnail is not None else '')
+
+        if self.visible:
+            self.SCB_scroll.set(self.offset / len(self.visible), (self.offset + len(self.rows)) / len(self.visible))
+        else:
+            self.SCB_scroll.set(0, 1)
@@ -2,7 +2,7 @@
 """Print gyro readings to the console in order to test it out.
 
 This is NOT production code, but instead a quick way to test the sensors.
-This also acts as a demo of sorts for the custom handler feature of capture.py.
+This also acts as a demo of sorts for the custom handler feature of capture.py (see capture_blocks).
 
 Modify the variable CHOSEN_ID to choose the sensor you would like to test.
 """
@@ -11,6 +11,7 @@ __author__ = 'Joseph Rubin'
 
 from calibration_generated import *
 import capture
+import latency
 from util import *
 from const import *
 from serial import SerialException
@@ -20,6 +21,9 @@ import sys
 # Choose the sensor you would like to test.
 CHOSEN_ID = TONGUE_SENSOR_ID
 
+# How far behind the sensor the console is (see latency.py). It prints a summary every few seconds.
+monitor = latency.LatencyMonitor()
+
 
 def main():
     # Make a serial connection and open it.
@@ -36,13 +40,17 @@ def main():
     con.flush()
 
     # Have frames delivered to show_gyro.
-    capture.capture_frames(con, show_gyro)
+    capture.capture_blocks(con, show_gyro)
 
 
-def show_gyro(frame, _frame_count, config):
+def show_gyro(block, _frame_count, config):
+    monitor.receive(block.time, block.received)
     # Skip all frames that are not from the sensor that we want.
-    if frame.flag.sensor != CHOSEN_ID:
+    block = block.of_sensor(CHOSEN_ID)
+    if not len(block):
         return True
+    # The console can't keep up with every frame anyway, so we just show the newest one of the block.
+    frame = block[-1]
 
     # Our gyro gives us outputs which are mappable to deg/sec from the range of a 16bit, signed value.
     # By resolving the mapping, and then integrating these readings w/r/t time, we obtain deg.
@@ -66,6 +74,7 @@ def show_gyro(frame, _frame_count, config):
 
     sys.stdout.write('\r{: 0.2f}°\t{: 0.2f}°\t{: 0.2f}°\t\t'.format(reading_x, reading_y, reading_z))
     sys.stdout.flush()
+    monitor.display(block.received)
 
     # Remember to return true to signal that we want more frames.
     return True
@@ -0,0 +1,189 @@
+"""Measure how far behind real time we are: from a sensor reading to its arrival, and from its arrival to its display.
+
+The frames only carry the 16 bit ms counter of the transmitter, which tells us when a reading was taken by the
+clock of the transmitter, not by ours. So every batch that is read is tagged with the time (by time.perf_counter,
+which is monotonic) at which it was received (see FrameBlock.received and pipeline.FrameList), and a
+ClockOffsetEstimator maps the time of the transmitter onto ours:
+
+The difference between when a frame was received and when it was taken (host time - device time) is the offset
+between the clocks plus however long that frame took to get to us. The fastest frames are those that took the least
+time, so we follow the lowest differences: the lowest one in each BUCKET_SECONDS, over the last BUCKET_COUNT buckets,
+with a line fitted through them (since the two clocks don't run at exactly the same rate) and moved down to
+the lowest of them. How long the fastest frame took can't be known without a round trip, so the latencies
+are in excess of that, plus the time it takes to send the frame (FRAME_SECONDS), which is the least it could be.
+
+A LatencyMonitor keeps the latencies:
+    sensor to receiver: when a frame was received, less when it was taken (mapped to our clock),
+    receiver to display: when whoever shows the frames was done with them, less when they were received.
+It prints a summary every REPORT_SECONDS while a capture goes on. make_latency_consumer does this for a capture,
+and as a DROP_OLDEST consumer it waits like a live display would, so its receiver to display latency
+is what a display would see before it draws. A real display can call LatencyMonitor.display itself.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+from const import *
+from pipeline import Consumer, DROP_OLDEST
+from util import TimeUnwrapper
+
+# The lowest offset between the clocks is kept for each bucket of this many seconds (of the transmitter's time)...
+BUCKET_SECONDS = 1
+# ...for this many of the most recent buckets.
+BUCKET_COUNT = 30
+
+# The clocks of the transmitter and of the computer are assumed to run at the same rate within this fraction.
+# A crystal is within about 1e-4, so anything bigger comes from the frames that were delayed, not from the clocks.
+MAX_SKEW = 1e-3
+
+# How long it takes to send a frame (16 bytes, at 10 bits per byte on the wire).
+FRAME_SECONDS = 16 * 10 / TRANSMITTER_BAUD_RATE
+
+# How many of the most recent latencies are kept (of frames, and of batches that were displayed).
+HISTORY_SIZE = 8192
+
+# How often (in seconds) a summary is printed during a capture.
+REPORT_SECONDS = 5
+
+LATENCY_FILENAME = 'latency.json'
+
+
+class ClockOffsetEstimator(object):
+    """Maps the time of the transmitter onto the time of the computer (see the top of this file)."""
+
+    def __init__(self, *, bucket_seconds=BUCKET_SECONDS, bucket_count=BUCKET_COUNT):
+        self.bucket_seconds = bucket_seconds
+        # Per bucket: [device time, lowest offset] (in seconds).
+        self.buckets = deque(maxlen=bucket_count)
+        # The fitted offset is intercept + slope * (device time - reference), where reference is the first device time.
+        self.reference = None
+        self.intercept = None
+        self.slope = 0.0
+
+    def add(self, device_seconds, host_seconds):
+        """Account for a frame that was taken at device_seconds (unwrapped) and received at host_seconds."""
+        offset = host_seconds - device_seconds
+        if self.reference is None:
+            self.reference = device_seconds
+        bucket = device_seconds // self.bucket_seconds
+        if self.buckets and self.buckets[-1][0] // self.bucket_seconds == bucket:
+            if offset >= self.buckets[-1][1]:
+                # Nothing changed.
+                return
+            self.buckets[-1] = [device_seconds, offset]
+        else:
+            self.buckets.append([device_seconds, offset])
+        self._fit()
+
+    def _fit(self):
+        points = np.array(self.buckets)
+        x = points[:, 0] - self.reference
+        if len(points) > 1 and x[-1] > x[0]:
+            self.slope = float(np.clip(np.polyfit(x, points[:, 1], 1)[0], -MAX_SKEW, MAX_SKEW))
+        # Move the line down to the lowest point, so that no frame that we kept was faster than the line.
+        self.intercept = float(np.min(points[:, 1] - self.slope * x))
+
+    def is_ready(self):
+        return self.intercept is not None
+
+    def to_host(self, device_seconds):
+        """Return when (by time.perf_counter) the transmitter's time device_seconds (unwrapped) was, as best we know."""
+        return device_seconds + self.intercept + self.slope * (device_seconds - self.reference)
+
+
+class LatencyMonitor(object):
+    """Keeps the sensor to receiver and receiver to display latencies of a capture (see the top of this file)."""
+
+    def __init__(self, *, history_size=HISTORY_SIZE, report_seconds=REPORT_SECONDS):
+        self.clock = ClockOffsetEstimator()
+        # In seconds.
+        self.sensor_to_receiver = deque(maxlen=history_size)
+        self.receiver_to_display = deque(maxlen=history_size)
+        self.report_seconds = report_seconds
+        self._next_report = None
+        self._unwrapper = TimeUnwrapper()
+
+    def receive(self, times, received):
+        """Account for a batch of frames with the (wrapped) timestamps times, which was received at received (by time.perf_counter)."""
+        if not len(times):
+            return
+        device_seconds = self._unwrapper.unwrap_array(times) / 1000
+        # The newest frame of the batch waited the least, so it tells us the most about the clocks.
+        newest = int(np.argmax(device_seconds))
+        self.clock.add(device_seconds[newest], received)
+        latencies = received - self.clock.to_host(device_seconds) + FRAME_SECONDS
+        self.sensor_to_receiver.extend(latencies.tolist())
+        self._maybe_print_report(received)
+
+    def display(self, received, displayed=None):
+        """Account for a batch that was received at received (by time.perf_counter) and displayed at displayed (by default, now)."""
+        self.receiver_to_display.append((time.perf_counter() if displayed is None else displayed) - received)
+
+    def get_report(self):
+        """Return a summary of the latencies (in ms) and of the clocks, in a form that can be saved as json."""
+        return {
+            'sensor_to_receiver': _summarize(self.sensor_to_receiver),
+            'receiver_to_display': _summarize(self.receiver_to_display),
+            'clock_offset_seconds': self.clock.intercept,
+            'clock_skew_ppm': self.clock.slope * 1e6,
+        }
+
+    def print_report(self):
+        report = self.get_report()
+        for name in ('sensor_to_receiver', 'receiver_to_display'):
+            if report[name]['count']:
+                # debug
+                print('$ Latency {}: median {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms'.format(
+                    name.replace('_', ' '), report[name]['p50'], report[name]['p95'], report[name]['max']))
+
+    def _maybe_print_report(self, now):
+        if self._next_report is None:
+            self._next_report = now + self.report_seconds
+        elif now >= self._next_report:
+            self._next_report = now + self.report_seconds
+            self.print_report()
+
+
+def _summarize(latencies):
+    """Return the count, and the median, 95th percentile, and largest of latencies (in seconds) in ms."""
+    if not latencies:
+        return {'count': 0, 'p50': None, 'p95': None, 'max': None}
+    p50, p95, largest = np.percentile(np.array(latencies) * 1000, (50, 95, 100))
+    return {'count': len(latencies), 'p50': float(p50), 'p95': float(p95), 'max': float(largest)}
+
+
+def make_latency_consumer(output_path=None, *, policy=DROP_OLDEST, name='latency'):
+    """Return a consumer (see pipeline.py) that measures the latencies of a capture.
+
+    When the capture ends the report is printed, and saved to output_path + LATENCY_FILENAME if output_path is given.
+    """
+    monitor = LatencyMonitor()
+
+    def measure(batch, _config):
+        # Batches of capture_blocks are FrameBlocks, and those of capture_frames are FrameLists. Both know when they were received.
+        if batch.received is None:
+            return True
+        if isinstance(batch, list):
+            times = [frame.time for frame in batch]
+        else:
+            times = np.frombuffer(batch.time, dtype=np.uint16)
+        monitor.receive(times, batch.received)
+        # We stand in for a display (see the top of this file).
+        monitor.display(batch.received)
+        return True
+
+    def end(_frame_count, _bad_checksum_count, _config):
+        monitor.print_report()
+        if output_path is not None:
+            with open(output_path + LATENCY_FILENAME, 'w') as output_file:
+                json.dump(monitor.get_report(), output_file, indent=4)
+
+    consumer = Consumer(measure, end_handler=end, policy=policy, name=name)
+    # So that whoever subscribed it can look at the latencies while the capture goes on.
+    consumer.monitor = monitor
+    return consumer
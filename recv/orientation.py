@@ -0,0 +1,168 @@
+"""Estimate the orientation of each sensor by fusing its gyro and accl readings.
+
+gyro_test.show_gyro notes that integrating the gyro alone never gives accurate absolute angles: any error in the
+calibration grows into drift. The accl, on the other hand, tells which way gravity is, so it gives the tilt (roll and
+pitch) without drift, but it is noisy and thrown off by any acceleration of the head. A complementary filter
+takes the best of both: the tilt follows the integrated gyro over short times, and is pulled towards the accl tilt
+over long times (longer than TIME_CONSTANT_SECONDS):
+
+    angle[n] = alpha * (angle[n - 1] + gyro[n] * dt[n]) + (1 - alpha) * accl_angle[n]
+
+This is a first order linear recursion, so like the filters in filters.py we solve a block of BLOCK_LENGTH samples
+at once with a matrix product, and carry the state from one call of process to the next. That way the orientation
+is the same whether it is computed live (see make_orientation_consumer) or offline (see process.process_orientation).
+Nothing measures the heading, so the yaw is only the integrated gyro, and drifts.
+
+We integrate the gyro rates about x and y straight into roll and pitch, which is accurate when the tilt is small,
+as it is for a sensor on the neck. The orientation is given as angles (in degrees) and as a quaternion.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import numpy as np
+
+from const import *
+from calibration_generated import *
+from pipeline import Consumer, DROP_OLDEST
+from util import SIXTEEN_BIT_MAX_VALUE, TimeUnwrapper
+
+# How long (in seconds) the gyro is trusted over the accl. Longer means smoother, but slower to correct drift.
+TIME_CONSTANT_SECONDS = 0.5
+
+# The recursion is solved this many samples at a time (see filters.BLOCK_LENGTH).
+BLOCK_LENGTH = 128
+
+# Longer steps between samples than this (e.g. frames that were lost) are cut to this, so that one gap doesn't
+# turn into a big jump in the angles. The accl corrects the tilt after a gap anyway.
+MAX_STEP_SECONDS = 0.1
+
+# The reading fields of a frame (see frame.py), in the order that OrientationEstimator expects them.
+READING_NAMES = ('gyro_x', 'gyro_y', 'gyro_z', 'accl_x', 'accl_y', 'accl_z')
+
+# What an OrientationEstimator returns, in order. The angles are in degrees.
+ORIENTATION_HEADERS = ('time', 'roll', 'pitch', 'yaw', 'qw', 'qx', 'qy', 'qz')
+
+
+class OrientationEstimator(object):
+    """Fuses the gyro and accl readings of one sensor into its orientation (see the top of this file)."""
+
+    def __init__(self, sample_rate, *, time_constant_seconds=TIME_CONSTANT_SECONDS, block_length=BLOCK_LENGTH):
+        self.sample_seconds = 1 / sample_rate
+        self.alpha = time_constant_seconds / (time_constant_seconds + self.sample_seconds)
+        self.block_length = block_length
+        # (matrix @ u)[n] is the sum of alpha ** (n - k) * u[k], and decay[n] is alpha ** (n + 1).
+        indexes = np.arange(block_length)
+        lags = indexes[:, None] - indexes[None, :]
+        self.matrix = np.where(lags >= 0, self.alpha ** np.maximum(lags, 0), 0)
+        self.decay = self.alpha ** (indexes + 1)
+
+        # The state: the last time (ms), roll and pitch and yaw (radians), and accl tilt. None until the first call to process.
+        self.previous_time = None
+        self.angles = None
+        self.previous_accl_angles = None
+
+    def reset(self):
+        self.previous_time = self.angles = self.previous_accl_angles = None
+
+    def process(self, times, readings):
+        """Estimate the orientation at each of the readings, of shape (samples, 6) in the order gyro x, y, z, accl x, y, z,
+        in dps and gs (calibrated and scaled, like the sensor csv files), with their unwrapped times in ms.
+
+        Returns an array of shape (samples, len(ORIENTATION_HEADERS)).
+        """
+        times = np.asarray(times, dtype=np.int64)
+        readings = np.asarray(readings, dtype=np.float64)
+        if not len(times):
+            return np.empty((0, len(ORIENTATION_HEADERS)))
+
+        # How far the gyro turned the sensor since the previous sample.
+        previous_time = times[0] - self.sample_seconds * 1000 if self.previous_time is None else self.previous_time
+        steps = np.clip(np.diff(np.concatenate(([previous_time], times))) / 1000, 0, MAX_STEP_SECONDS)
+        turns = np.radians(readings[:, :3]) * steps[:, None]
+
+        # The tilt according to gravity. We unwrap the roll so that turning past +/-180 degrees doesn't jump.
+        accl_x, accl_y, accl_z = readings[:, 3], readings[:, 4], readings[:, 5]
+        accl_angles = np.column_stack((np.arctan2(accl_y, accl_z), np.arctan2(-accl_x, np.hypot(accl_y, accl_z))))
+        if self.previous_accl_angles is not None:
+            accl_angles = np.unwrap(np.vstack((self.previous_accl_angles, accl_angles)), axis=0)[1:]
+        else:
+            accl_angles = np.unwrap(accl_angles, axis=0)
+        if self.angles is None:
+            # Start from where gravity says we are.
+            self.angles = np.array((accl_angles[0, 0], accl_angles[0, 1], 0.0))
+        else:
+            # Keep the accl tilt within half a turn of our estimate.
+            accl_angles += np.round((self.angles[:2] - accl_angles[:1]) / (2 * np.pi)) * 2 * np.pi
+
+        angles = np.empty((len(times), 3))
+        inputs = self.alpha * turns[:, :2] + (1 - self.alpha) * accl_angles
+        for start in range(0, len(times), self.block_length):
+            end = min(start + self.block_length, len(times))
+            length = end - start
+            angles[start:end, :2] = self.matrix[:length, :length] @ inputs[start:end] \
+                + self.decay[:length, None] * self.angles[None, :2]
+            self.angles[:2] = angles[end - 1, :2]
+        # Nothing corrects the yaw, so it is just the integrated gyro.
+        angles[:, 2] = self.angles[2] + np.cumsum(turns[:, 2])
+        self.angles[2] = angles[-1, 2]
+
+        self.previous_time = times[-1]
+        self.previous_accl_angles = accl_angles[-1]
+
+        return np.column_stack((times, np.degrees(angles), to_quaternion(angles)))
+
+
+def to_quaternion(angles):
+    """Return the quaternions (w, x, y, z) of angles, of shape (samples, 3), in radians: roll, pitch, yaw (applied in the order yaw, pitch, roll)."""
+    half = angles / 2
+    cos_roll, cos_pitch, cos_yaw = np.cos(half).T
+    sin_roll, sin_pitch, sin_yaw = np.sin(half).T
+    return np.column_stack((
+        cos_roll * cos_pitch * cos_yaw + sin_roll * sin_pitch * sin_yaw,
+        sin_roll * cos_pitch * cos_yaw - cos_roll * sin_pitch * sin_yaw,
+        cos_roll * sin_pitch * cos_yaw + sin_roll * cos_pitch * sin_yaw,
+        cos_roll * cos_pitch * sin_yaw - sin_roll * sin_pitch * cos_yaw,
+    ))
+
+
+def make_orientation_consumer(handler, *, policy=DROP_OLDEST, name='orientation'):
+    """Return a consumer (see pipeline.py) that estimates the orientation of each sensor during a capture.
+
+    handler is called with (sensor_name, output) for every batch, where output is like that of OrientationEstimator.process.
+    The frames are calibrated and scaled here, the same way as capture.format_frame does it.
+    """
+    estimators = {}
+    # Per sensor: the calibration offsets, and the scales of the gyro and accl readings.
+    offsets = {}
+    scales = {}
+    # To unwrap the timestamps of each sensor, carried on from the previous batch.
+    unwrappers = {TONGUE_SENSOR_ID: TimeUnwrapper(), THROAT_SENSOR_ID: TimeUnwrapper()}
+
+    def start(config):
+        for sensor, sensor_calib in ((TONGUE_SENSOR_ID, calib.tongue), (THROAT_SENSOR_ID, calib.throat)):
+            estimators[sensor] = OrientationEstimator(config.capture_rate)
+            offsets[sensor] = np.array((sensor_calib.gyro.x, sensor_calib.gyro.y, sensor_calib.gyro.z,
+                                        sensor_calib.accl.x, sensor_calib.accl.y, sensor_calib.accl.z))
+            scales[sensor] = np.repeat((config.gyro_scale / SIXTEEN_BIT_MAX_VALUE, config.accl_scale / SIXTEEN_BIT_MAX_VALUE), 3)
+
+    def estimate_batch(batch, _config):
+        if isinstance(batch, list):
+            sensors = np.array([frame.flag.sensor for frame in batch])
+            times = np.array([frame.time for frame in batch])
+            readings = np.array([[getattr(frame.reading, name) for name in READING_NAMES] for frame in batch]).reshape(-1, 6)
+        else:
+            sensors = np.frombuffer(batch.sensor, dtype=np.uint8)
+            times = np.frombuffer(batch.time, dtype=np.uint16)
+            readings = np.column_stack([np.frombuffer(getattr(batch, name), dtype=np.int16) for name in READING_NAMES])
+
+        for sensor, sensor_name in ((TONGUE_SENSOR_ID, 'tongue'), (THROAT_SENSOR_ID, 'throat')):
+            mask = sensors == sensor
+            if not mask.any():
+                continue
+            sensor_times = unwrappers[sensor].unwrap_array(times[mask])
+            sensor_readings = (readings[mask] - offsets[sensor]) * scales[sensor]
+            handler(sensor_name, estimators[sensor].process(sensor_times, sensor_readings))
+        return True
+
+    # Like the filters, the estimators carry their state across a batch that was dropped (see MAX_STEP_SECONDS).
+    return Consumer(estimate_batch, start_handler=start, policy=policy, name=name)
@@ -0,0 +1,250 @@
+"""Lets several consumers use the frames of a single capture at once (writing to disk, plotting, statistics...).
+
+capture_frames only accepts a single handler. A Pipeline is that handler: it collects the frames into batches
+and hands every batch to each of its consumers. Each consumer runs on a thread of its own, with a bounded queue
+of batches in front of it, so a slow consumer does not hold up the others.
+
+What happens when the queue of a consumer is full is up to its policy:
+BLOCK makes the capture wait for the consumer (use this when no frame may be lost, e.g. for writing to disk),
+DROP_OLDEST throws away the oldest batch that is waiting, and DROP_NEWEST throws away the new batch
+(use one of these for something like a live plot, which can afford to miss some frames).
+
+    pipeline = Pipeline()
+    pipeline.subscribe(Consumer(write_batch, policy=BLOCK))
+    pipeline.subscribe(Consumer(plot_batch, policy=DROP_OLDEST))
+    capture.capture_frames(con, *pipeline.handlers())
+
+With capture.capture_blocks, use pipeline.block_handlers() instead, and every block that is read becomes a batch.
+
+A consumer's handler is called with (batch, config), where batch is a FrameList (a list of frames) or a FrameBlock (see frame.py).
+Both know when they were received (see latency.py).
+Just like a capture handler, it returns whether it would like the capture to continue.
+If any consumer returns False, the capture is stopped (a SIG_ENOUGH is sent), but every consumer
+still receives the frames that arrive until the transmitter ends the capture.
+
+The optional start_handler and end_handler of a consumer have the same meaning as those of capture_frames,
+but they are called on the capturing thread: start_handler before any batch is handed out, and end_handler
+after the consumer has handled every batch.
+
+If the capture fails (capture_frames raises, and never calls our end handler), call Pipeline.abort instead.
+The consumers still handle every batch they have, and then their end handlers are called with the counts of frames
+and bad checksums so far. For those, give pipeline.count to capture_frames (or capture_blocks) as its count_handler.
+A consumer may give an abort_handler (with the same arguments) to be called in place of its end_handler then.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import queue
+import threading
+import time
+
+# Queue policies (see above).
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+# How many frames go in a batch. At the FAST capture rate this is about 40 ms of data.
+BATCH_SIZE = 64
+# How many batches may wait in the queue of a consumer.
+QUEUE_SIZE = 64
+
+
+class FrameList(list):
+    """A batch of frames from capture_frames.
+
+    received is when (by time.perf_counter) the last of its frames was read from the connection.
+    """
+
+    def __init__(self, frames, received=None):
+        list.__init__(self, frames)
+        self.received = received
+
+
+class Consumer(threading.Thread):
+    """Handles the batches of a Pipeline on a thread of its own."""
+
+    def __init__(self, handler, *, start_handler=None, end_handler=None, abort_handler=None, policy=BLOCK,
+                 queue_size=QUEUE_SIZE, name=None):
+        # We are a daemon so that a consumer that is stuck can't keep the program alive.
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.handler = handler
+        self.start_handler = start_handler
+        self.end_handler = end_handler
+        self.abort_handler = abort_handler
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pipeline = None
+        self.config = None
+
+        # Statistics.
+        self.batch_count = 0
+        self.dropped_batch_count = 0
+        # If the handler raised an exception, it is saved here and raised again by the pipeline when the capture ends.
+        self.error = None
+
+    @classmethod
+    def from_frame_handlers(cls, handler, start_handler=None, end_handler=None, **kwargs):
+        """Make a consumer out of handlers written for capture_frames, which take a single frame at a time.
+
+        The frame_count given to the handler counts the frames that this consumer has handled.
+        """
+        frame_count = 0
+
+        def batch_handler(batch, config):
+            nonlocal frame_count
+            do_continue = True
+            for frame in batch:
+                frame_count += 1
+                if not handler(frame, frame_count, config):
+                    do_continue = False
+            return do_continue
+
+        return cls(batch_handler, start_handler=start_handler, end_handler=end_handler, **kwargs)
+
+    def put(self, batch):
+        """Queue a batch for this consumer, according to its policy. None means that there are no more batches."""
+        if batch is None or self.policy == BLOCK:
+            self.queue.put(batch)
+            return
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped_batch_count += 1
+            if self.policy == DROP_OLDEST:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self.queue.put_nowait(batch)
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if self.error is not None:
+                # We already failed, so just make room for the batches that are still coming.
+                continue
+            self.batch_count += 1
+            try:
+                if not self.handler(batch, self.config):
+                    self.pipeline.request_stop()
+            except Exception as e:
+                self.error = e
+                self.pipeline.request_stop()
+
+
+class Pipeline(object):
+    """Hands the frames of a capture to every subscribed consumer. See the top of this file."""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.consumers = []
+        self._batch = []
+        self._received = None
+        self._stop_event = threading.Event()
+
+        # The counts of the capture so far (see count), for abort.
+        self.frame_count = 0
+        self.bad_checksum_count = 0
+        self._config = None
+
+    def subscribe(self, consumer):
+        """Add a consumer. This must be done before the capture begins."""
+        consumer.pipeline = self
+        self.consumers.append(consumer)
+        return consumer
+
+    def request_stop(self):
+        """Ask for the capture to be stopped. This may be called from any thread."""
+        self._stop_event.set()
+
+    def handlers(self):
+        """Return the handler, start_handler and end_handler to give to capture_frames."""
+        return self._handle_frame, self._start, self._end
+
+    def block_handlers(self):
+        """Return the handler, start_handler and end_handler to give to capture_blocks."""
+        return self._handle_block, self._start, self._end
+
+    def count(self, frame_count, bad_checksum_count):
+        """Keep the counts of frames and bad checksums of the capture so far. This is the count_handler of capture_frames."""
+        self.frame_count = frame_count
+        self.bad_checksum_count = bad_checksum_count
+
+    def _start(self, config):
+        self._config = config
+        for consumer in self.consumers:
+            consumer.config = config
+            if consumer.start_handler is not None:
+                consumer.start_handler(config)
+        for consumer in self.consumers:
+            consumer.start()
+
+    def _handle_frame(self, frame, _frame_count, _config):
+        self._batch.append(frame)
+        # capture_frames calls us right after it reads a frame.
+        self._received = time.perf_counter()
+        if len(self._batch) >= self.batch_size:
+            self._publish()
+        return not self._stop_event.is_set()
+
+    def _handle_block(self, block, _frame_count, _config):
+        # A block is already a batch.
+        for consumer in self.consumers:
+            consumer.put(block)
+        return not self._stop_event.is_set()
+
+    def _publish(self):
+        # Every consumer gets the same list, so consumers must not modify it (or the frames in it).
+        batch = FrameList(self._batch, self._received)
+        self._batch = []
+        for consumer in self.consumers:
+            consumer.put(batch)
+
+    def abort(self):
+        """Stop the consumers after they handle the frames they already have, then call their abort handlers
+        (or their end handlers) with the counts so far (see count).
+
+        Use this when capture_frames raised an exception, since it then never calls our end handler.
+        The exception is what the caller should raise, so an end handler that fails here is only printed.
+        """
+        self._finish_consumers()
+
+        for consumer in self.consumers:
+            # A consumer that never started (because a start handler failed) has nothing to end.
+            if consumer.ident is None:
+                continue
+            end_handler = consumer.abort_handler or consumer.end_handler
+            if end_handler is None:
+                continue
+            try:
+                end_handler(self.frame_count, self.bad_checksum_count, self._config)
+            except Exception as e:
+                # debug
+                print('$', consumer.name, 'failed to end:', repr(e))
+
+    def _finish_consumers(self):
+        if self._batch:
+            self._publish()
+        # Let every consumer finish what is in its queue.
+        for consumer in self.consumers:
+            if consumer.is_alive():
+                consumer.put(None)
+        for consumer in self.consumers:
+            if consumer.is_alive():
+                consumer.join()
+
+    def _end(self, frame_count, bad_checksum_count, config):
+        self._finish_consumers()
+
+        for consumer in self.consumers:
+            if consumer.end_handler is not None:
+                consumer.end_handler(frame_count, bad_checksum_count, config)
+            if consumer.dropped_batch_count:
+                # debug
+                print('$', consumer.name, 'dropped', consumer.dropped_batch_count, 'batches.')
+
+        for consumer in self.consumers:
+            if consumer.error is not None:
+                raise consumer.error
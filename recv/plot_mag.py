@@ -8,6 +8,7 @@ or by modifying the default value of the variable capture_number below.
 __author__ = 'Joseph Rubin'
 
 import sys
+import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 from itertools import chain
@@ -24,6 +25,8 @@ INPUT_DIRECTORY_ROOT = 'processed/'
 PLOT_TONGUE = False
 PLOT_THROAT = True
 PLOT_BUTTON = False
+# Show the spectrogram of the gyro magnitude (see spectral.py) in a second figure.
+PLOT_SPECTROGRAM = False
 
 
 def main():
@@ -36,6 +39,21 @@ def main():
         raise ValueError('That capture does not exist!')
 
     capture_directory = INPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    ensure_processed(capture_number)
+
+    # debug
+    print('$ Plotting...')
+    if PLOT_SPECTROGRAM:
+        # Only make the figure here, plot() will show it along with its own.
+        plt.figure()
+        plot_spectrogram(capture_number, 'throat' if PLOT_THROAT else 'tongue')
+        plt.figure()
+    plot(capture_directory)
+
+
+def ensure_processed(capture_number):
+    """Process a capture unless it has already been processed."""
+    capture_directory = INPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
 
     # If we have not processed the capture before, or if we think we have
     # but the processed data doesn't exist, we process the capture now.
@@ -45,59 +63,99 @@ def main():
         # debug
         print('$ Processing...')
         process.process_capture(capture_number)
-    # debug
-    print('$ Plotting...')
-    plot(capture_directory)
 
 
 def plot(input_path):
     """Plot a capture given the path to its subdirectory."""
-    input_filename_tongue = input_path + 'tongue.csv'
-    input_filename_throat = input_path + 'throat.csv'
-    input_filename_button = input_path + 'button.csv'
+    draw(plt.gca(), load(input_path))
+    plt.show()
+
 
-    # Plot sensor files, depending on the status of the debugging constants.
+def load(input_path):
+    """Read the data that we plot from the subdirectory of a processed capture.
+
+    This is kept apart from drawing, so that the (slow) reading can be done in the background.
+    Only the data that is chosen to be plotted (see the debugging constants) is read.
+    """
+    def read_sensor_file(input_filename):
+        input_reader = pd.read_csv(input_filename, delimiter=',', usecols=['time', 'gyro_m'])
+        return input_reader.time.values, input_reader.gyro_m.values
+
+    return {
+        'tongue': read_sensor_file(input_path + 'tongue.csv') if PLOT_TONGUE else None,
+        'throat': read_sensor_file(input_path + 'throat.csv') if PLOT_THROAT else None,
+        'button': pd.read_csv(input_path + 'button.csv', delimiter=',').time.values if PLOT_BUTTON else None,
+    }
+
+
+def draw(axes, data):
+    """Draw data returned from load onto the given axes, replacing anything already drawn there."""
+    axes.clear()
+
+    # Plot sensor data, depending on the status of the debugging constants.
     # We save the minimum and maximum data values for later.
-    min_a, max_a = plot_sensor_file(input_filename_tongue, 'Tongue') if PLOT_TONGUE else (0, 0)
-    min_b, max_b = plot_sensor_file(input_filename_throat, 'Throat') if PLOT_THROAT else (0, 0)
+    min_a, max_a = plot_sensor_file(axes, *data['tongue'], 'Tongue') if data['tongue'] is not None else (0, 0)
+    min_b, max_b = plot_sensor_file(axes, *data['throat'], 'Throat') if data['throat'] is not None else (0, 0)
 
-    plt.xlabel('Milliseconds')
-    plt.ylabel('Degrees per second')
+    axes.set_xlabel('Milliseconds')
+    axes.set_ylabel('Degrees per second')
 
     # We can plot the button presses as vertical lines if we want to.
     # Here is where the min and max data values come in.
     # We plot the lines as low as the min, and as high as the max,
     # so we are certain that the line extends the entire reach of the plot
     # without going over or under.
-    if PLOT_BUTTON:
-        plot_button_presses(input_filename_button, min(min_a, min_b), max(max_a, max_b))
+    if data['button'] is not None:
+        plot_button_presses(axes, data['button'], min(min_a, min_b), max(max_a, max_b))
 
     # The two plots were labeled, so let's generate the legend.
-    plt.legend()
-
-    plt.show()
+    axes.legend()
 
 
-def plot_sensor_file(input_filename, plot_label):
-    """Plot a sensor capture data given the path to its file."""
-    input_reader = pd.read_csv(input_filename, delimiter=',')
+def plot_sensor_file(axes, time, gyro_m, plot_label):
+    """Plot the gyro magnitude of a sensor."""
     # If we are just plotting the throat, having it blue would be confusing
     # (since it is usually orange). Resolve this ambiguity by making it orange as usual.
     if PLOT_THROAT and not PLOT_TONGUE:
         color = '#FF8000'
     else:
         color = ''
-    plt.plot(input_reader.time, input_reader.gyro_m, color, lw=0.8, label=plot_label)
-    return min(input_reader.gyro_m), max(input_reader.gyro_m)
+    axes.plot(time, gyro_m, color, lw=0.8, label=plot_label)
+    return min(gyro_m), max(gyro_m)
+
+
+def plot_spectrogram(capture_number, sensor_name, channel='gyroM'):
+    """Plot the spectrogram of one channel of a sensor ('tongue' or 'throat').
+
+    The spectrum is taken from the cache made by process.process_spectrum.
+    """
+    spectrum = process.load_spectrum(capture_number, sensor_name)
+    if not len(spectrum['times']):
+        # The capture is shorter than a single segment (see spectral.SEGMENT_LENGTH), so there is no spectrum to show.
+        plt.text(0.5, 0.5, 'Too short for a spectrogram', ha='center', va='center', transform=plt.gca().transAxes)
+        plt.title(sensor_name.capitalize())
+        return
+    channel_index = list(spectrum['channels']).index(channel)
+    power = spectrum['power'][:, :, channel_index]
+    # Plot in decibels, since the power varies by many orders of magnitude.
+    # The tiny constant avoids taking the log of zero.
+    plt.pcolormesh(spectrum['times'], spectrum['frequencies'], 10 * np.log10(power.T + 1e-12), cmap='viridis')
+    plt.colorbar(label='Power (dB)')
+    # Overlay the swallow frequency that we found in every segment.
+    plt.plot(spectrum['times'], spectrum['swallow_frequency'], 'w.', ms=2,
+             label='Swallow frequency ({:.1f} Hz)'.format(float(spectrum['average_swallow_frequency'])))
+    plt.xlabel('Milliseconds')
+    plt.ylabel('Hz')
+    plt.title(sensor_name.capitalize())
+    plt.legend()
 
 
-def plot_button_presses(input_filename, low_y_coord, high_y_coord):
+def plot_button_presses(axes, times, low_y_coord, high_y_coord):
     """Make vertical lines in the plot for the button presses."""
     assert high_y_coord >= low_y_coord
-    input_reader = pd.read_csv(input_filename, delimiter=',')
     # Plot a line for each button press.
-    for time in input_reader.time:
-        plt.plot([time, time], [low_y_coord, high_y_coord], 'k:', lw=1.6, solid_capstyle='round')
+    for time in times:
+        axes.plot([time, time], [low_y_coord, high_y_coord], 'k:', lw=1.6, solid_capstyle='round')
 
 
 if __name__ == '__main__':
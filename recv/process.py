@@ -2,13 +2,22 @@
 
 Currently, our processing consists of calculating a vector magnitude for the gyro readings
 and collecting the button presses into a single file.
+We also compute the spectral features of every sensor (see spectral.py) and cache them next to the processed data,
+and filter every sensor (see filters.py) and estimate its orientation (see orientation.py) into files of their own.
+The summary statistics of every capture are recorded in the catalog (see process_stats).
 Remember that the 'raw' data is actually already scaled and calibrated.
 """
 
 __author__ = 'Joseph Rubin'
 
+import numpy as np
 import pandas as pd
 from util import *
+import spectral
+import filters
+import orientation
+import saturation
+import catalog
 
 # These values will be generated from the raw data.
 #                          magnitude
@@ -23,6 +32,33 @@ OUTPUT_DIRECTORY_ROOT = 'processed/'
 # Name of the empty file that is placed in a raw capture subdirectory to indicate that we have processed this capture.
 PROCESSED_MARKER_FILENAME = 'processed'
 
+# Channels of a sensor that we compute the spectrum of. The gyro magnitude must come last (see spectral.compute_spectrum).
+SPECTRUM_CHANNELS = ('gyroX', 'gyroY', 'gyroZ', 'acclX', 'acclY', 'acclZ', 'gyroM')
+
+# Spectra are cached per sensor in the processed subdirectory, e.g. 'spectrum_tongue.npz'.
+SPECTRUM_FILENAME = 'spectrum_{}.npz'
+# The power spectrum is big (segments x frequencies x channels), so it is cached compressed, as float32.
+# Caches of another version are made again.
+SPECTRUM_CACHE_VERSION = 2
+
+# The filtered sensor data is kept in the processed subdirectory too, e.g. 'filtered_tongue.csv' (see filters.FILTER_HEADERS).
+FILTERED_FILENAME = 'filtered_{}.csv'
+
+# The summary statistics (see process_stats) are also kept for each chunk of this many ms of a sensor.
+STATS_CHUNK_MS = 5000
+# The percentiles of the gyro magnitude that we keep (see catalog.STATS_COLUMNS).
+STATS_PERCENTILES = (50, 95, 99)
+# A step between two frames of a sensor that is longer than this many sample intervals is a gap (lost frames).
+GAP_SAMPLE_INTERVALS = 4
+
+# The orientation of each sensor is kept in the processed subdirectory too, e.g. 'orientation_tongue.csv'
+# (see orientation.ORIENTATION_HEADERS).
+ORIENTATION_FILENAME = 'orientation_{}.csv'
+
+# How many rows of a sensor file we filter (or estimate the orientation of) at once. The stages carry their state
+# from one chunk to the next, so this only changes how much memory we use, not the result.
+FILTER_CHUNK_ROWS = 1 << 16
+
 
 def process_capture(capture_number: int):
     """Given a capture number, process the capture."""
@@ -33,66 +69,44 @@ def process_capture(capture_number: int):
     if not os.path.isdir(output_path):
         os.makedirs(output_path)
 
-    def process_sensor_file(input_filename: str, output_filename: str):
+    def process_sensor_file(sensor_name: str, output_filename: str):
         """Process a single sensor."""
         with open(output_filename, 'w') as output_file:
-            input_reader = pd.read_csv(input_filename, delimiter=',')
-
             # Write the csv headers.
             output_file.write(format_csv(PROCESS_HEADERS) + '\n')
 
-            previous_time = 0
-            time_offset = 0
-            for time, gyro_x, gyro_y, gyro_z in \
-                    zip(input_reader.time, input_reader.gyroX, input_reader.gyroY, input_reader.gyroZ):
-
-                # We don't apply calibration data or scaling here because it has already been applied
-                # to the file we are reading when it was captured.
-                gyro_m = magnitude(gyro_x, gyro_y, gyro_z)
+            # The times are already corrected for overflow in the time byte (see _read_sensor_chunks).
+            for times, readings in _read_sensor_chunks(capture_number, sensor_name):
+                for time, gyro_x, gyro_y, gyro_z in zip(times.tolist(), *readings[:, :3].T.tolist()):
 
-                # We must correct for overflow in the time byte.
-                # In the future, it might just be better to increase the size of our timestamp.
-                if time < previous_time:
-                    # Overflow occurred, correct for it!
-                    # We increase the offset that we add to every time value.
-                    time_offset += (2**16)
-                previous_time = time
-                time += time_offset
+                    # We don't apply calibration data or scaling here because it has already been applied
+                    # to the file we are reading when it was captured.
+                    gyro_m = magnitude(gyro_x, gyro_y, gyro_z)
 
-                output_file.write(format_csv([time, gyro_m, gyro_x, gyro_y, gyro_z]) + '\n')
+                    output_file.write(format_csv([time, gyro_m, gyro_x, gyro_y, gyro_z]) + '\n')
 
-    def process_button(input_filenames: list, output_filename: str):
-        """Generate processed button output, given sensor filenames."""
+    def process_button(sensor_names: list, output_filename: str):
+        """Generate processed button output, given the names of the sensors to take the presses from."""
         # Create a list of all the (non-contiguous) times a button press was reported.
         button_pressed_last_frame = False
         button_press_times = list()
-        for input_filename in input_filenames:
-            input_reader = pd.read_csv(input_filename, delimiter=',')
-
-            previous_time = 0
-            time_offset = 0
-            for time, button in zip(input_reader.time, input_reader.button):
-                if button == 1:
-                    # Don't count a new button press if we have not let go of the button since last frame.
-                    if not button_pressed_last_frame:
-                        button_pressed_last_frame = True
-
-                        # We must correct for overflow in the time byte.
-                        # In the future, it might just be better to increase the size of our timestamp.
-                        if time < previous_time:
-                            # Overflow occurred, correct for it!
-                            # We increase the offset that we add to every time value.
-                            time_offset += (2 ** 16)
-                        previous_time = time
-                        time += time_offset
-
-                        # It's possible that two distinct presses are at the same time if packets were collected very quickly,
-                        # and also because two sensor frames may both be reporting the button press,
-                        # but we rather not add that press twice.
-                        if time not in button_press_times:
-                            button_press_times.append(time)
-                else:
-                    button_pressed_last_frame = False
+        for sensor_name in sensor_names:
+            # The times are corrected for overflow in the time byte with every frame, not only the presses,
+            # since the timer may overflow more than once between two presses (see _read_sensor_chunks).
+            for times, _readings, buttons in _read_sensor_chunks(capture_number, sensor_name, with_buttons=True):
+                for time, button in zip(times.tolist(), buttons.tolist()):
+                    if button == 1:
+                        # Don't count a new button press if we have not let go of the button since last frame.
+                        if not button_pressed_last_frame:
+                            button_pressed_last_frame = True
+
+                            # It's possible that two distinct presses are at the same time if packets were collected very quickly,
+                            # and also because two sensor frames may both be reporting the button press,
+                            # but we rather not add that press twice.
+                            if time not in button_press_times:
+                                button_press_times.append(time)
+                    else:
+                        button_pressed_last_frame = False
         # Now save those press times to a file.
         with open(output_filename, 'w') as output_file:
             # Write the csv headers.
@@ -100,28 +114,262 @@ def process_capture(capture_number: int):
             for time in button_press_times:
                 output_file.write(str(time) + '\n')
 
-    # Process the sensors.
-    tongue_ending = 'tongue.csv'
-    throat_ending = 'throat.csv'
-    process_sensor_file(input_path + tongue_ending, output_path + tongue_ending)
-    process_sensor_file(input_path + throat_ending, output_path + throat_ending)
+    # Process the sensors. Their csv files may be gone if the capture was archived (see archive.py).
+    process_sensor_file('tongue', output_path + 'tongue.csv')
+    process_sensor_file('throat', output_path + 'throat.csv')
 
     # Process the button.
     button_ending = 'button.csv'
-    process_button([input_path + tongue_ending,
+    process_button(['tongue',
                     # Only need to use button presses that came with the tongue frames,
                     # since the throat presses will be nearly identical.
-                    #input_path + throat_ending
+                    #'throat'
                     ],
                    output_path + button_ending)
 
-    # Mark the raw capture as processed by adding the processed marker (see PROCESSED_MARKER_FILENAME).
+    # Record the summary statistics in the catalog.
+    process_stats(capture_number)
+
+    # Compute the spectral features and filter the sensors while we are at it.
+    process_spectrum(capture_number)
+    process_filtered(capture_number)
+    process_orientation(capture_number)
+    # Captures from before we looked for saturation while capturing don't have a report yet.
+    if not os.path.isfile(input_path + saturation.SATURATION_FILENAME):
+        saturation.process_saturation(capture_number)
+
+    # Mark the raw capture as processed by adding the processed marker (see PROCESSED_MARKER_FILENAME),
+    # and in the catalog.
     open(input_path + PROCESSED_MARKER_FILENAME, 'w').close()
+    catalog.set_processed(capture_number)
+
+
+def process_spectrum(capture_number: int, force: bool=False):
+    """Compute the spectral features (see spectral.py) of both sensors of a capture and cache them on disk.
+
+    A cached spectrum is only recomputed if its raw data was modified after it was cached,
+    if the STFT parameters have changed since, or if force is True.
+    """
+    output_path = OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+
+    for sensor_name in ('tongue', 'throat'):
+        input_filename = _get_sensor_source(capture_number, sensor_name)
+        output_filename = output_path + SPECTRUM_FILENAME.format(sensor_name)
+        if not force and _spectrum_is_cached(input_filename, output_filename):
+            continue
+
+        chunks = list(_read_sensor_chunks(capture_number, sensor_name))
+        times = np.concatenate([chunk_times for chunk_times, _readings in chunks]) if chunks else np.empty(0, dtype=np.int64)
+        readings = np.concatenate([readings for _times, readings in chunks]) if chunks else np.empty((0, 6))
+        data = np.column_stack((readings, np.sqrt((readings[:, :3] ** 2).sum(axis=1))))
+
+        features = spectral.compute_spectrum(times, data)
+        features['power'] = features['power'].astype(np.float32)
+        # Remember what the cache was built from, so that we know when it is stale.
+        np.savez_compressed(output_filename,
+                            channels=np.array(SPECTRUM_CHANNELS),
+                            source_mtime=np.float64(os.path.getmtime(input_filename)),
+                            segment_length=np.int64(spectral.SEGMENT_LENGTH),
+                            segment_overlap=np.int64(spectral.SEGMENT_OVERLAP),
+                            version=np.int64(SPECTRUM_CACHE_VERSION),
+                            **features)
+
+
+def _spectrum_is_cached(input_filename: str, output_filename: str):
+    """Return whether the spectrum cached in output_filename is up to date with input_filename."""
+    try:
+        with np.load(output_filename) as cached:
+            return 'version' in cached.files and cached['version'] == SPECTRUM_CACHE_VERSION \
+                and cached['source_mtime'] == os.path.getmtime(input_filename) \
+                and cached['segment_length'] == spectral.SEGMENT_LENGTH \
+                and cached['segment_overlap'] == spectral.SEGMENT_OVERLAP
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return False
+
+
+def process_filtered(capture_number: int, force: bool=False):
+    """Filter both sensors of a capture (see filters.SensorFilter), a chunk at a time, and save the results.
+
+    Like the spectrum, the filtered data is only made again if the raw data was modified since, or if force is True.
+    The filters use the declared capture rate (when there is one) like filters.make_filter_consumer does live,
+    so that both give the same output for the same capture.
+    """
+    def make_filter(sample_rate):
+        return filters.SensorFilter(sample_rate)
+    _process_sensor_stage(capture_number, FILTERED_FILENAME, filters.FILTER_HEADERS, make_filter, force,
+                          use_declared_rate=True)
+
+
+def process_orientation(capture_number: int, force: bool=False):
+    """Estimate the orientation of both sensors of a capture (see orientation.OrientationEstimator), a chunk at a time,
+    and save the results.
+
+    Like the filtered data, the orientation is only estimated again if the raw data was modified since, or if force is True.
+    """
+    def make_estimator(sample_rate):
+        return orientation.OrientationEstimator(sample_rate)
+    _process_sensor_stage(capture_number, ORIENTATION_FILENAME, orientation.ORIENTATION_HEADERS, make_estimator, force)
+
+
+def process_stats(capture_number: int):
+    """Compute the summary statistics of a processed capture and record them in the catalog (see catalog.set_stats).
+
+    For each sensor we keep the minimum, maximum, mean and percentiles (STATS_PERCENTILES) of the gyro magnitude,
+    both over the whole capture and over each chunk of STATS_CHUNK_MS, along with the number of button presses and gaps.
+    The chunks start at multiples of STATS_CHUNK_MS, so chunk i of a sensor covers the same time as chunk i of the other.
+    """
+    output_path = OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    row = catalog.get_capture(capture_number)
+    press_times = pd.read_csv(output_path + 'button.csv', delimiter=',').time.values.astype(np.int64)
+
+    stats = {'press_count': len(press_times), 'gap_count': 0}
+    chunk_stats = {}
+    first_time = None
+    last_time = None
+    for sensor_name in ('tongue', 'throat'):
+        data = pd.read_csv(output_path + sensor_name + '.csv', delimiter=',', usecols=['time', 'gyro_m'])
+        times = data.time.values.astype(np.int64)
+        gyro_m = data.gyro_m.values.astype(np.float64)
+        prefix = sensor_name + '_gyro_m_'
+        if not len(times):
+            for name in ('min', 'max', 'mean') + tuple('p{}'.format(percentile) for percentile in STATS_PERCENTILES):
+                stats[prefix + name] = None
+            chunk_stats[sensor_name] = []
+            continue
+
+        stats[prefix + 'min'] = float(gyro_m.min())
+        stats[prefix + 'max'] = float(gyro_m.max())
+        stats[prefix + 'mean'] = float(gyro_m.mean())
+        for percentile, value in zip(STATS_PERCENTILES, np.percentile(gyro_m, STATS_PERCENTILES)):
+            stats[prefix + 'p{}'.format(percentile)] = float(value)
+        first_time = times[0] if first_time is None else min(first_time, times[0])
+        last_time = times[-1] if last_time is None else max(last_time, times[-1])
+
+        # The rate that the sensor really ran at is best (see rate.py), otherwise the declared rate, otherwise we measure it.
+        sample_rate = None
+        if row is not None:
+            sample_rate = row[sensor_name + '_rate'] or row['capture_rate']
+        sample_rate = sample_rate or spectral.estimate_sample_rate(times)
+        # Without a rate (too few frames to measure it), we can't tell a gap from a normal step.
+        if sample_rate is not None:
+            stats['gap_count'] += int((np.diff(times) > GAP_SAMPLE_INTERVALS * 1000 / sample_rate).sum())
+
+        # The rows where each chunk starts. The processed times are unwrapped, so they only ever go up.
+        chunk_numbers = times // STATS_CHUNK_MS
+        starts = np.flatnonzero(np.concatenate(([True], np.diff(chunk_numbers) != 0)))
+        ends = np.concatenate((starts[1:], [len(times)]))
+        chunk_starts = chunk_numbers[starts] * STATS_CHUNK_MS
+        chunk_ends = chunk_starts + STATS_CHUNK_MS
+        chunk_press_counts = np.searchsorted(press_times, chunk_ends) - np.searchsorted(press_times, chunk_starts)
+        chunk_stats[sensor_name] = list(zip(
+            chunk_starts.tolist(), (chunk_ends - 1).tolist(), (ends - starts).tolist(),
+            np.minimum.reduceat(gyro_m, starts).tolist(), np.maximum.reduceat(gyro_m, starts).tolist(),
+            (np.add.reduceat(gyro_m, starts) / (ends - starts)).tolist(), chunk_press_counts.tolist()))
+
+    duration_seconds = None if first_time is None else (last_time - first_time) / 1000
+    catalog.set_stats(capture_number, stats, chunk_stats, duration_seconds)
+
+
+def _process_sensor_stage(capture_number: int, output_filename_format: str, headers, make_stage, force: bool,
+                          use_declared_rate: bool=False):
+    """Run each sensor of a capture through a stage that is made by make_stage(sample_rate)
+    and has a process(times, readings) like filters.SensorFilter, and save its output as csv.
+
+    If use_declared_rate is True, the stage is made with the declared capture rate rather than the measured one.
+    """
+    output_path = OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+    row = catalog.get_capture(capture_number)
+
+    for sensor_name in ('tongue', 'throat'):
+        source_filename = _get_sensor_source(capture_number, sensor_name)
+        output_filename = output_path + output_filename_format.format(sensor_name)
+        if not force and os.path.isfile(output_filename) \
+                and os.path.getmtime(output_filename) >= os.path.getmtime(source_filename):
+            continue
+
+        # The rate that the sensor really ran at is best (see rate.py), otherwise we use the declared rate.
+        sample_rate = None
+        if row is not None:
+            sample_rate = row['capture_rate'] if use_declared_rate else row[sensor_name + '_rate'] or row['capture_rate']
+
+        stage = None
+        with open(output_filename, 'w') as output_file:
+            output_file.write(format_csv(headers) + '\n')
+            for times, readings in _read_sensor_chunks(capture_number, sensor_name):
+                if stage is None:
+                    # For old captures that have no rate in the catalog, we measure it from the first chunk.
+                    sample_rate = sample_rate or spectral.estimate_sample_rate(times)
+                    if sample_rate is None:
+                        # Too few frames to measure the rate, and too few to be worth filtering. We leave only the headers.
+                        # debug
+                        print('$ The {} sensor of capture {} has no sample rate, skipping {}'.format(
+                            sensor_name, capture_number, output_filename))
+                        break
+                    stage = make_stage(sample_rate)
+                output = stage.process(times, readings)
+                np.savetxt(output_file, output, fmt=['%d'] + ['%.6g'] * (output.shape[1] - 1), delimiter=',')
+
+
+def _get_sensor_source(capture_number: int, sensor_name: str):
+    """Return the filename that the data of a sensor is read from: its csv file, or the archive if only that was kept."""
+    input_filename = INPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + sensor_name + '.csv'
+    if os.path.isfile(input_filename):
+        return input_filename
+    import archive
+    return archive.get_archive_filename(capture_number)
+
+
+def _read_sensor_chunks(capture_number: int, sensor_name: str, with_buttons: bool=False):
+    """Yield the data of a sensor a chunk at a time, as (times, readings): the times unwrapped,
+    and the readings of shape (samples, 6) in the order gyro x, y, z, accl x, y, z.
+
+    If with_buttons is True, (times, readings, buttons) is yielded instead.
+    Every reader of the raw data of a capture goes through here, so that a capture that only has its archive can be read.
+    """
+    source_filename = _get_sensor_source(capture_number, sensor_name)
+    if not source_filename.endswith('.csv'):
+        import archive
+        with archive.ArchiveReader(source_filename) as reader:
+            # The times in an archive are already unwrapped.
+            for chunk in reader.iter_chunks(sensor_name):
+                readings = np.column_stack([chunk[column] for column in archive.COLUMNS[1:7]]).astype(np.float64)
+                yield (chunk['time'], readings, chunk['button']) if with_buttons else (chunk['time'], readings)
+        return
+
+    unwrapper = TimeUnwrapper()
+    for chunk in pd.read_csv(source_filename, delimiter=',', chunksize=FILTER_CHUNK_ROWS):
+        # Unwrap the time (see unwrap_time), carrying on from the previous chunk.
+        times = unwrapper.unwrap_array(chunk.time.values)
+
+        readings = np.column_stack((chunk.gyroX.values, chunk.gyroY.values, chunk.gyroZ.values,
+                                    chunk.acclX.values, chunk.acclY.values, chunk.acclZ.values))
+        yield (times, readings, chunk.button.values) if with_buttons else (times, readings)
+
+
+def load_spectrum(capture_number: int, sensor_name: str):
+    """Return the cached spectral features of a sensor ('tongue' or 'throat'), computing them first if necessary."""
+    process_spectrum(capture_number)
+    output_filename = OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + SPECTRUM_FILENAME.format(sensor_name)
+    with np.load(output_filename) as cached:
+        return {key: cached[key] for key in cached.files}
+
+
+def unwrap_time(times):
+    """Correct for overflow in the 16 bit timestamps of a whole sensor file at once (see util.TimeUnwrapper).
+
+    Every time the timer overflowed, we add another TIME_OVERFLOW to the timestamp and to every timestamp after it.
+    """
+    return TimeUnwrapper().unwrap_array(times)
 
 
 def capture_was_processed(capture_number: int):
-    """Given a capture number, return whether we can find the processed marker (see PROCESSED_MARKER_FILENAME) in its subdirectory."""
-    return os.path.isfile(INPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + PROCESSED_MARKER_FILENAME)
+    """Given a capture number, return whether the catalog says that it was processed."""
+    row = catalog.get_capture(capture_number)
+    return row is not None and bool(row['processed'])
 
 
 """
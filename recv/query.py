@@ -0,0 +1,190 @@
+"""Read a range of time out of a capture without reading the whole capture.
+
+    data = query.load_range(13, 'tongue', 60000, 62000, columns=('time', 'gyroX'))
+    print(data['time'], data['gyroX'])
+
+To find where a range of time starts in a raw csv file, every capture has a time index for each sensor:
+the byte offset (and row number) of the first frame in every TIME_INDEX_INTERVAL_MS of the capture.
+The index is built while the capture is being written (see capture.writing_consumer), so it costs nothing to make.
+Reading a range is then a seek to the last index entry before the range and a read up to the first entry after it.
+Captures that were made before we had time indexes get one the first time that they are queried.
+
+Times are unwrapped (see process.unwrap_time), so they keep counting past the 16 bit limit of the transmitter's timestamps.
+The csv files of a capture that was made with a trigger (see trigger.py) hold times that were already unwrapped,
+which is recorded by an empty UNWRAPPED_MARKER_FILENAME in the capture subdirectory, and we use those times as they are.
+If a capture has an archive (see archive.py) but no raw csv files, the range is read from the archive instead.
+
+To look through a long capture for strong motion, scan_range reads a range a chunk at a time,
+and skips the chunks whose largest gyro magnitude (from the statistics in the catalog, see process.process_stats)
+is below what we are looking for, without reading them at all.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import io
+
+import numpy as np
+
+from util import *
+import catalog
+
+# How often (in ms of capture time) there is an entry in the time index.
+TIME_INDEX_INTERVAL_MS = 250
+
+# The time index of a sensor is kept next to its csv file, e.g. 'tongue_time_index.npy'.
+# It is an array with a row of (unwrapped time, byte offset, row number) per entry.
+TIME_INDEX_FILENAME = '{}_time_index.npy'
+
+# Name of the empty file that is placed in a raw capture subdirectory whose csv files hold unwrapped times (see trigger.py).
+UNWRAPPED_MARKER_FILENAME = 'times_unwrapped'
+
+
+class TimeIndexBuilder(object):
+    """Builds the time index of a csv file as its rows are written.
+
+    Call add with the (wrapped) time of every row and the byte offset that the row starts at, then save.
+    Times that were already unwrapped only ever go up, so they pass through unchanged.
+    """
+
+    __slots__ = ('interval', 'entries', 'row_count', 'unwrapper', 'next_entry_time')
+
+    def __init__(self, interval=TIME_INDEX_INTERVAL_MS):
+        self.interval = interval
+        self.entries = []
+        self.row_count = 0
+        self.unwrapper = TimeUnwrapper()
+        self.next_entry_time = None
+
+    def add(self, time, offset):
+        # We must correct for overflow in the time, exactly like process.unwrap_time does.
+        time = self.unwrapper.unwrap(time)
+
+        if self.next_entry_time is None or time >= self.next_entry_time:
+            self.entries.append((time, offset, self.row_count))
+            self.next_entry_time = time - time % self.interval + self.interval
+        self.row_count += 1
+
+    def save(self, filename):
+        np.save(filename, np.array(self.entries, dtype=np.int64).reshape(-1, 3))
+
+
+def get_time_index_filename(capture_number: int, sensor_name: str):
+    """Return the filename of the time index of a sensor ('tongue' or 'throat') of a capture."""
+    return catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + TIME_INDEX_FILENAME.format(sensor_name)
+
+
+def build_time_index(capture_number: int, sensor_name: str):
+    """Build the time index of a sensor of a capture by reading through its csv file once. Return the index."""
+    builder = TimeIndexBuilder()
+    input_filename = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + sensor_name + '.csv'
+    with open(input_filename, 'rb') as input_file:
+        # Skip the csv headers.
+        offset = len(input_file.readline())
+        for line in input_file:
+            builder.add(int(line[:line.index(b',')]), offset)
+            offset += len(line)
+    builder.save(get_time_index_filename(capture_number, sensor_name))
+    return np.load(get_time_index_filename(capture_number, sensor_name))
+
+
+def load_time_index(capture_number: int, sensor_name: str):
+    """Return the time index of a sensor of a capture, building it first if it is missing or older than the csv file."""
+    input_filename = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + sensor_name + '.csv'
+    index_filename = get_time_index_filename(capture_number, sensor_name)
+    try:
+        if os.path.getmtime(index_filename) >= os.path.getmtime(input_filename):
+            return np.load(index_filename)
+    except OSError:
+        pass
+    return build_time_index(capture_number, sensor_name)
+
+
+def times_are_unwrapped(capture_number: int):
+    """Return whether the csv files of a capture hold times that were already unwrapped (see UNWRAPPED_MARKER_FILENAME)."""
+    return os.path.isfile(catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + UNWRAPPED_MARKER_FILENAME)
+
+
+def load_range(capture_number: int, sensor_name: str, start_time=None, end_time=None, columns=None):
+    """Return a dict of arrays, one per column, holding the frames of a sensor with start_time <= time <= end_time.
+
+    Times are in ms, unwrapped. A start_time or end_time of None means the start or end of the capture.
+    The columns are those of the raw csv files (see capture.HEADERS), all of them if columns is None.
+    """
+    # See capture.HEADERS. We don't import capture here, since it needs serial.
+    headers = ('time', 'gyroX', 'gyroY', 'gyroZ', 'acclX', 'acclY', 'acclZ', 'button')
+    columns = headers if columns is None else tuple(columns)
+    input_filename = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + sensor_name + '.csv'
+
+    if not os.path.isfile(input_filename):
+        # Maybe only the archive was kept.
+        import archive
+        with archive.ArchiveReader(archive.get_archive_filename(capture_number)) as reader:
+            return reader.read_range(sensor_name, start_time, end_time, columns)
+
+    index = load_time_index(capture_number, sensor_name)
+    if len(index) == 0:
+        return {column: np.empty(0) for column in columns}
+    times = index[:, 0]
+
+    # Start from the last entry at or before start_time, and stop at the first entry after end_time.
+    first_entry = 0 if start_time is None else max(0, np.searchsorted(times, start_time, side='right') - 1)
+    last_entry = len(index) if end_time is None else np.searchsorted(times, end_time, side='right')
+    start_offset = index[first_entry, 1]
+
+    with open(input_filename, 'rb') as input_file:
+        input_file.seek(start_offset)
+        if last_entry < len(index):
+            data = input_file.read(index[last_entry, 1] - start_offset)
+        else:
+            data = input_file.read()
+
+    # Only the columns that were asked for are parsed (the time is always needed to trim the range).
+    import pandas as pd
+    use_columns = [column for column in headers if column in columns or column == 'time']
+    input_reader = pd.read_csv(io.BytesIO(data), delimiter=',', header=None, names=headers, usecols=use_columns)
+    values = {column: input_reader[column].values for column in use_columns}
+
+    wrapped_times = values['time'].astype(np.int64)
+    if not times_are_unwrapped(capture_number) and not (wrapped_times >= TIME_OVERFLOW).any():
+        # The index tells us how many times the timer had overflowed before the first row we read.
+        # We continue to unwrap from there.
+        # (Trigger captures from before the marker was written are caught by their times being too big to be wrapped.
+        # Where all of their times are small enough, they never overflowed, and unwrapping doesn't change them.)
+        values['time'] = TimeUnwrapper(start=times[first_entry]).unwrap_array(wrapped_times)
+
+    # Trim the rows outside of the range, which came from the entries at either end.
+    keep = np.ones(len(wrapped_times), dtype=bool)
+    if start_time is not None:
+        keep &= values['time'] >= start_time
+    if end_time is not None:
+        keep &= values['time'] <= end_time
+    return {column: values[column][keep] for column in columns}
+
+
+def scan_range(capture_number: int, sensor_name: str, start_time=None, end_time=None, columns=None, min_gyro_m=None):
+    """Yield the data of a sensor between start_time and end_time (like load_range), one run of chunks
+    (see process.STATS_CHUNK_MS) at a time, skipping the chunks whose largest gyro magnitude is below min_gyro_m.
+
+    If the capture has no chunk statistics yet (it wasn't processed since they were added), nothing is skipped.
+    """
+    chunks = catalog.get_chunk_stats(capture_number, sensor_name) if min_gyro_m is not None else []
+    if not chunks:
+        yield load_range(capture_number, sensor_name, start_time, end_time, columns)
+        return
+
+    # Merge the chunks that we need to read and that follow one another into runs, so that each run is one read.
+    runs = []
+    for chunk in chunks:
+        if (start_time is not None and chunk['end_time'] < start_time) or (end_time is not None and chunk['start_time'] > end_time):
+            continue
+        if chunk['gyro_m_max'] is None or chunk['gyro_m_max'] < min_gyro_m:
+            continue
+        if runs and runs[-1][1] + 1 == chunk['start_time']:
+            runs[-1][1] = chunk['end_time']
+        else:
+            runs.append([chunk['start_time'], chunk['end_time']])
+
+    for run_start, run_end in runs:
+        yield load_range(capture_number, sensor_name,
+                         run_start if start_time is None else max(run_start, start_time),
+                         run_end if end_time is None else min(run_end, end_time), columns)
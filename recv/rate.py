@@ -0,0 +1,105 @@
+"""Measure the real sample rate of each sensor from the timestamps of its frames.
+
+The config that the transmitter sends declares a capture rate, but frames that are dropped or rejected
+(or a transmitter that can't keep up) mean that we actually receive fewer, so counting frames
+and dividing by the capture rate gives the wrong duration. A RateMonitor looks at the timestamps instead:
+it tracks how long the capture has really been going on (elapsed_seconds), and the rate of each sensor
+over the last RATE_WINDOW_SECONDS, which can be compared against the declared rate (see drift).
+
+    monitor = RateMonitor(config.capture_rate)
+    monitor.add(block)
+    print(monitor.elapsed_seconds, monitor.get_rate(TONGUE_SENSOR_ID), monitor.drift(TONGUE_SENSOR_ID))
+"""
+
+__author__ = 'Joseph Rubin'
+
+from collections import deque
+
+from const import *
+from frame import FrameBlock
+from util import TimeUnwrapper
+
+# The rate is measured over this much of the most recent capture time.
+# The timestamps only have millisecond resolution, so this shouldn't be too short.
+RATE_WINDOW_SECONDS = 2
+
+SENSOR_IDS = (TONGUE_SENSOR_ID, THROAT_SENSOR_ID)
+
+
+class RateMonitor(object):
+    """Measures the sample rate of each sensor, and the elapsed time of the capture, from the frames it is given."""
+
+    def __init__(self, declared_rate, window_seconds=RATE_WINDOW_SECONDS):
+        self.declared_rate = declared_rate
+        self.window_ms = window_seconds * 1000
+
+        # Per sensor, to unwrap the timestamps.
+        self._unwrappers = {sensor: TimeUnwrapper() for sensor in SENSOR_IDS}
+        # Per sensor: (unwrapped time, frames received until then) at the end of each batch, for the last window.
+        self._history = {sensor: deque() for sensor in SENSOR_IDS}
+        self._frame_counts = {sensor: 0 for sensor in SENSOR_IDS}
+        # Per sensor: the unwrapped times of its first and latest frames.
+        self._first_times = {}
+        self._last_times = {}
+
+        self.first_time = None
+        self.last_time = None
+
+    def add(self, batch):
+        """Account for a batch of frames (a FrameBlock or a list of frames), in the order they were received."""
+        if isinstance(batch, FrameBlock):
+            pairs = zip(batch.sensor, batch.time)
+        else:
+            pairs = ((frame.flag.sensor, frame.time) for frame in batch)
+
+        latest = {}
+        for sensor, time in pairs:
+            if sensor not in self._frame_counts:
+                continue
+            time = self._unwrappers[sensor].unwrap(time)
+
+            self._frame_counts[sensor] += 1
+            latest[sensor] = time
+            if sensor not in self._first_times:
+                self._first_times[sensor] = time
+            self._last_times[sensor] = time
+            if self.first_time is None:
+                self.first_time = time
+            if self.last_time is None or time > self.last_time:
+                self.last_time = time
+
+        for sensor, time in latest.items():
+            history = self._history[sensor]
+            history.append((time, self._frame_counts[sensor]))
+            # Keep one point from before the window, so that the window is always fully covered.
+            while len(history) > 2 and history[1][0] <= time - self.window_ms:
+                history.popleft()
+
+    @property
+    def elapsed_seconds(self):
+        """How much capture time has passed between the first frame and the latest one, according to their timestamps."""
+        if self.first_time is None:
+            return 0
+        return (self.last_time - self.first_time) / 1000
+
+    def get_rate(self, sensor):
+        """Return the rate (in Hz) of a sensor over the last window, or None if we can't tell yet."""
+        history = self._history[sensor]
+        if len(history) < 2 or history[-1][0] == history[0][0]:
+            return None
+        (first_time, first_count), (last_time, last_count) = history[0], history[-1]
+        return (last_count - first_count) * 1000 / (last_time - first_time)
+
+    def get_average_rate(self, sensor):
+        """Return the rate (in Hz) of a sensor over the whole capture, or None if we can't tell."""
+        if sensor not in self._first_times or self._last_times[sensor] == self._first_times[sensor]:
+            return None
+        # The frames of a sensor span one sample interval less than their count.
+        return (self._frame_counts[sensor] - 1) * 1000 / (self._last_times[sensor] - self._first_times[sensor])
+
+    def drift(self, sensor):
+        """Return how far (as a fraction) the measured rate of a sensor is from the declared rate, or None."""
+        rate = self.get_rate(sensor)
+        if rate is None or not self.declared_rate:
+            return None
+        return rate / self.declared_rate - 1
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Render a thumbnail and a summary report of every capture, without a display, so they can be looked over at a glance.
+
+Looking over a day of captures used to mean plotting each of them in the GUI and waiting for each plot.
+Instead, this makes a small overview image of the gyro magnitude of both sensors (THUMBNAIL_FILENAME),
+which the capture list of the GUI shows next to each capture, and a text report (REPORT_FILENAME)
+with what the catalog knows about the capture: its config, frame counts, rates, statistics, trailer metadata, and saturation.
+Both are kept in the processed subdirectory of the capture.
+
+The thumbnail is only a few hundred pixels wide, so we never draw every sample: the data is decimated to the smallest
+and largest value in each column of pixels, which looks the same (peaks included) and is far faster to draw.
+The figures are drawn with matplotlib's Agg backend, straight into a file, so no display is needed.
+
+Run this file to render every capture that is new or changed since it was last rendered, using every core of the machine.
+Give 'force' as the first command line argument to render every capture again.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from const import *
+from util import *
+import catalog
+import process
+import saturation
+
+# Kept in the processed subdirectory of a capture, like the thumbnail (see const.THUMBNAIL_FILENAME).
+REPORT_FILENAME = 'report.txt'
+
+# The size of a thumbnail. It should fit in a row of the capture list of the GUI.
+THUMBNAIL_WIDTH_PIXELS = 120
+THUMBNAIL_HEIGHT_PIXELS = 20
+THUMBNAIL_DPI = 100
+
+# The colors of the sensors, like in plot_mag.
+SENSOR_COLORS = {'tongue': '#1F77B4', 'throat': '#FF8000'}
+
+SENSOR_NAMES = ('tongue', 'throat')
+
+
+def render_capture(capture_number: int, force: bool=False):
+    """Render the thumbnail and the report of a capture, processing it first if it was never processed.
+
+    Nothing is done if they are newer than the processed data (and the catalog says that it was processed), unless force is True.
+    Return whether they were rendered.
+    """
+    if not process.capture_was_processed(capture_number):
+        process.process_capture(capture_number)
+    path = catalog.PROCESSED_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    if not force and is_rendered(capture_number):
+        return False
+
+    press_times = pd.read_csv(path + 'button.csv', delimiter=',').time.values
+    figure = Figure(figsize=(THUMBNAIL_WIDTH_PIXELS / THUMBNAIL_DPI, THUMBNAIL_HEIGHT_PIXELS / THUMBNAIL_DPI), dpi=THUMBNAIL_DPI)
+    FigureCanvasAgg(figure)
+    # The axes take up the whole image, with no ticks or labels.
+    axes = figure.add_axes((0, 0, 1, 1))
+    axes.set_axis_off()
+    for sensor_name in SENSOR_NAMES:
+        data = pd.read_csv(path + sensor_name + '.csv', delimiter=',', usecols=['time', 'gyro_m'])
+        times, gyro_m = decimate(data.time.values, data.gyro_m.values, THUMBNAIL_WIDTH_PIXELS)
+        axes.plot(times, gyro_m, color=SENSOR_COLORS[sensor_name], lw=0.5)
+    for press_time in press_times:
+        axes.axvline(press_time, color='k', lw=0.5, ls=':')
+    figure.savefig(path + THUMBNAIL_FILENAME, dpi=THUMBNAIL_DPI)
+
+    with open(path + REPORT_FILENAME, 'w') as report_file:
+        report_file.write(make_report(capture_number))
+    return True
+
+
+def is_rendered(capture_number: int):
+    """Return whether the thumbnail and report of a capture are up to date with its processed data."""
+    path = catalog.PROCESSED_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    try:
+        rendered = min(os.path.getmtime(path + THUMBNAIL_FILENAME), os.path.getmtime(path + REPORT_FILENAME))
+        return all(os.path.getmtime(path + filename) <= rendered for filename in ('tongue.csv', 'throat.csv', 'button.csv'))
+    except OSError:
+        return False
+
+
+def decimate(times, values, bucket_count):
+    """Return (times, values) with only the smallest and the largest value of each of bucket_count equal spans of time,
+    in the order they came, so that a plot of them looks just like a plot of all of them at that width."""
+    if len(times) <= 2 * bucket_count:
+        return times, values
+    buckets = ((times - times[0]) * bucket_count // max(1, times[-1] - times[0])).clip(0, bucket_count - 1)
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(buckets) != 0)))
+    ends = np.concatenate((starts[1:], [len(times)]))
+    # The index of the smallest and largest value within each bucket.
+    order = np.lexsort((values, buckets))
+    smallest = order[starts]
+    largest = order[ends - 1]
+    indexes = np.sort(np.concatenate((smallest, largest)))
+    return times[indexes], values[indexes]
+
+
+def make_report(capture_number: int):
+    """Return the text of the summary report of a capture, made from the catalog and the saturation report."""
+    row = catalog.get_capture(capture_number)
+    lines = [('capture', capture_number)]
+    if row is not None:
+        lines.append(('started', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['started'])) if row['started'] else None))
+        for key in ('status', 'port', 'duration_seconds', 'capture_rate', 'gyro_scale', 'accl_scale',
+                    'frame_count', 'tongue_frame_count', 'throat_frame_count', 'bad_checksum_count',
+                    'tongue_rate', 'throat_rate') + catalog.STATS_COLUMNS:
+            if key in row.keys():
+                lines.append((key, row[key]))
+        # What the transmitter reported in the trailer.
+        lines.extend(catalog.get_metadata(capture_number).items())
+
+    saturation_filename = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + saturation.SATURATION_FILENAME
+    if os.path.isfile(saturation_filename):
+        with open(saturation_filename) as saturation_file:
+            saturation_report = json.load(saturation_file)
+        for sensor_name, sensor_report in saturation_report['sensors'].items():
+            lines.append((sensor_name + '_saturated_count', sum(sensor_report['saturated_counts'].values())))
+            lines.append((sensor_name + '_saturated_interval_count', len(sensor_report['saturated_intervals'])))
+        lines.append(('recommended_gyro_scale', saturation_report['recommended_gyro_scale']))
+        lines.append(('recommended_accl_scale', saturation_report['recommended_accl_scale']))
+
+    return ''.join('{}: {}\n'.format(key, '{:.6g}'.format(value) if isinstance(value, float) else value) for key, value in lines)
+
+
+def main():
+    force = len(sys.argv) > 1 and sys.argv[1] == 'force'
+    capture_numbers = [row['number'] for row in catalog.list_captures()]
+    # debug
+    print('$ Rendering', len(capture_numbers), 'captures')
+
+    rendered_count = 0
+    # Each capture is rendered in a process of its own, since reading the csv files and drawing both hold the GIL.
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(render_capture, capture_number, force) for capture_number in capture_numbers]
+        for capture_number, future in zip(capture_numbers, futures):
+            try:
+                rendered_count += future.result()
+            except (OSError, ValueError, KeyError) as e:
+                # A capture with missing or broken files shouldn't stop the others.
+                print('$ Could not render capture', capture_number, '-', e)
+
+    print('$ Rendered {} captures, the rest were up to date.'.format(rendered_count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""Log every byte that goes over the serial connection, and play such a log back in place of the transmitter.
+
+When a capture goes wrong, its csv files only show what we made of the frames, not what we actually received.
+A TeeConnection wraps a serial connection and writes every byte that is read from it (the SIG_READY handshake,
+the config, the frames, and the trailer) and every byte that is written to it into a log, along with when it happened.
+capture.make_con does this for us when capture.LOG_SERIAL_BYTES is True.
+
+A ReplayConnection reads such a log and acts like a serial.Serial, so it can be given to capture_frames
+(or anything else that takes a connection) to go through the capture again, without the hardware.
+It can play the bytes back at the pace they were received (realtime) or as fast as they can be read,
+which also makes it a realistic workload for measuring how fast we can handle frames.
+What we write to a ReplayConnection is ignored, since the log already holds how the transmitter answered.
+
+A log looks like this:
+
+    MAGIC
+    header length (4 bytes), then the header: utf-8 json with the port, baud rate, and whether the connection was resetting
+    records, each a RECORD_FORMAT (direction, seconds since the connection was opened, length) followed by the bytes
+
+Run this file with the filename of a log to replay it through capture_blocks and report the throughput.
+Add 'realtime' to play it back at the pace it was recorded, and 'write' to save it as a new capture too.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import bisect
+import json
+import struct
+import sys
+import time
+
+# Marks the start of a log file.
+MAGIC = b'ELIJAHS1'
+
+#               direction, seconds, length
+RECORD_FORMAT = '<cdI'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+DIRECTION_READ = b'r'
+DIRECTION_WRITE = b'w'
+
+# The size of the buffer of the log file. The log is written on the thread that reads the connection, so it should be big.
+LOG_BUFFER_SIZE = 1 << 20
+# But the buffer is handed to the operating system at least this often (in seconds), so that if we crash or are killed,
+# the log still holds what happened until just before, which is what we want it for.
+LOG_FLUSH_INTERVAL_SECONDS = 0.25
+
+
+class TeeConnection(object):
+    """Wraps a serial connection and logs every byte read from it or written to it.
+
+    Everything else (opening, closing, the port, the timeout...) is passed through to the connection.
+    The log is opened when the connection is opened.
+    """
+
+    def __init__(self, con, log_filename):
+        self._con = con
+        self._log_filename = log_filename
+        self._log = None
+        self._start = None
+        self._last_flush = None
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def __setattr__(self, name, value):
+        # Our own attributes start with an underscore, the rest belong to the connection.
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._con, name, value)
+
+    def open(self):
+        self._con.open()
+        self._log = open(self._log_filename, 'wb', buffering=LOG_BUFFER_SIZE)
+        self._start = self._last_flush = time.perf_counter()
+        header = json.dumps({'port': self._con.port, 'baudrate': self._con.baudrate, 'resetting': bool(self._con.dtr),
+                             'started': time.time()}).encode('utf-8')
+        self._log.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    def close(self):
+        self._con.close()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _record(self, direction, data):
+        if data and self._log is not None:
+            now = time.perf_counter()
+            self._log.write(struct.pack(RECORD_FORMAT, direction, now - self._start, len(data)) + data)
+            if now - self._last_flush >= LOG_FLUSH_INTERVAL_SECONDS:
+                self._log.flush()
+                self._last_flush = now
+
+    def read(self, size=1):
+        data = self._con.read(size)
+        self._record(DIRECTION_READ, data)
+        return data
+
+    def read_until(self, *args, **kwargs):
+        data = self._con.read_until(*args, **kwargs)
+        self._record(DIRECTION_READ, data)
+        return data
+
+    def readline(self, *args, **kwargs):
+        data = self._con.readline(*args, **kwargs)
+        self._record(DIRECTION_READ, data)
+        return data
+
+    def write(self, data):
+        self._record(DIRECTION_WRITE, bytes(data))
+        return self._con.write(data)
+
+
+def read_log(filename):
+    """Return the header of a log, and its records as a list of (direction, seconds, bytes)."""
+    with open(filename, 'rb') as log_file:
+        if log_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(filename + ' is not a serial log.')
+        header_length, = struct.unpack('<I', log_file.read(4))
+        header = json.loads(log_file.read(header_length).decode('utf-8'))
+        records = []
+        while True:
+            record = log_file.read(RECORD_SIZE)
+            if len(record) < RECORD_SIZE:
+                # A log that was cut off (e.g. by a crash) is good up to its last whole record.
+                break
+            direction, seconds, length = struct.unpack(RECORD_FORMAT, record)
+            data = log_file.read(length)
+            if len(data) < length:
+                break
+            records.append((direction, seconds, data))
+    return header, records
+
+
+class ReplayConnection(object):
+    """Acts like a serial.Serial connection to the transmitter, but plays back the bytes of a log.
+
+    With realtime, the bytes only become available when they did when the log was made (divided by speed).
+    Otherwise every byte is available right away. When the log runs out, reads come back short, just like a timeout.
+    """
+
+    def __init__(self, log_filename, *, realtime=False, speed=1.0):
+        self.header, records = read_log(log_filename)
+        received = [(seconds, data) for direction, seconds, data in records if direction == DIRECTION_READ]
+        self.data = b''.join(data for _seconds, data in received)
+        # For realtime: the offset in data where each record ends, and the time when it was received.
+        self._ends = []
+        self._times = []
+        end = 0
+        for seconds, data in received:
+            end += len(data)
+            self._ends.append(end)
+            self._times.append(seconds)
+
+        self.realtime = realtime
+        self.speed = speed
+        self.position = 0
+        self._start = None
+
+        # So that we look like a serial.Serial.
+        self.port = self.header.get('port')
+        self.baudrate = self.header.get('baudrate')
+        self.dtr = self.header.get('resetting')
+        self.timeout = None
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+        self._start = time.perf_counter()
+
+    def close(self):
+        self.is_open = False
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def _available_end(self):
+        """Return the offset in data up to which the bytes have 'arrived'."""
+        if not self.realtime:
+            return len(self.data)
+        elapsed = (time.perf_counter() - self._start) * self.speed
+        received_count = bisect.bisect_right(self._times, elapsed)
+        return self._ends[received_count - 1] if received_count else 0
+
+    def _wait_for(self, end):
+        """Wait until the bytes up to offset end have arrived (or the log is over)."""
+        end = min(end, len(self.data))
+        if not self.realtime or self._available_end() >= end:
+            return
+        # The time when the record that holds the byte at end - 1 was received.
+        arrival = self._times[bisect.bisect_left(self._ends, end)]
+        time.sleep(max(0, arrival / self.speed - (time.perf_counter() - self._start)))
+
+    @property
+    def in_waiting(self):
+        return self._available_end() - self.position
+
+    def read(self, size=1):
+        self._wait_for(self.position + size)
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        index = self.data.find(expected, self.position)
+        end = len(self.data) if index == -1 else index + len(expected)
+        if size is not None:
+            end = min(end, self.position + size)
+        return self.read(end - self.position)
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+
+def main():
+    # We only need these when we run the replay ourselves.
+    import capture
+
+    log_filename = sys.argv[1]
+    realtime = 'realtime' in sys.argv[2:]
+    writing = 'write' in sys.argv[2:]
+
+    con = ReplayConnection(log_filename, realtime=realtime)
+    con.open()
+    if con.dtr:
+        # The log starts with the board resetting.
+        capture.wait_for_sig_ready(con)
+
+    frame_count = 0
+
+    def count_frames(block, _frame_count, _config):
+        nonlocal frame_count
+        frame_count += len(block)
+        return True
+
+    start = time.perf_counter()
+    if writing:
+        capture_number = capture.do_writing_capture(con)
+        # debug
+        print('$ Saved the replay as capture', capture_number)
+    else:
+        capture.capture_blocks(con, count_frames)
+    seconds = time.perf_counter() - start
+    con.close()
+
+    # debug
+    print('$ Replayed {} bytes in {:.2f} s ({:.1f} MB/s).'.format(con.position, seconds, con.position / seconds / 1e6))
+    if not writing:
+        print('$ {} frames, {:.0f} frames/s.'.format(frame_count, frame_count / seconds))
+
+
+if __name__ == '__main__':
+    main()
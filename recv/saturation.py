@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Detect readings that were clipped at the edge of the range of a sensor, and recommend a better range.
+
+As _gyro_range_notes.txt explains, the readings can't go past about +/-32764, so with a GYRO_SCALE_t (or ACCL_SCALE_t)
+that is too small for a motion, the readings stay stuck at the edge of the range and we lose how big the motion was.
+A SaturationDetector counts, per sensor and axis, the readings at the edge of the range (saturated)
+and those close to it (near full scale), and records the intervals of time during which a sensor was saturated.
+
+It also keeps a histogram of the size of the readings, at a constant cost per reading.
+From it, recommend_scales picks the smallest GYRO_SCALE_t and ACCL_SCALE_t (see trans/config.h)
+that would have held all but ALLOWED_CLIPPED_FRACTION of the readings with some headroom.
+If readings were clipped, we can't know how big they really were, so we recommend at least the next bigger scale.
+
+During a capture, make_saturation_consumer does this live and saves the report to the capture subdirectory
+when the capture ends. Run this file with a capture number to make the report from the raw data of an existing capture.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from const import *
+from util import *
+import catalog
+
+# Readings at least this big (in absolute value) are saturated. See _gyro_range_notes.txt.
+SATURATION_VALUE = 32764
+# Readings at least this big are near full scale.
+NEAR_FULL_SCALE_VALUE = int(0.95 * SIXTEEN_BIT_MAX_VALUE)
+
+# The ranges that the transmitter supports (see GYRO_SCALE_t and ACCL_SCALE_t in trans/config.h).
+GYRO_SCALES = (125, 250, 500, 1000, 2000)
+ACCL_SCALES = (2, 4, 8, 16)
+
+# The histogram of the absolute readings has bins of this many raw units.
+HISTOGRAM_BIN_WIDTH = 128
+HISTOGRAM_BIN_COUNT = (SIXTEEN_BIT_MAX_VALUE + 1) // HISTOGRAM_BIN_WIDTH + 1
+
+# We recommend a scale that holds all but this fraction of the readings...
+ALLOWED_CLIPPED_FRACTION = 1e-5
+# ...using no more than this fraction of its range.
+HEADROOM = 0.9
+
+# Saturated intervals that are closer than this (in ms) are merged into one.
+INTERVAL_MERGE_MS = 50
+
+SATURATION_FILENAME = 'saturation.json'
+
+SENSOR_NAMES = {TONGUE_SENSOR_ID: 'tongue', THROAT_SENSOR_ID: 'throat'}
+AXIS_NAMES = ('gyro_x', 'gyro_y', 'gyro_z', 'accl_x', 'accl_y', 'accl_z')
+
+
+class SaturationDetector(object):
+    """Counts saturated readings, records when they happened, and keeps a histogram of the size of the readings."""
+
+    def __init__(self, gyro_scale, accl_scale):
+        self.gyro_scale = gyro_scale
+        self.accl_scale = accl_scale
+
+        # Per sensor, an array with a count per axis.
+        self.reading_counts = {sensor: 0 for sensor in SENSOR_NAMES}
+        self.saturated_counts = {sensor: np.zeros(len(AXIS_NAMES), dtype=np.int64) for sensor in SENSOR_NAMES}
+        self.near_full_scale_counts = {sensor: np.zeros(len(AXIS_NAMES), dtype=np.int64) for sensor in SENSOR_NAMES}
+        # Per sensor, histograms of the absolute gyro and accl readings (all three axes together).
+        self.gyro_histograms = {sensor: np.zeros(HISTOGRAM_BIN_COUNT, dtype=np.int64) for sensor in SENSOR_NAMES}
+        self.accl_histograms = {sensor: np.zeros(HISTOGRAM_BIN_COUNT, dtype=np.int64) for sensor in SENSOR_NAMES}
+        # Per sensor, a list of [start time, end time] (unwrapped ms) during which it was saturated.
+        self.intervals = {sensor: [] for sensor in SENSOR_NAMES}
+
+        self._unwrappers = {sensor: TimeUnwrapper() for sensor in SENSOR_NAMES}
+
+    def add(self, sensor, times, readings):
+        """Account for the readings of a sensor: raw (unscaled, uncalibrated) values of shape (samples, 6),
+        with their (wrapped) timestamps, in the order that they were received."""
+        if not len(times):
+            return
+        times = self._unwrappers[sensor].unwrap_array(times)
+        absolute = np.abs(np.asarray(readings, dtype=np.int64))
+
+        self.reading_counts[sensor] += len(times)
+        saturated = absolute >= SATURATION_VALUE
+        self.saturated_counts[sensor] += saturated.sum(axis=0)
+        self.near_full_scale_counts[sensor] += (absolute >= NEAR_FULL_SCALE_VALUE).sum(axis=0)
+
+        bins = np.minimum(absolute // HISTOGRAM_BIN_WIDTH, HISTOGRAM_BIN_COUNT - 1)
+        self.gyro_histograms[sensor] += np.bincount(bins[:, :3].ravel(), minlength=HISTOGRAM_BIN_COUNT)
+        self.accl_histograms[sensor] += np.bincount(bins[:, 3:].ravel(), minlength=HISTOGRAM_BIN_COUNT)
+
+        intervals = self.intervals[sensor]
+        for time in times[saturated.any(axis=1)]:
+            time = int(time)
+            if intervals and time - intervals[-1][1] <= INTERVAL_MERGE_MS:
+                intervals[-1][1] = time
+            else:
+                intervals.append([time, time])
+
+    def recommend_scales(self):
+        """Return the smallest gyro scale and accl scale that would not have clipped the readings (see the top of this file)."""
+        return (_recommend_scale(sum(self.gyro_histograms.values()), self.gyro_scale, GYRO_SCALES),
+                _recommend_scale(sum(self.accl_histograms.values()), self.accl_scale, ACCL_SCALES))
+
+    def get_report(self):
+        """Return everything that we found, in a form that can be saved as json."""
+        gyro_scale, accl_scale = self.recommend_scales()
+        return {
+            'gyro_scale': self.gyro_scale,
+            'accl_scale': self.accl_scale,
+            'recommended_gyro_scale': gyro_scale,
+            'recommended_accl_scale': accl_scale,
+            'sensors': {
+                SENSOR_NAMES[sensor]: {
+                    'reading_count': self.reading_counts[sensor],
+                    'saturated_counts': dict(zip(AXIS_NAMES, self.saturated_counts[sensor].tolist())),
+                    'near_full_scale_counts': dict(zip(AXIS_NAMES, self.near_full_scale_counts[sensor].tolist())),
+                    'saturated_intervals': self.intervals[sensor],
+                } for sensor in SENSOR_NAMES
+            },
+        }
+
+    def print_report(self):
+        report = self.get_report()
+        for sensor_name, sensor_report in report['sensors'].items():
+            saturated = {axis: count for axis, count in sensor_report['saturated_counts'].items() if count}
+            if saturated:
+                # debug
+                print('$ The {} sensor was saturated in {} intervals: {}'.format(
+                    sensor_name, len(sensor_report['saturated_intervals']),
+                    ', '.join('{} {}'.format(axis, count) for axis, count in saturated.items())))
+        if (report['recommended_gyro_scale'], report['recommended_accl_scale']) != (self.gyro_scale, self.accl_scale):
+            # debug
+            print('$ Recommended GYRO_SCALE_t {} (was {}) and ACCL_SCALE_t {} (was {}).'.format(
+                report['recommended_gyro_scale'], self.gyro_scale, report['recommended_accl_scale'], self.accl_scale))
+
+
+def _recommend_scale(histogram, scale, scales):
+    """Return the smallest of scales that holds the readings of a histogram that were taken at the given scale."""
+    total = histogram.sum()
+    if not total:
+        return scale
+    # The size (in raw units) that all but ALLOWED_CLIPPED_FRACTION of the readings are under.
+    # We take the top of the bin, so we never underestimate.
+    quantile_bin = int(np.searchsorted(np.cumsum(histogram), total * (1 - ALLOWED_CLIPPED_FRACTION)))
+    largest_reading = min((quantile_bin + 1) * HISTOGRAM_BIN_WIDTH, SIXTEEN_BIT_MAX_VALUE)
+
+    if largest_reading >= SATURATION_VALUE:
+        # The readings were clipped, so they needed more than this scale. How much more, we can't tell.
+        bigger = [candidate for candidate in scales if candidate > scale]
+        return bigger[0] if bigger else scales[-1]
+
+    needed = largest_reading / SIXTEEN_BIT_MAX_VALUE * scale / HEADROOM
+    for candidate in scales:
+        if candidate >= needed:
+            return candidate
+    return scales[-1]
+
+
+def make_saturation_consumer(output_path=None):
+    """Return a consumer (see pipeline.py) that detects saturation during a capture.
+
+    When the capture ends the report is printed, and saved to output_path + SATURATION_FILENAME if output_path is given.
+    """
+    from frame import FrameBlock
+    from pipeline import Consumer, BLOCK
+
+    detector = None
+
+    def start(config):
+        nonlocal detector
+        detector = SaturationDetector(config.gyro_scale, config.accl_scale)
+
+    def detect(batch, _config):
+        if isinstance(batch, FrameBlock):
+            sensors = np.frombuffer(batch.sensor, dtype=np.uint8)
+            times = np.frombuffer(batch.time, dtype=np.uint16)
+            readings = np.column_stack([np.frombuffer(getattr(batch, axis), dtype=np.int16) for axis in AXIS_NAMES])
+        else:
+            sensors = np.array([frame.flag.sensor for frame in batch])
+            times = np.array([frame.time for frame in batch])
+            readings = np.array([[getattr(frame.reading, axis) for axis in AXIS_NAMES] for frame in batch]).reshape(-1, 6)
+        for sensor in SENSOR_NAMES:
+            mask = sensors == sensor
+            detector.add(sensor, times[mask], readings[mask])
+        return True
+
+    def end(_frame_count, _bad_checksum_count, _config):
+        detector.print_report()
+        if output_path is not None:
+            with open(output_path + SATURATION_FILENAME, 'w') as output_file:
+                json.dump(detector.get_report(), output_file, indent=4)
+
+    # Every reading must be counted, so we don't drop any batches. The work per batch is small.
+    return Consumer(detect, start_handler=start, end_handler=end, policy=BLOCK, name='saturation')
+
+
+def process_saturation(capture_number: int):
+    """Make the saturation report of an existing capture from its unscaled, uncalibrated data, and save it.
+
+    Return the report, or None if the capture doesn't have what we need (its scales, and its unscaled data).
+    """
+    import pandas as pd
+
+    row = catalog.get_capture(capture_number)
+    input_path = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    if row is None or row['gyro_scale'] is None or row['accl_scale'] is None \
+            or not all(os.path.isfile(input_path + sensor_name + '_unscaled_uncalibrated.csv') for sensor_name in SENSOR_NAMES.values()):
+        # debug
+        print('$ Can not look for saturation in capture', capture_number)
+        return None
+    detector = SaturationDetector(row['gyro_scale'], row['accl_scale'])
+
+    for sensor, sensor_name in SENSOR_NAMES.items():
+        for chunk in pd.read_csv(input_path + sensor_name + '_unscaled_uncalibrated.csv', delimiter=',', chunksize=1 << 16):
+            detector.add(sensor, chunk.time.values, chunk[['gyroX', 'gyroY', 'gyroZ', 'acclX', 'acclY', 'acclZ']].values)
+
+    with open(input_path + SATURATION_FILENAME, 'w') as output_file:
+        json.dump(detector.get_report(), output_file, indent=4)
+    detector.print_report()
+    return detector.get_report()
+
+
+if __name__ == '__main__':
+    process_saturation(int(sys.argv[1]))
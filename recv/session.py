@@ -0,0 +1,237 @@
+"""Keep a connection to the transmitter for as long as the program runs, and get it back when the board is replugged.
+
+Opening a resetting connection (see capture.make_con) reboots the Arduino, and we then have to wait for it to boot
+and send SIG_READY, which takes seconds. And when the board was unplugged, the connection was dead for good,
+so the GUI had to quit. A DeviceSession takes care of both:
+
+It opens the connection warm (without resetting the board) when it can. A board that was just plugged in boots
+on its own and sends SIG_READY, and a board that was already booted (e.g. the program was restarted) is idle and silent,
+so either way it is ready for a SIG_REQUEST. A board that is still sending a capture (the program quit in the middle of one)
+is sent a SIG_ENOUGH, and is ready once it goes quiet. Only if none of that works do we fall back to a resetting open.
+
+While connected, it polls the serial ports every PORT_POLL_SECONDS. When the port disappears (or whoever uses the
+connection reports that it failed, see report_failure), the connection is closed and we wait for a board to come back,
+then connect to it again, trying for at most RECONNECT_TIMEOUT_SECONDS before we start over. The callbacks on_ready
+and on_lost are called (on the session's thread) whenever the connection becomes ready or is lost.
+
+How long connecting took is kept in get_metrics, so we can see what warm connections save us.
+
+    session = DeviceSession(on_ready=lambda con: print('ready'), on_lost=lambda: print('lost'))
+    session.start()
+    session.wait_until_ready()
+    session.con.write(SIG_REQUEST)
+"""
+
+__author__ = 'Joseph Rubin'
+
+import threading
+import time
+from collections import deque
+
+from serial import SerialException
+
+from const import *
+from util import *
+import capture
+
+# How often (in seconds) we look at the serial ports to see if the board was unplugged or plugged in.
+PORT_POLL_SECONDS = 0.5
+
+# How long (in seconds) we try to connect to a board that we found before we give up and wait for a board again.
+RECONNECT_TIMEOUT_SECONDS = 15
+
+# A warm connection: how long we listen for SIG_READY (or for a capture that is still going on) before we decide that
+# the board is idle, and for a board that was just plugged in (which must boot first) how long we wait for SIG_READY.
+WARM_LISTEN_SECONDS = 0.3
+BOOT_SECONDS = 4
+# After a SIG_ENOUGH, a board that was still capturing must be quiet for this long, within at most DRAIN_SECONDS.
+QUIET_SECONDS = 0.3
+DRAIN_SECONDS = 3
+
+# The read timeout of the connection once it is ready (see capture.py).
+READY_TIMEOUT_SECONDS = 1
+
+# How many of the most recent connection times we keep for the metrics.
+METRICS_HISTORY_SIZE = 20
+
+# The ways that a connection was made.
+CONNECTION_WARM = 'warm'
+CONNECTION_BOOTED = 'booted'
+CONNECTION_RESET = 'reset'
+
+
+class DeviceSession(threading.Thread):
+    """Keeps a connection to the transmitter ready, and reconnects to it when it is lost (see the top of this file)."""
+
+    def __init__(self, *, port=None, on_ready=None, on_lost=None):
+        # We are a daemon so that we don't keep the program alive after it is done.
+        threading.Thread.__init__(self, daemon=True)
+        # If port is None, we use the first Arduino that we find (see util.get_arduino_port).
+        self.fixed_port = port
+        self.on_ready = on_ready
+        self.on_lost = on_lost
+
+        # The connection while it is ready, otherwise None.
+        self.con = None
+        self.port = None
+        self.ready = threading.Event()
+        self._failed = threading.Event()
+        self._stop_event = threading.Event()
+
+        # Metrics.
+        self.connect_count = 0
+        self.lost_count = 0
+        # Per connection: (how it was made, seconds from when we started connecting until it was ready).
+        self.connect_history = deque(maxlen=METRICS_HISTORY_SIZE)
+        # How long (in seconds) we were without a connection the last time that we lost it.
+        self.last_downtime_seconds = None
+        self._lost_time = None
+
+    def run(self):
+        # The first time, the board may already be booted, so we try a warm connection.
+        just_plugged_in = False
+        while not self._stop_event.is_set():
+            port = self._wait_for_port()
+            if port is None:
+                return
+            # If the board was unplugged, it will boot when we see it next.
+            # If only the connection failed (or we couldn't connect), the board may be booted already.
+            just_plugged_in = self._watch() if self._connect(port, just_plugged_in) else False
+
+    def wait_until_ready(self, timeout=None):
+        """Wait until the connection is ready, and return it (or None if we timed out)."""
+        self.ready.wait(timeout)
+        return self.con
+
+    def report_failure(self):
+        """Tell the session that the connection failed (e.g. a read timed out), so that it connects again."""
+        self._failed.set()
+
+    def stop(self):
+        """Close the connection and end the session."""
+        self._stop_event.set()
+        self._failed.set()
+
+    def get_metrics(self):
+        """Return a dict of how the session has been going."""
+        seconds = [connect_seconds for _kind, connect_seconds in self.connect_history]
+        return {
+            'connected': self.ready.is_set(),
+            'port': self.port,
+            'connect_count': self.connect_count,
+            'lost_count': self.lost_count,
+            'last_connection': self.connect_history[-1][0] if self.connect_history else None,
+            'last_connect_seconds': seconds[-1] if seconds else None,
+            'average_connect_seconds': sum(seconds) / len(seconds) if seconds else None,
+            'max_connect_seconds': max(seconds) if seconds else None,
+            'last_downtime_seconds': self.last_downtime_seconds,
+        }
+
+    def _get_ports(self):
+        if self.fixed_port is not None:
+            # The port that we were given may not be an Arduino Uno (e.g. a USB to serial adapter),
+            # so we only look for it among every port, whatever its description.
+            return [self.fixed_port] if self.fixed_port in get_ports_of('') else []
+        return get_arduino_ports()
+
+    def _wait_for_port(self):
+        """Poll the ports until a board is there, and return its port (or None if we were stopped)."""
+        while not self._stop_event.is_set():
+            ports = self._get_ports()
+            if ports:
+                return ports[0]
+            self._stop_event.wait(PORT_POLL_SECONDS)
+        return None
+
+    def _connect(self, port, just_plugged_in):
+        """Try to connect to the board on port for at most RECONNECT_TIMEOUT_SECONDS. Return whether we did."""
+        start = time.perf_counter()
+        self._failed.clear()
+        # A board that was just plugged in sends SIG_READY when it is done booting, so there is no need to reset it.
+        # Otherwise it is already booted (or it isn't running our sketch, in which case only a reset will help).
+        attempts = [(False, just_plugged_in), (True, True)]
+        while time.perf_counter() - start < RECONNECT_TIMEOUT_SECONDS and not self._stop_event.is_set():
+            resetting, expect_boot = attempts[0]
+            con = None
+            try:
+                con = capture.make_con(resetting=resetting, timeout=BOOT_SECONDS, port=port)
+                con.open()
+                if resetting or expect_boot:
+                    capture.wait_for_sig_ready(con)
+                    kind = CONNECTION_RESET if resetting else CONNECTION_BOOTED
+                else:
+                    self._settle(con)
+                    kind = CONNECTION_WARM
+            except SerialException as e:
+                # debug
+                print('$ Could not connect to {} ({}): {}'.format(port, 'reset' if resetting else 'warm', e))
+                if con is not None:
+                    con.close()
+                # Try the next way of connecting, or the last one again (the port may still be coming up).
+                if len(attempts) > 1:
+                    attempts.pop(0)
+                else:
+                    self._stop_event.wait(PORT_POLL_SECONDS)
+                if port not in self._get_ports():
+                    return False
+                continue
+
+            con.timeout = READY_TIMEOUT_SECONDS
+            connect_seconds = time.perf_counter() - start
+            self.con = con
+            self.port = port
+            self.connect_count += 1
+            self.connect_history.append((kind, connect_seconds))
+            if self._lost_time is not None:
+                self.last_downtime_seconds = time.perf_counter() - self._lost_time
+                self._lost_time = None
+            self.ready.set()
+            # debug
+            print('$ Connected to {} ({}) in {:.2f} s.'.format(port, kind, connect_seconds))
+            if self.on_ready is not None:
+                self.on_ready(con)
+            return True
+        return False
+
+    def _settle(self, con):
+        """Make sure that a board that we connected to warm is idle, or raise a SerialException."""
+        con.timeout = WARM_LISTEN_SECONDS
+        heard = con.read(max(1, con.in_waiting))
+        if not heard or heard.endswith(SIG_READY):
+            # Idle, or it just booted.
+            return
+        # The board is still in a capture. Tell it that we have had enough, and wait for it to finish.
+        con.write(SIG_ENOUGH)
+        con.flush()
+        con.timeout = QUIET_SECONDS
+        deadline = time.perf_counter() + DRAIN_SECONDS
+        while time.perf_counter() < deadline:
+            if not con.read(max(1, con.in_waiting)):
+                return
+        raise SerialException('The board never went quiet.')
+
+    def _watch(self):
+        """Wait while the connection is ready, until the port disappears or the connection fails, then close it.
+
+        Return whether the port disappeared (the board was unplugged).
+        """
+        unplugged = False
+        while not self._failed.wait(PORT_POLL_SECONDS):
+            if self.port not in self._get_ports():
+                unplugged = True
+                break
+        self._lost_time = time.perf_counter()
+        self.ready.clear()
+        con, self.con = self.con, None
+        try:
+            con.close()
+        except SerialException:
+            pass
+        if self._stop_event.is_set():
+            return unplugged
+        self.lost_count += 1
+        # debug
+        print('$ Lost the connection to', self.port)
+        if self.on_lost is not None:
+            self.on_lost()
+        return unplugged
@@ -0,0 +1,150 @@
+"""Spectral features of the sensor data.
+
+We compute a short-time Fourier transform (STFT) of every channel of a sensor at once.
+The signal is cut into overlapping segments, each segment is windowed, and the power spectrum of each segment is taken.
+Rather than looping over the segments (or over the peaks, like the transmitter does in demo mode),
+we build a strided view of all the segments and transform a whole batch of them with a single call to numpy.
+
+From the spectrogram we derive the power in a few frequency bands and the swallow frequency.
+The swallow frequency is what the 'frequency' LED strip of the transmitter approximates (see trans/metric.h),
+but instead of averaging the distance between peaks we take the dominant frequency of the gyro magnitude.
+
+This module only does the math. Reading captures and caching the results on disk is done in process.py.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# Number of samples in each STFT segment, and how many of them are shared with the next segment.
+# At the FAST capture rate (833 Hz) a segment is roughly 300 ms long, which is about the length of a single swallow.
+SEGMENT_LENGTH = 256
+SEGMENT_OVERLAP = 192
+
+# How many segments we transform at once. Larger batches are faster but use more memory.
+SEGMENT_BATCH_SIZE = 512
+
+# Frequency bands (in Hz) that we compute the power of. The last band is open ended (it goes up to the nyquist frequency).
+BANDS = ((0.5, 4.0), (4.0, 8.0), (8.0, 16.0), (16.0, 32.0), (32.0, None))
+
+# Peaks that are further apart than PEAK_DISTANCE_MAX (trans/metric.h) are not considered part of the same swallow,
+# so the slowest swallow frequency we are interested in is 1000 / 150 ms. We look for the dominant frequency
+# between this and SWALLOW_FREQUENCY_MAX.
+PEAK_DISTANCE_MAX_MS = 150
+SWALLOW_FREQUENCY_MIN = 1000 / PEAK_DISTANCE_MAX_MS
+SWALLOW_FREQUENCY_MAX = 40.0
+
+
+def estimate_sample_rate(times):
+    """Return the sample rate (in Hz) of a sensor given its (overflow corrected) millisecond timestamps.
+
+    The timestamps only have millisecond resolution, so we measure the rate over the whole capture
+    instead of looking at the distance between neighbouring samples.
+    """
+    if len(times) < 2 or times[-1] == times[0]:
+        return None
+    return (len(times) - 1) * 1000 / (times[-1] - times[0])
+
+
+def stft(data, *, segment_length=SEGMENT_LENGTH, segment_overlap=SEGMENT_OVERLAP, batch_size=SEGMENT_BATCH_SIZE):
+    """Return the power spectrum of every segment of every channel.
+
+    data should have the shape (samples, channels).
+    The result has the shape (segments, frequencies, channels), and the start sample of every segment is also returned.
+    """
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    sample_count, channel_count = data.shape
+    step = segment_length - segment_overlap
+    if sample_count < segment_length:
+        return np.zeros((0, segment_length // 2 + 1, channel_count)), np.zeros(0, dtype=np.int64)
+    segment_count = 1 + (sample_count - segment_length) // step
+
+    # A view of the data where segments[i] is the i'th segment. No data is copied here.
+    row_stride, column_stride = data.strides
+    segments = as_strided(data, shape=(segment_count, segment_length, channel_count),
+                          strides=(row_stride * step, row_stride, column_stride), writeable=False)
+
+    # A Hann window reduces the leakage between frequencies. We scale the power so that it does not depend on the window.
+    window = np.hanning(segment_length)[:, np.newaxis]
+    scale = 1 / np.sum(window ** 2)
+
+    power = np.empty((segment_count, segment_length // 2 + 1, channel_count))
+    for start in range(0, segment_count, batch_size):
+        batch = segments[start:start + batch_size]
+        # Remove the mean of every segment so that a constant offset (like gravity on the accl) does not swamp the low bins.
+        batch = (batch - batch.mean(axis=1, keepdims=True)) * window
+        power[start:start + batch_size] = np.abs(np.fft.rfft(batch, axis=1)) ** 2 * scale
+
+    return power, np.arange(segment_count) * step
+
+
+def band_power(power, frequencies, bands=BANDS):
+    """Sum the power spectrum over each frequency band.
+
+    The result has the shape (segments, bands, channels).
+    """
+    result = np.empty((power.shape[0], len(bands), power.shape[2]))
+    for i, (low, high) in enumerate(bands):
+        in_band = frequencies >= low
+        if high is not None:
+            in_band &= frequencies < high
+        result[:, i, :] = power[:, in_band, :].sum(axis=1)
+    return result
+
+
+def swallow_frequency(power, frequencies):
+    """Return the dominant frequency of every segment within the swallow band.
+
+    power should have the shape (segments, frequencies) (a single channel, usually the gyro magnitude).
+    Segments with no power at all in the band get a frequency of nan.
+    """
+    in_band = (frequencies >= SWALLOW_FREQUENCY_MIN) & (frequencies <= SWALLOW_FREQUENCY_MAX)
+    band_frequencies = frequencies[in_band]
+    band = power[:, in_band]
+    result = band_frequencies[np.argmax(band, axis=1)] if band.shape[1] else np.full(power.shape[0], np.nan)
+    result = np.asarray(result, dtype=np.float64)
+    result[band.sum(axis=1) == 0] = np.nan
+    return result
+
+
+def average_swallow_frequency(power, frequencies):
+    """Return a single swallow frequency for a whole capture.
+
+    Each segment votes with its dominant frequency, weighted by how much power it has in the swallow band,
+    so quiet segments (no swallowing) barely count.
+    """
+    in_band = (frequencies >= SWALLOW_FREQUENCY_MIN) & (frequencies <= SWALLOW_FREQUENCY_MAX)
+    weights = power[:, in_band].sum(axis=1)
+    dominant = swallow_frequency(power, frequencies)
+    valid = ~np.isnan(dominant)
+    if not np.any(weights[valid]):
+        return float('nan')
+    return float(np.average(dominant[valid], weights=weights[valid]))
+
+
+def compute_spectrum(times, data, *, segment_length=SEGMENT_LENGTH, segment_overlap=SEGMENT_OVERLAP):
+    """Compute every spectral feature for a single sensor.
+
+    times are the overflow corrected timestamps (ms), and data has the shape (samples, channels)
+    where the last channel is expected to be the gyro magnitude.
+    Returns a dictionary of arrays that can be saved directly with numpy.savez.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    sample_rate = estimate_sample_rate(times)
+    power, starts = stft(data, segment_length=segment_length, segment_overlap=segment_overlap)
+    frequencies = np.fft.rfftfreq(segment_length, 1 / sample_rate) if sample_rate else np.zeros(power.shape[1])
+
+    # The time of a segment is the time at its center sample.
+    segment_times = times[starts + segment_length // 2] if len(starts) else np.zeros(0)
+
+    return {
+        'sample_rate': np.float64(sample_rate or 0),
+        'times': segment_times,
+        'frequencies': frequencies,
+        'power': power,
+        'band_power': band_power(power, frequencies),
+        'bands': np.array([(low, np.inf if high is None else high) for low, high in BANDS]),
+        'swallow_frequency': swallow_frequency(power[:, :, -1], frequencies),
+        'average_swallow_frequency': np.float64(average_swallow_frequency(power[:, :, -1], frequencies)),
+    }
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Try many combinations of the thresholds in trans/metric.h against every processed capture, to see which work best.
+
+The thresholds were picked by hand. Here the button presses of the processed captures are the ground truth:
+a peak (see trans.ino) that is within MATCH_WINDOW_MS of a press is a true peak, and a press with a peak
+within MATCH_WINDOW_MS of it was found. Over all the captures, this gives the precision and recall of the peaks
+(and their F1 score) for every combination of MAGNITUDE_THRESHOLD, PEAK_MAGNITUDE_THRESHOLD,
+PEAK_MAGNITUDE_CHANGE_THRESHOLD and PEAK_DISTANCE_MAX. A blindspot is supposed to be a stretch without swallowing,
+so for every combination of MAGNITUDE_THRESHOLD and BLINDSPOT_DURATION_MIN we count how many presses fell in one.
+
+We find the peaks and blindspots the way the transmitter does, but for every combination at once:
+each capture is loaded once, the samples that could be a peak under the loosest thresholds are picked out,
+and the grid of thresholds is evaluated against them with array operations rather than running the detection again
+for each combination. The captures are evaluated in a pool of processes, and their counts are added up.
+
+The results are saved to SWEEP_FILENAME, best first, and the best few are printed along with the current thresholds.
+"""
+
+__author__ = 'Joseph Rubin'
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from util import *
+import catalog
+
+# The thresholds that are in trans/metric.h now.
+MAGNITUDE_THRESHOLD = 3
+PEAK_MAGNITUDE_THRESHOLD = 25
+PEAK_MAGNITUDE_CHANGE_THRESHOLD = 4
+PEAK_DISTANCE_MAX = 150
+BLINDSPOT_DURATION_MIN = 70
+
+# The values that we try for each threshold. Every combination is tried.
+GRID = {
+    'magnitude_threshold': (1, 2, 3, 4, 6, 8),
+    'peak_magnitude_threshold': (10, 15, 20, 25, 30, 40, 50, 65, 80),
+    'peak_magnitude_change_threshold': (1, 2, 3, 4, 6, 8, 12),
+    'peak_distance_max': (50, 100, 150, 200, 300, 500),
+    'blindspot_duration_min': (30, 50, 70, 100, 150, 250),
+}
+
+# A peak and a button press that are this close (in ms) go together.
+MATCH_WINDOW_MS = 500
+
+# How many combinations of thresholds are evaluated at once. This bounds how much memory a process uses.
+ROW_CHUNK = 64
+
+SENSOR_NAMES = ('tongue', 'throat')
+
+SWEEP_FILENAME = 'sweep.csv'
+
+# How many of the best combinations are printed.
+PRINT_COUNT = 10
+
+
+def load_capture(capture_number: int):
+    """Return the gyro magnitude of each sensor of a capture as {sensor_name: (times, gyro_m)},
+    and the times of its button presses, processing it first if it was never processed."""
+    # We don't import process at the top, since the workers of main only need it for captures that weren't processed.
+    import process
+
+    if not process.capture_was_processed(capture_number):
+        # This reads the archive of the capture if only that was kept (see process._read_sensor_chunks).
+        process.process_capture(capture_number)
+    path = process.OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    sensors = {}
+    for sensor_name in SENSOR_NAMES:
+        data = pd.read_csv(path + sensor_name + '.csv', delimiter=',', usecols=['time', 'gyro_m'])
+        sensors[sensor_name] = (data.time.values.astype(np.int64), data.gyro_m.values.astype(np.float64))
+    press_times = np.sort(pd.read_csv(path + 'button.csv', delimiter=',').time.values.astype(np.int64))
+    return sensors, press_times
+
+
+def evaluate_capture(capture_number: int, grid=GRID):
+    """Evaluate every combination of thresholds in grid against a capture, and return its counts (see add_up)."""
+    sensors, press_times = load_capture(capture_number)
+    magnitude_thresholds = np.asarray(grid['magnitude_threshold'], dtype=np.float64)
+    peak_thresholds = np.asarray(grid['peak_magnitude_threshold'], dtype=np.float64)
+    change_thresholds = np.asarray(grid['peak_magnitude_change_threshold'], dtype=np.float64)
+    distance_maxes = np.asarray(grid['peak_distance_max'], dtype=np.int64)
+    duration_mins = np.asarray(grid['blindspot_duration_min'], dtype=np.int64)
+
+    # A peak must be above both MAGNITUDE_THRESHOLD and PEAK_MAGNITUDE_THRESHOLD, so only the larger one matters.
+    # Many combinations of the two have the same larger one, so we only evaluate each of those once.
+    peak_levels, level_inverse = np.unique(np.maximum.outer(magnitude_thresholds, peak_thresholds), return_inverse=True)
+    level_inverse = level_inverse.reshape(len(magnitude_thresholds), len(peak_thresholds))
+    # Rows: every (peak level, change threshold).
+    row_levels = np.repeat(peak_levels, len(change_thresholds))
+    row_changes = np.tile(change_thresholds, len(peak_levels))
+
+    shape = (len(distance_maxes), len(row_levels))
+    peak_counts = np.zeros(shape, dtype=np.int64)
+    true_peak_counts = np.zeros(shape, dtype=np.int64)
+    # Whether each press was found, by either sensor.
+    found_presses = np.zeros(shape + (len(press_times),), dtype=bool)
+
+    blindspot_shape = (len(magnitude_thresholds), len(duration_mins))
+    blindspot_counts = np.zeros(blindspot_shape, dtype=np.int64)
+    blindspot_widths = np.zeros(blindspot_shape, dtype=np.int64)
+    presses_in_blindspots = np.zeros(blindspot_shape, dtype=np.int64)
+
+    for times, magnitudes in sensors.values():
+        if not len(times):
+            continue
+        _evaluate_peaks(times, magnitudes, press_times, row_levels, row_changes, distance_maxes,
+                        peak_counts, true_peak_counts, found_presses)
+        for i, magnitude_threshold in enumerate(magnitude_thresholds):
+            _evaluate_blindspots(times, magnitudes, press_times, magnitude_threshold, duration_mins,
+                                 blindspot_counts[i], blindspot_widths[i], presses_in_blindspots[i])
+
+    # Back from rows to the full grid: (magnitude, peak, change, distance).
+    def to_grid(counts):
+        counts = counts.reshape(len(distance_maxes), len(peak_levels), len(change_thresholds))
+        return counts[:, level_inverse, :].transpose(1, 2, 3, 0)
+
+    return {
+        'press_count': len(press_times),
+        'peak_count': to_grid(peak_counts),
+        'true_peak_count': to_grid(true_peak_counts),
+        'found_press_count': to_grid(found_presses.sum(axis=2)),
+        'blindspot_count': blindspot_counts,
+        'blindspot_width_total': blindspot_widths,
+        'presses_in_blindspots': presses_in_blindspots,
+    }
+
+
+def _evaluate_peaks(times, magnitudes, press_times, row_levels, row_changes, distance_maxes,
+                    peak_counts, true_peak_counts, found_presses):
+    """Find the peaks of a sensor for every row (level, change) and distance, and add to the counts."""
+    # How much the magnitude dropped since the previous sample. The transmitter starts from a magnitude of 0.
+    drops = np.concatenate(([-magnitudes[0]], magnitudes[:-1] - magnitudes[1:]))
+    candidates = np.flatnonzero((magnitudes > row_levels.min()) & (drops > row_changes.min()))
+    if not len(candidates):
+        return
+    candidate_times = times[candidates]
+    candidate_magnitudes = magnitudes[candidates]
+    candidate_drops = drops[candidates]
+    near_press = _near(candidate_times, press_times)
+    # The candidates within the window of each press are [first, last).
+    firsts = np.searchsorted(candidate_times, press_times - MATCH_WINDOW_MS, side='left')
+    lasts = np.searchsorted(candidate_times, press_times + MATCH_WINDOW_MS, side='right')
+    positions = np.arange(len(candidates))
+
+    for start in range(0, len(row_levels), ROW_CHUNK):
+        rows = slice(start, start + ROW_CHUNK)
+        is_peak = (candidate_magnitudes > row_levels[rows, None]) & (candidate_drops > row_changes[rows, None])
+        # The previous peak of the same row, or -1 if there is none.
+        previous = np.maximum.accumulate(np.where(is_peak, positions, -1), axis=1)
+        previous = np.concatenate((np.full((previous.shape[0], 1), -1), previous[:, :-1]), axis=1)
+        # Like the transmitter (see trans.ino), before the first peak the previous peak is taken to be the start of the capture.
+        since_previous = candidate_times - np.where(previous >= 0, candidate_times[np.maximum(previous, 0)], times[0])
+
+        for i, distance_max in enumerate(distance_maxes):
+            # Like the transmitter, a peak only counts if it is close enough to the peak before it.
+            counted = is_peak & (since_previous < distance_max)
+            peak_counts[i, rows] += counted.sum(axis=1)
+            true_peak_counts[i, rows] += (counted & near_press).sum(axis=1)
+            if len(press_times):
+                cumulative = np.concatenate((np.zeros((counted.shape[0], 1), dtype=np.int64), np.cumsum(counted, axis=1)), axis=1)
+                found_presses[i, rows] |= (cumulative[:, lasts] - cumulative[:, firsts]) > 0
+
+
+def _evaluate_blindspots(times, magnitudes, press_times, magnitude_threshold, duration_mins,
+                         blindspot_counts, blindspot_widths, presses_in_blindspots):
+    """Find the blindspots of a sensor for a magnitude threshold and every minimum duration, and add to the counts."""
+    # Like the transmitter, a blindspot starts when the magnitude falls to the threshold (after having been above it)
+    # and ends when it goes above it again. One that hasn't ended when the capture ends doesn't count.
+    high = (magnitudes > magnitude_threshold).astype(np.int8)
+    changes = np.diff(high)
+    starts = np.flatnonzero(changes == -1) + 1
+    ends = np.flatnonzero(changes == 1) + 1
+    if not len(starts):
+        return
+    ends = ends[ends > starts[0]]
+    starts = starts[:len(ends)]
+    start_times = times[starts]
+    end_times = times[ends]
+    durations = end_times - start_times
+
+    counted = durations[None, :] >= duration_mins[:, None]
+    blindspot_counts += counted.sum(axis=1)
+    blindspot_widths += (counted * durations).sum(axis=1)
+    if len(press_times) and len(starts):
+        # The blindspot that started last before each press, and whether the press came before it ended.
+        containing = np.searchsorted(start_times, press_times, side='right') - 1
+        inside = (containing >= 0) & (press_times < end_times[np.maximum(containing, 0)])
+        presses_in_blindspots += (counted[:, np.maximum(containing, 0)] & inside).sum(axis=1)
+
+
+def _near(times, press_times):
+    """Return whether each of (sorted) times is within MATCH_WINDOW_MS of any of (sorted) press_times."""
+    if not len(press_times):
+        return np.zeros(len(times), dtype=bool)
+    following = np.searchsorted(press_times, times).clip(0, len(press_times) - 1)
+    preceding = (following - 1).clip(0)
+    return (np.abs(press_times[following] - times) <= MATCH_WINDOW_MS) | (np.abs(press_times[preceding] - times) <= MATCH_WINDOW_MS)
+
+
+def add_up(results, grid=GRID):
+    """Add up the counts of the captures, and return a table with a row for every combination of thresholds, best first."""
+    totals = {key: sum(result[key] for result in results) for key in results[0]}
+
+    # The peak counts have the shape (magnitude, peak, change, distance) and the blindspot counts (magnitude, duration).
+    # Broadcast both to the full grid.
+    names = tuple(GRID)
+    axes = np.meshgrid(*(np.asarray(grid[name]) for name in names), indexing='ij')
+    table = pd.DataFrame({name: axis.ravel() for name, axis in zip(names, axes)})
+    full_shape = axes[0].shape
+
+    def peak_column(counts):
+        return np.broadcast_to(counts[..., None], full_shape).ravel()
+
+    def blindspot_column(counts):
+        return np.broadcast_to(counts[:, None, None, None, :], full_shape).ravel()
+
+    peak_count = peak_column(totals['peak_count'])
+    true_peak_count = peak_column(totals['true_peak_count'])
+    found_press_count = peak_column(totals['found_press_count'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(peak_count > 0, true_peak_count / peak_count, 0)
+        recall = found_press_count / totals['press_count'] if totals['press_count'] else np.zeros(len(table))
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0)
+    table['peak_count'] = peak_count
+    table['precision'] = precision
+    table['recall'] = recall
+    table['f1'] = f1
+    table['blindspot_count'] = blindspot_column(totals['blindspot_count'])
+    table['presses_in_blindspots'] = blindspot_column(totals['presses_in_blindspots'])
+    # Among equally good peaks, fewer presses in blindspots is better.
+    return table.sort_values(['f1', 'presses_in_blindspots'], ascending=[False, True]).reset_index(drop=True)
+
+
+def main():
+    capture_numbers = [row['number'] for row in catalog.list_captures() if row['processed']]
+    if not capture_numbers:
+        print('$ There are no processed captures.')
+        return
+    grid_size = int(np.prod([len(values) for values in GRID.values()]))
+    print('$ Trying {} combinations of thresholds on {} captures.'.format(grid_size, len(capture_numbers)))
+
+    results = []
+    # Each capture is evaluated in a process of its own, since the work is mostly array operations on its own data.
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(evaluate_capture, capture_number) for capture_number in capture_numbers]
+        for capture_number, future in zip(capture_numbers, futures):
+            try:
+                results.append(future.result())
+            except (OSError, ValueError, KeyError) as e:
+                # A capture with missing or broken files shouldn't stop the others.
+                print('$ Could not evaluate capture', capture_number, '-', e)
+    if not results:
+        return
+
+    table = add_up(results)
+    table.to_csv(SWEEP_FILENAME, index=False)
+
+    pd.set_option('display.width', 200)
+    print(table.head(PRINT_COUNT).to_string())
+    current = table[(table.magnitude_threshold == MAGNITUDE_THRESHOLD)
+                    & (table.peak_magnitude_threshold == PEAK_MAGNITUDE_THRESHOLD)
+                    & (table.peak_magnitude_change_threshold == PEAK_MAGNITUDE_CHANGE_THRESHOLD)
+                    & (table.peak_distance_max == PEAK_DISTANCE_MAX)
+                    & (table.blindspot_duration_min == BLINDSPOT_DURATION_MIN)]
+    if len(current):
+        print('$ The current thresholds are number {} of {}:'.format(current.index[0] + 1, len(table)))
+        print(current.to_string(header=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Regression tests for archive.py. Run with pytest from this directory."""
+
+__author__ = 'Joseph Rubin'
+
+import shutil
+
+import numpy as np
+import pytest
+
+from util import *
+from config import Config
+import archive
+import catalog
+import process
+
+HEADERS = 'time,gyroX,gyroY,gyroZ,acclX,acclY,acclZ,button\n'
+
+
+@pytest.fixture
+def capture_number(tmp_path, monkeypatch):
+    """A capture of 3000 frames per sensor whose timer overflows, with a few button presses, and its csv files."""
+    raw_root = str(tmp_path) + '/raw/'
+    os.makedirs(raw_root)
+    monkeypatch.setattr(catalog, 'RAW_DIRECTORY_ROOT', raw_root)
+    monkeypatch.setattr(catalog, 'CATALOG_FILENAME', raw_root + 'catalog.sqlite3')
+    monkeypatch.setattr(catalog, 'ARCHIVE_DIRECTORY_ROOT', str(tmp_path) + '/archive/')
+    monkeypatch.setattr(process, 'INPUT_DIRECTORY_ROOT', raw_root)
+    monkeypatch.setattr(process, 'OUTPUT_DIRECTORY_ROOT', str(tmp_path) + '/processed/')
+
+    number = catalog.allocate_capture_number()
+    catalog.finish_capture(number, config=Config(capture_rate=100, gyro_scale=500, accl_scale=4), frame_count=6000,
+                           tongue_frame_count=3000, throat_frame_count=3000, bad_checksum_count=0, duration_seconds=30)
+    input_path = raw_root + get_capture_subdirectory(number)
+    os.makedirs(input_path)
+    random = np.random.RandomState(0)
+    times = (TIME_OVERFLOW - 10000 + np.arange(3000) * 10) % TIME_OVERFLOW
+    buttons = ((np.arange(3000) // 100) % 7 == 3).astype(int)
+    for sensor_name in archive.SENSOR_NAMES:
+        readings = np.round(random.normal(0, 50, (3000, 6)), 3)
+        with open(input_path + sensor_name + '.csv', 'w', newline='') as csv_file:
+            csv_file.write(HEADERS)
+            for time, reading, button in zip(times, readings.tolist(), buttons):
+                csv_file.write(format_csv([time] + reading + [button]) + '\n')
+    return number
+
+
+def read_processed(capture_number):
+    import pandas as pd
+
+    output_path = process.OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    return {filename: pd.read_csv(output_path + filename, delimiter=',').values
+            for filename in ('tongue.csv', 'throat.csv', 'button.csv',
+                             process.FILTERED_FILENAME.format('tongue'), process.ORIENTATION_FILENAME.format('throat'))}
+
+
+def test_archive_only_capture_is_processed(capture_number):
+    process.process_capture(capture_number)
+    from_csv = read_processed(capture_number)
+    spectrum = process.load_spectrum(capture_number, 'tongue')
+
+    archive.archive_capture(capture_number)
+    assert archive.drop_csv_files(capture_number) > 0
+    assert not archive.has_csv_files(capture_number)
+    shutil.rmtree(process.OUTPUT_DIRECTORY_ROOT)
+
+    process.process_capture(capture_number)
+    from_archive = read_processed(capture_number)
+    for filename, expected in from_csv.items():
+        # The archive keeps the readings as 32 bit floats.
+        assert np.allclose(from_archive[filename], expected, rtol=1e-5, atol=1e-4), filename
+    assert len(from_csv['button.csv']) == 4
+    assert np.allclose(process.load_spectrum(capture_number, 'tongue')['power'], spectrum['power'], rtol=1e-3, atol=1e-6)
+
+
+def test_csv_files_are_kept_if_the_archive_does_not_match(capture_number):
+    archive.archive_capture(capture_number)
+    input_filename = catalog.RAW_DIRECTORY_ROOT + get_capture_subdirectory(capture_number) + 'throat.csv'
+    with open(input_filename, 'a', newline='') as csv_file:
+        csv_file.write('0,1,2,3,4,5,6,0\n')
+
+    assert not archive.verify_archive(capture_number)
+    with pytest.raises(ValueError):
+        archive.drop_csv_files(capture_number)
+    assert archive.has_csv_files(capture_number)
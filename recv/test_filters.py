@@ -0,0 +1,79 @@
+"""Regression tests for filters.py. Run with pytest from this directory."""
+
+__author__ = 'Joseph Rubin'
+
+import numpy as np
+
+from const import *
+from util import *
+from config import Config
+from frame import FrameBlock
+from pipeline import FrameList
+import capture
+import catalog
+import filters
+import process
+
+HEADERS = 'time,gyroX,gyroY,gyroZ,acclX,acclY,acclZ,button\n'
+
+
+def make_capture_blocks(frame_count, batch_size):
+    """Return the frames of a made up capture at 500 Hz, whose timer overflows, as FrameBlocks of batch_size frames."""
+    random = np.random.RandomState(0)
+    blocks = []
+    for start in range(0, frame_count, batch_size):
+        block = FrameBlock()
+        for index in range(start, min(start + batch_size, frame_count)):
+            # Both sensors take a reading every 2 ms, starting close to the overflow.
+            time = (TIME_OVERFLOW - 500 + (index // 2) * 2) % TIME_OVERFLOW
+            sensor = TONGUE_SENSOR_ID if index % 2 == 0 else THROAT_SENSOR_ID
+            reading = 2000 * np.sin(index / 50 + np.arange(6)) + random.randint(-300, 300, 6)
+            block.append(time, *reading.astype(int).tolist(), False, sensor, False)
+        blocks.append(block)
+    return blocks
+
+
+def test_live_and_offline_filters_agree(tmp_path, monkeypatch):
+    raw_root = str(tmp_path) + '/raw/'
+    os.makedirs(raw_root)
+    monkeypatch.setattr(catalog, 'RAW_DIRECTORY_ROOT', raw_root)
+    monkeypatch.setattr(catalog, 'CATALOG_FILENAME', raw_root + 'catalog.sqlite3')
+    monkeypatch.setattr(process, 'INPUT_DIRECTORY_ROOT', raw_root)
+    monkeypatch.setattr(process, 'OUTPUT_DIRECTORY_ROOT', str(tmp_path) + '/processed/')
+
+    config = Config(capture_rate=500, gyro_scale=500, accl_scale=4)
+    blocks = make_capture_blocks(4000, 64)
+
+    # Live, as a capture hands out its batches. Some are FrameLists (from capture_frames), the rest FrameBlocks.
+    live = {'tongue': [], 'throat': []}
+    consumer = filters.make_filter_consumer(lambda sensor_name, output: live[sensor_name].append(output))
+    consumer.start_handler(config)
+    for index, block in enumerate(blocks):
+        consumer.handler(FrameList(block) if index % 2 else block, config)
+
+    # Offline, from the csv files that the capture wrote. The measured rates are a little off from the declared one.
+    capture_number = catalog.allocate_capture_number()
+    catalog.finish_capture(capture_number, config=config, frame_count=4000, tongue_frame_count=2000,
+                           throat_frame_count=2000, bad_checksum_count=0, duration_seconds=4,
+                           tongue_rate=497.5, throat_rate=502.5)
+    input_path = raw_root + get_capture_subdirectory(capture_number)
+    os.makedirs(input_path)
+    csv_files = {sensor: open(input_path + sensor_name + '.csv', 'w', newline='')
+                 for sensor, sensor_name in ((TONGUE_SENSOR_ID, 'tongue'), (THROAT_SENSOR_ID, 'throat'))}
+    for csv_file in csv_files.values():
+        csv_file.write(HEADERS)
+    for block in blocks:
+        for frame in block:
+            csv_files[frame.flag.sensor].write(capture.format_frame(frame, config)[0])
+    for csv_file in csv_files.values():
+        csv_file.close()
+    process.process_filtered(capture_number)
+
+    output_path = process.OUTPUT_DIRECTORY_ROOT + get_capture_subdirectory(capture_number)
+    for sensor_name in ('tongue', 'throat'):
+        offline = np.loadtxt(output_path + process.FILTERED_FILENAME.format(sensor_name), delimiter=',', skiprows=1)
+        live_output = np.concatenate(live[sensor_name])
+        assert offline.shape == live_output.shape == (2000, len(filters.FILTER_HEADERS))
+        assert (offline[:, 0] == live_output[:, 0]).all()
+        # The offline output was saved with 6 significant digits.
+        assert np.allclose(offline, live_output, rtol=1e-5, atol=1e-6 * np.abs(live_output).max())
@@ -0,0 +1,44 @@
+"""Regression tests for query.load_range. Run with pytest from this directory."""
+
+__author__ = 'Joseph Rubin'
+
+import numpy as np
+
+from util import *
+import catalog
+import query
+
+HEADERS = 'time,gyroX,gyroY,gyroZ,acclX,acclY,acclZ,button\n'
+
+
+def write_capture(root, capture_number, times, marker=False):
+    path = str(root) + '/' + get_capture_subdirectory(capture_number)
+    os.makedirs(path)
+    with open(path + 'tongue.csv', 'w', newline='') as csv_file:
+        csv_file.write(HEADERS + ''.join('{},1,2,3,4,5,6,0\n'.format(time) for time in times))
+    if marker:
+        open(path + query.UNWRAPPED_MARKER_FILENAME, 'w').close()
+
+
+def test_wrapped_times_are_unwrapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'RAW_DIRECTORY_ROOT', str(tmp_path) + '/')
+    # 0, 1000, ..., 99000 ms, as the transmitter sends them.
+    times = np.arange(0, 100000, 1000)
+    write_capture(tmp_path, 0, times % query.TIME_OVERFLOW)
+
+    assert (query.load_range(0, 'tongue')['time'] == times).all()
+    assert query.load_range(0, 'tongue', 70000, 72000)['time'].tolist() == [70000, 71000, 72000]
+
+
+def test_trigger_times_are_not_unwrapped_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'RAW_DIRECTORY_ROOT', str(tmp_path) + '/')
+    # A trigger capture (see trigger.py): two windows with a gap between them, with the times already unwrapped.
+    times = np.concatenate((np.arange(1000, 3000, 100), np.arange(70000, 72000, 100)))
+    write_capture(tmp_path, 0, times, marker=True)
+    # From before the marker was written.
+    write_capture(tmp_path, 1, times)
+
+    for capture_number in (0, 1):
+        assert (query.load_range(capture_number, 'tongue')['time'] == times).all()
+        assert query.load_range(capture_number, 'tongue', 70100, 70200)['time'].tolist() == [70100, 70200]
+        assert query.load_range(capture_number, 'tongue', 2900, 70000)['time'].tolist() == [2900, 70000]
@@ -0,0 +1,106 @@
+"""Keep only the frames around button presses, for long monitoring sessions.
+
+The button (the limit switch) marks the moments that the operator found interesting, but what led up to a press
+happened before it was pressed. So rather than record everything, a PreTrigger holds on to the most recent
+pre_seconds of frames. When the button is pressed, those frames are let through along with every frame
+until post_seconds after the press (a press within that time extends the window).
+Everything else is thrown away, so a session of hours with a few presses takes only a few windows of disk space.
+
+    trigger = PreTrigger(pre_seconds=10, post_seconds=5)
+    capture.do_writing_capture(con, trigger=trigger)
+
+The recent frames are kept as FrameBlocks (see frame.py), a block per batch, rather than as a Frame object per frame,
+since at a fast capture rate pre_seconds may be tens of thousands of frames. The oldest blocks are dropped
+once all of their frames are older than pre_seconds, and Frames are only made for those that are let through.
+
+Since there are gaps between the windows, the 16 bit timestamps of the frames that we keep can't be unwrapped later
+(a gap may hide an overflow), so we unwrap them here, while we still see every frame.
+The capture is marked as holding unwrapped times (see query.UNWRAPPED_MARKER_FILENAME), so they aren't unwrapped again.
+"""
+
+__author__ = 'Joseph Rubin'
+
+from array import array
+from collections import deque
+
+from frame import FrameBlock
+from util import TimeUnwrapper
+
+
+class PreTrigger(object):
+    """Lets through only the frames from pre_seconds before a button press until post_seconds after it."""
+
+    def __init__(self, pre_seconds, post_seconds):
+        self.pre_ms = pre_seconds * 1000
+        self.post_ms = post_seconds * 1000
+        # The frames that we may still have to let through, oldest first:
+        # (block, unwrapped times of its frames, the latest of those times).
+        self.history = deque()
+        # The time until which we are letting every frame through, or None if no button was pressed yet.
+        self.window_end = None
+
+        self.unwrapper = TimeUnwrapper()
+
+        # Statistics.
+        self.frame_count = 0
+        self.kept_frame_count = 0
+        self.window_count = 0
+
+    def start(self, _config):
+        """Get ready for a capture. This must be called before any frames are filtered."""
+        self.history.clear()
+        self.window_end = None
+
+    def filter(self, frames):
+        """Return the frames (from a FrameBlock, or a sequence of frames, in the order they were received) that should be kept.
+
+        The frames we return are copies whose timestamps are unwrapped, the given frames are not modified.
+        """
+        if not isinstance(frames, FrameBlock):
+            block = FrameBlock()
+            for frame in frames:
+                block.append_frame(frame)
+            frames = block
+        self.frame_count += len(frames)
+
+        # The two sensors take turns, so their timestamps can step back by a little (see util.TimeUnwrapper).
+        times = array('q', (self.unwrapper.unwrap(time) for time in frames.time))
+        kept = []
+        # The frames of this block that were not let through (yet).
+        waiting = []
+        for index, (time, button) in enumerate(zip(times, frames.button)):
+            if button:
+                if self.window_end is None or time > self.window_end:
+                    self.window_count += 1
+                self.window_end = time + self.post_ms
+                # Let through what happened before the press.
+                start_time = time - self.pre_ms
+                for history_block, history_times, _latest_time in self.history:
+                    kept.extend(_make_frame(history_block, history_times, i)
+                                for i in range(len(history_times)) if history_times[i] >= start_time)
+                kept.extend(_make_frame(frames, times, i) for i in waiting if times[i] >= start_time)
+                self.history.clear()
+                waiting = []
+
+            if self.window_end is not None and time <= self.window_end:
+                kept.append(_make_frame(frames, times, index))
+            else:
+                waiting.append(index)
+
+        if waiting:
+            waiting_times = array('q', (times[i] for i in waiting))
+            self.history.append((frames.take(waiting), waiting_times, max(waiting_times)))
+            # Drop the blocks whose frames are all too old to be let through by any later press.
+            start_time = max(times) - self.pre_ms
+            while self.history and self.history[0][2] < start_time:
+                self.history.popleft()
+
+        self.kept_frame_count += len(kept)
+        return kept
+
+
+def _make_frame(block, times, index):
+    """Return the frame at index of block, with its unwrapped time from times."""
+    frame = block[index]
+    frame.time = times[index]
+    return frame
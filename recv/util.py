@@ -2,9 +2,12 @@
 
 __author__ = 'Joseph Rubin'
 
-from serial.tools.list_ports import comports
+from collections import OrderedDict
 from math import sqrt
 import os
+import threading
+
+from const import TIME_OVERFLOW
 
 # The highest value we can store in a 16 bit value.
 SIXTEEN_BIT_MAX_VALUE = 32767
@@ -15,8 +18,23 @@ def get_arduino_port():
     return get_port_of('Arduino Uno')
 
 
+def get_arduino_ports():
+    """Return every serial port connected to an Arduino Uno."""
+    return get_ports_of('Arduino Uno')
+
+
+def get_ports_of(device_name: str):
+    """Return every serial port that is connected to a device, given its name."""
+    # See get_port_of for why this is imported here.
+    from serial.tools.list_ports import comports
+    return [port.device for port in comports() if device_name in port.description]
+
+
 def get_port_of(device_name: str):
     """Return the first serial port that is connected to a device, given its name."""
+    # Enumerating the ports is slow, and most scripts that use util never do it,
+    # so we only import it when we need it.
+    from serial.tools.list_ports import comports
     for port in comports():
         if device_name in port.description:
             return port.device
@@ -55,3 +73,70 @@ def calculate_gs(accl_reading, max_gs):
 def magnitude(a, b, c):
     """Returns the 3d vector magnitude."""
     return sqrt((a * a) + (b * b) + (c * c))
+
+
+class TimeUnwrapper(object):
+    """Corrects for overflow in the 16 bit timestamps of the transmitter, carrying on from one call to the next.
+
+    Only a big step back (more than half of TIME_OVERFLOW) means that the timer overflowed. The two sensors take turns,
+    so when their frames are mixed, the timestamps can step back by a little. Times that were already unwrapped
+    (see trigger.py) never step back, so they pass through unchanged.
+    If start is given, we carry on from that unwrapped time, as if it was the previous timestamp.
+    """
+
+    __slots__ = ('previous_time', 'offset')
+
+    def __init__(self, start=None):
+        self.previous_time = None if start is None else int(start) % TIME_OVERFLOW
+        self.offset = 0 if start is None else int(start) - self.previous_time
+
+    def unwrap(self, time):
+        """Return a single timestamp, unwrapped."""
+        if self.previous_time is not None and time < self.previous_time - TIME_OVERFLOW // 2:
+            self.offset += TIME_OVERFLOW
+        self.previous_time = time
+        return time + self.offset
+
+    def unwrap_array(self, times):
+        """Return a sequence of timestamps as a numpy array, unwrapped."""
+        # util is imported by the GUI at startup, which doesn't need numpy until later.
+        import numpy as np
+        times = np.asarray(times, dtype=np.int64)
+        if not len(times):
+            return times
+        previous = times[0] if self.previous_time is None else self.previous_time
+        steps = np.diff(np.concatenate(([previous], times))) < -TIME_OVERFLOW // 2
+        offsets = self.offset + np.cumsum(steps) * TIME_OVERFLOW
+        self.previous_time = int(times[-1])
+        self.offset = int(offsets[-1])
+        return times + offsets
+
+
+class LRUCache(object):
+    """A dictionary that only remembers the maxsize most recently used items. It may be shared between threads."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the item for key (marking it as recently used), or default if we don't have it."""
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        """Remember an item, forgetting the least recently used item if we are full."""
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        """Forget an item if we have it."""
+        with self._lock:
+            self._items.pop(key, None)
@@ -0,0 +1,115 @@
+"""Writes text files from a background thread, in large sequential writes.
+
+Writing a line to each file for every frame means thousands of small writes per second on the thread
+that handles the frames, and if the disk is slow, everything waits for it. Instead, BufferedWriter
+keeps what we write in memory and a thread of its own writes it out whenever enough has piled up
+(FLUSH_BYTES) or enough time has passed (FLUSH_INTERVAL_SECONDS).
+
+Data that was written is not necessarily on the disk yet, since the operating system keeps its own buffers.
+Every FSYNC_INTERVAL_SECONDS we ask the operating system to put the files on the disk (os.fsync),
+so a crash or power loss never costs more than about that much data.
+"""
+
+__author__ = 'Joseph Rubin'
+
+import os
+import threading
+import time
+
+# Write to disk once this many bytes are waiting...
+FLUSH_BYTES = 1 << 20
+# ...or once the oldest waiting data is this old.
+FLUSH_INTERVAL_SECONDS = 0.5
+# Force the written data onto the disk this often. None means never (leave it to the operating system), 0 means every flush.
+FSYNC_INTERVAL_SECONDS = 2.0
+# If the disk can't keep up and this many bytes are waiting, write() waits for the disk.
+MAX_BUFFERED_BYTES = 64 << 20
+
+
+class BufferedWriter(object):
+    """Buffers text for several files and writes it from a background thread.
+
+    Files are named by keys, e.g. BufferedWriter({'tongue': 'raw/capture00001/tongue.csv'}),
+    then written with write('tongue', text). Call close() when done, which writes everything that is left.
+    """
+
+    def __init__(self, filenames, *, flush_bytes=FLUSH_BYTES, flush_interval_seconds=FLUSH_INTERVAL_SECONDS,
+                 fsync_interval_seconds=FSYNC_INTERVAL_SECONDS, max_buffered_bytes=MAX_BUFFERED_BYTES):
+        self.flush_bytes = flush_bytes
+        self.flush_interval_seconds = flush_interval_seconds
+        self.fsync_interval_seconds = fsync_interval_seconds
+        self.max_buffered_bytes = max_buffered_bytes
+
+        # With newline='' a '\n' is written as it is, even on Windows, so the size of what we write is its size on disk
+        # (capture.writing_consumer relies on that for the byte offsets of the time index).
+        self._files = {key: open(filename, 'w', newline='') for key, filename in filenames.items()}
+        # Text waiting to be written, as a list of strings per file.
+        self._buffers = {key: [] for key in filenames}
+        self._buffered_bytes = 0
+        self._closing = False
+        # If writing failed, the error is saved here and raised by the next write() or close().
+        self._error = None
+
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='writer', daemon=True)
+        self._thread.start()
+
+    def write(self, key, text):
+        """Queue text to be written to the file named by key."""
+        with self._condition:
+            if self._error is not None:
+                raise self._error
+            self._buffers[key].append(text)
+            self._buffered_bytes += len(text)
+            if self._buffered_bytes >= self.flush_bytes:
+                self._condition.notify_all()
+            # Backpressure: don't let a slow disk use up all of our memory.
+            while self._buffered_bytes >= self.max_buffered_bytes and self._error is None:
+                self._condition.wait()
+
+    def close(self):
+        """Write everything that is left, put it on the disk, and close the files."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        last_fsync = time.monotonic()
+        while True:
+            with self._condition:
+                if not self._closing and self._buffered_bytes < self.flush_bytes:
+                    self._condition.wait(self.flush_interval_seconds)
+                closing = self._closing
+                # Take the buffers, so that write() can go on filling new ones while we write these.
+                buffers = self._buffers
+                self._buffers = {key: [] for key in buffers}
+                self._buffered_bytes = 0
+                self._condition.notify_all()
+
+            try:
+                for key, chunks in buffers.items():
+                    if chunks:
+                        self._files[key].write(''.join(chunks))
+
+                now = time.monotonic()
+                fsync_due = self.fsync_interval_seconds is not None and now - last_fsync >= self.fsync_interval_seconds
+                if fsync_due or closing:
+                    for file in self._files.values():
+                        file.flush()
+                        os.fsync(file.fileno())
+                    last_fsync = now
+
+                if closing:
+                    for file in self._files.values():
+                        file.close()
+                    return
+            except OSError as e:
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                for file in self._files.values():
+                    file.close()
+                return